@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Send many ARM management requests as a few ARM batch calls.
+
+ARM's batch endpoint (POST /batch) takes up to MAX_BATCH_SIZE requests at a
+time and answers with one response per request. send() splits a list of
+(method, url, body) requests into batches, sends them concurrently over an
+azhttp.HTTPClient and hands back one azhttp.Response per request, in
+order. Reading fifty VMs' instance views, deleting a fleet's NICs or
+polling its deployments then costs a handful of HTTPS requests instead of
+one each.
+
+Sub-requests that come back throttled or with a transient server error are
+sent again in a later batch, after the longest Retry-After they asked for.
+Other failures are returned as responses with their status, not raised, so
+one missing resource doesn't fail the rest. A large batch ARM accepts with
+202 is followed through azlro.
+"""
+import concurrent.futures
+import http
+import json
+import time
+import urllib.parse
+
+import azhttp
+import azlro
+
+BATCH_API_VERSION = "2020-06-01"
+MAX_BATCH_SIZE = 20
+# Batches sent at once
+MAX_PARALLEL_BATCHES = 4
+BATCH_RETRIES = 3
+
+
+def batch_url(url):
+    """The batch endpoint on the same host as a request URL."""
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/batch?api-version={BATCH_API_VERSION}"
+
+
+def _relative(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def _response(url, item):
+    status = item.get("httpStatusCode", 500)
+    try:
+        reason = http.HTTPStatus(status).phrase
+    except ValueError:
+        reason = ""
+    headers = {k.lower(): str(v) for k, v in (item.get("headers") or {}).items()}
+    content = item.get("content")
+    body = json.dumps(content).encode() if content is not None else b""
+    return azhttp.Response(url, status, reason, headers, body)
+
+
+def _retryable(method, response):
+    return (response.status in azhttp.THROTTLE_STATUSES
+            or (response.status in azhttp.RETRY_STATUSES and method in azhttp.IDEMPOTENT_METHODS))
+
+
+def _send_batch(client, requests, headers, timeout):
+    payload = {"requests": []}
+    for i, (method, url, body) in enumerate(requests):
+        entry = {"httpMethod": method, "url": _relative(url), "name": str(i)}
+        if body is not None:
+            entry["content"] = body
+        payload["requests"].append(entry)
+    response = client.request("POST", batch_url(requests[0][1]), headers=headers, body=payload)
+    result = azlro.wait(client, response, headers, method="POST", timeout=timeout)
+    responses = [None] * len(requests)
+    for n, item in enumerate(result.get("responses", [])):
+        i = int(item.get("name", n))
+        responses[i] = _response(requests[i][1], item)
+    # A request the batch didn't answer is treated like a server error, so it is retried
+    return [r or azhttp.Response(requests[i][1], 503, "Missing from batch", {}, b"")
+            for i, r in enumerate(responses)]
+
+
+def send(client, requests, headers=None, timeout=azlro.DEFAULT_TIMEOUT):
+    """Send (method, url, body) requests in batches; returns their Responses in order.
+
+    body is None for requests without one. Raises azhttp.HTTPError (or
+    another azhttp.REQUEST_ERRORS) only when a whole batch call fails.
+    """
+    if not requests:
+        return []
+    requests = [(method.upper(), url, body) for method, url, body in requests]
+    responses = [None] * len(requests)
+    todo = list(range(len(requests)))
+    for attempt in range(BATCH_RETRIES + 1):
+        groups = {}
+        for i in todo:
+            groups.setdefault(batch_url(requests[i][1]), []).append(i)
+        chunks = [ids[n:n + MAX_BATCH_SIZE] for ids in groups.values() for n in range(0, len(ids), MAX_BATCH_SIZE)]
+        if len(chunks) == 1:
+            results = [_send_batch(client, [requests[i] for i in chunks[0]], headers, timeout)]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(chunks), MAX_PARALLEL_BATCHES)) as pool:
+                results = list(pool.map(lambda ids: _send_batch(client, [requests[i] for i in ids], headers, timeout),
+                                        chunks))
+        todo = []
+        hints = []
+        for ids, batch in zip(chunks, results):
+            for i, response in zip(ids, batch):
+                responses[i] = response
+                if _retryable(requests[i][0], response):
+                    todo.append(i)
+                    hints.append(azhttp.retry_after(response.headers))
+        if not todo or attempt == BATCH_RETRIES:
+            break
+        known = [h for h in hints if h is not None]
+        time.sleep(azhttp.backoff_delay(attempt, max(known) if known else None))
+    return responses
+
+
+def get_json(client, urls, headers=None):
+    """GET many URLs; returns each JSON body, or None for the ones that failed."""
+    responses = send(client, [("GET", url, None) for url in urls], headers)
+    return [response.json() if response.ok else None for response in responses]
+
+
+def poller(client, headers=None):
+    """A send(urls) for azlro.poll_due that polls operations through batches."""
+    return lambda urls: send(client, [("GET", url, None) for url in urls], headers)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Persistent on-disk response cache for builddb.py.
+
+Entries are keyed by the full request URL (which carries the region and the
+OData $filter) and stored as a small metadata file plus the gzipped raw body.
+When the server handed out an ETag or Last-Modified the entry is revalidated
+with If-None-Match / If-Modified-Since; otherwise it is served until its TTL
+expires.
+
+CachedClient / AsyncCachedClient wrap azhttp clients and expose the same
+get_json() / get_bytes() calls, so the scrape code does not need to know a
+cache exists.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import azhttp
+
+DEFAULT_CACHE_DIR = os.path.join("data", "cache")
+DEFAULT_TTL = 12 * 3600
+MANIFEST_FILE = "regions.json"
+
+
+def _atomic_write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ResponseCache:
+    """Directory of cached GET responses with TTL and validator metadata."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".meta.json", base + ".body.gz"
+
+    def lookup(self, url):
+        """Return the metadata dict for url, or None if not cached."""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+        return meta
+
+    def is_fresh(self, meta, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() - meta.get("fetched_at", 0) < ttl
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load_body(self, url):
+        _, body_path = self._paths(url)
+        with gzip.open(body_path, "rb") as f:
+            return f.read()
+
+    def store(self, url, response):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            "url": url,
+            "fetched_at": time.time(),
+            "etag": response.header("etag"),
+            "last_modified": response.header("last-modified"),
+        }
+        _atomic_write(body_path, gzip.compress(response.body, compresslevel=1))
+        _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def touch(self, url, meta):
+        """Mark a revalidated (304) entry as fresh again."""
+        meta_path, _ = self._paths(url)
+        meta = dict(meta, fetched_at=time.time())
+        _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+
+    # Per-region bookkeeping for --incremental
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.cache_dir, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        path = os.path.join(self.cache_dir, MANIFEST_FILE)
+        _atomic_write(path, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+    def stats(self):
+        return f"{self.hits} fresh hits, {self.revalidated} revalidated (304), {self.misses} fetched"
+
+
+class CachedClient:
+    """azhttp.HTTPClient wrapper that serves get_json() / get_bytes() through a ResponseCache."""
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.client.close()
+
+    def get_json(self, url, headers=None, ttl=None):
+        body = self.get_bytes(url, headers, ttl)
+        return json.loads(body) if body else {}
+
+    def get_bytes(self, url, headers=None, ttl=None):
+        cache = self.cache
+        meta = cache.lookup(url)
+        if meta is not None and cache.is_fresh(meta, ttl):
+            cache.hits += 1
+            return cache.load_body(url)
+
+        send_headers = dict(headers or {})
+        if meta is not None:
+            send_headers.update(cache.conditional_headers(meta))
+        try:
+            response = self.client.get(url, headers=send_headers)
+        except azhttp.HTTPError as e:
+            if e.status == 304 and meta is not None:
+                cache.revalidated += 1
+                cache.touch(url, meta)
+                return cache.load_body(url)
+            raise
+        cache.misses += 1
+        cache.store(url, response)
+        return response.body
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncCachedClient:
+    """AsyncHTTPClient counterpart of CachedClient."""
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.client.close()
+
+    async def get_json(self, url, headers=None, ttl=None):
+        body = await self.get_bytes(url, headers, ttl)
+        return json.loads(body) if body else {}
+
+    async def get_bytes(self, url, headers=None, ttl=None):
+        cache = self.cache
+        meta = cache.lookup(url)
+        if meta is not None and cache.is_fresh(meta, ttl):
+            cache.hits += 1
+            return cache.load_body(url)
+
+        send_headers = dict(headers or {})
+        if meta is not None:
+            send_headers.update(cache.conditional_headers(meta))
+        try:
+            response = await self.client.get(url, headers=send_headers)
+        except azhttp.HTTPError as e:
+            if e.status == 304 and meta is not None:
+                cache.revalidated += 1
+                cache.touch(url, meta)
+                return cache.load_body(url)
+            raise
+        cache.misses += 1
+        cache.store(url, response)
+        return response.body
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,666 @@
+#!/usr/bin/env python3
+"""Pooled keep-alive HTTP client for the Azure REST endpoints.
+
+Standard library only (http.client), same as builddb.py. One pool of
+persistent connections is kept per (scheme, host, port), so repeated calls to
+management.azure.com and prices.azure.com reuse TLS sessions instead of paying
+a handshake per page.
+
+AsyncHTTPClient is the asyncio flavour used by `builddb.py --engine async`:
+a minimal HTTP/1.1 client on asyncio streams with a global in-flight budget
+and a per-host connection limit.
+
+Both clients retry throttled (429/503), transient 5xx and dropped-connection
+failures with jittered exponential backoff, honouring Retry-After. Each host
+also gets an AIMD concurrency limit: it creeps up by one slot per window of
+successful requests and halves when the host throttles us (or when ARM's
+x-ms-ratelimit-remaining-* quota runs low), so a large worker count speeds a
+scrape up instead of getting it throttled.
+
+Pass metrics= (an azmetrics.BuildMetrics, or anything with record_request
+and record_retry) to have every attempt's latency, size and status recorded,
+and recorder= (an azreplay.Recorder) to keep every successful GET response
+for offline replay.
+"""
+import asyncio
+import email.utils
+import gzip
+import http.client
+import json
+import queue
+import random
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_IN_FLIGHT = 64
+USER_AGENT = "azure-vm-optimizer/1.0"
+
+# Retry policy
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+THROTTLE_STATUSES = frozenset({429, 503})
+# Failures where the request may have been processed are only retried for these
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+# An ARM x-ms-ratelimit-remaining-* value below this counts as being throttled
+LOW_QUOTA = 10
+
+# Errors that mean a reused keep-alive socket was closed by the server.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class HTTPError(Exception):
+    """Raised for non-2xx responses. Carries the full Response."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status
+        super().__init__(f"HTTP {response.status} {response.reason} for {response.url}")
+
+
+# Everything a request can raise that callers usually treat as "no data".
+REQUEST_ERRORS = (
+    HTTPError,
+    OSError,
+    ValueError,
+    http.client.HTTPException,
+    asyncio.TimeoutError,
+    asyncio.IncompleteReadError,
+)
+
+
+class Response:
+    """A fully read HTTP response (body already decompressed)."""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def json(self):
+        if not self.body:
+            return {}
+        return json.loads(self.body)
+
+
+def retry_after(headers):
+    """Seconds the server asked us to wait (Retry-After or x-ms-retry-after-ms), or None."""
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    value = headers.get("x-ms-retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    return None
+
+
+def remaining_quota(headers):
+    """Lowest ARM x-ms-ratelimit-remaining-* value on a response, or None.
+
+    Resource-provider quotas look like "Microsoft.Compute/HighCostGet3Min;107".
+    """
+    lowest = None
+    for name, value in headers.items():
+        if not name.startswith("x-ms-ratelimit-remaining-"):
+            continue
+        for part in value.split(","):
+            try:
+                left = int(part.rsplit(";", 1)[-1])
+            except ValueError:
+                continue
+            lowest = left if lowest is None else min(lowest, left)
+    return lowest
+
+
+def backoff_delay(attempt, hint=None):
+    """Full-jitter exponential backoff; a server hint is a floor, not a target."""
+    if hint is not None:
+        # Spread the retries a little so they don't all land at the same instant
+        return hint * random.uniform(1.0, 1.25)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+class AIMDLimit:
+    """Adaptive concurrency limit for one host (additive increase, multiplicative decrease).
+
+    Pure bookkeeping: the sync and async pools wrap it with their own lock
+    and wait primitive.
+    """
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._last_cut = float("-inf")
+
+    def can_start(self, now):
+        return self.in_flight < int(self.limit) and now >= self.paused_until
+
+    def wait_time(self, now):
+        """How long a blocked caller should sleep before checking again (None: until notified)."""
+        return self.paused_until - now if now < self.paused_until else None
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self, now, started, pause=None):
+        self.throttled += 1
+        # Halve at most once per generation of requests: the ones already in
+        # flight when the first 429 lands would otherwise collapse the limit to 1
+        if started >= self._last_cut:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_cut = now
+        if pause:
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def assess(self, started, method, status, headers, attempt, retries):
+        """Feed a response to a request sent at `started` into the limit.
+
+        Returns the delay before a retry, or None.
+        """
+        now = time.monotonic()
+        if status in THROTTLE_STATUSES:
+            hint = retry_after(headers)
+            delay = backoff_delay(attempt, hint)
+            # A Retry-After applies to the whole host, not just this request
+            self.on_throttle(now, started, hint)
+        elif 200 <= status < 400:
+            quota = remaining_quota(headers)
+            if quota is not None and quota < LOW_QUOTA:
+                self.on_throttle(now, started)
+            else:
+                self.on_success()
+            return None
+        elif status in RETRY_STATUSES and method in IDEMPOTENT_METHODS:
+            delay = backoff_delay(attempt)
+        else:
+            return None
+        return delay if attempt < retries else None
+
+
+def _decode_body(raw, encoding):
+    if not encoding or not raw:
+        return raw
+    encoding = encoding.lower()
+    if encoding == "gzip":
+        return gzip.decompress(raw)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(raw)
+        except zlib.error:
+            return zlib.decompress(raw, -zlib.MAX_WBITS)
+    return raw
+
+
+def _prepare(url, headers, body):
+    """Split a URL and build the outgoing headers/body for a request."""
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme or "https"
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+
+    send_headers = {
+        "Accept-Encoding": "gzip, deflate",
+        "User-Agent": USER_AGENT,
+        "Connection": "keep-alive",
+    }
+    if headers:
+        send_headers.update(headers)
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode("utf-8")
+        send_headers.setdefault("Content-Type", "application/json")
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    return scheme, parts.hostname, port, path, send_headers, body
+
+
+def _rate_stats(retried, pools):
+    throttled = sum(pool.limit.throttled for pool in pools.values())
+    limits = ", ".join(f"{key[1]} {pool.limit.limit:.0f}/{pool.limit.maximum}"
+                       for key, pool in sorted(pools.items()))
+    return f"{retried} retries, {throttled} throttled responses (concurrency: {limits or 'n/a'})"
+
+
+class HostPool:
+    """Bounded pool of keep-alive connections to a single host."""
+
+    def __init__(self, scheme, host, port, size, timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.limit = AIMDLimit(size)
+        self._gate = threading.Condition()
+
+    def enter(self):
+        """Wait until the host's adaptive limit (and any Retry-After pause) admits a request."""
+        with self._gate:
+            while not self.limit.can_start(time.monotonic()):
+                self._gate.wait(self.limit.wait_time(time.monotonic()))
+            self.limit.in_flight += 1
+        return time.monotonic()
+
+    def leave(self, started, method=None, status=None, headers=None, attempt=0, retries=0):
+        """Release the admission slot; with a response, update the limit and return the retry delay."""
+        with self._gate:
+            self.limit.in_flight -= 1
+            delay = None
+            if status is not None:
+                delay = self.limit.assess(started, method, status, headers, attempt, retries)
+            self._gate.notify_all()
+        return delay
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """Block until a slot is free, then return (connection, reused)."""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def release(self, conn, reusable=True):
+        if reusable:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class HTTPClient:
+    """Thread-safe HTTP client with per-host keep-alive pools and gzip.
+
+    pool_size bounds the number of concurrent connections (and so in-flight
+    requests) per host; callers beyond that block until a connection is free,
+    or until the host's adaptive limit lets them in.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 metrics=None, recorder=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.retried = 0
+        self.metrics = metrics
+        self.recorder = recorder
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _pool_for(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = HostPool(scheme, host, port, self.pool_size, self.timeout)
+                self._pools[key] = pool
+            return pool
+
+    def _send_once(self, pool, method, path, send_headers, body):
+        # A reused socket may have been closed by the server while idle;
+        # retry exactly once on a fresh connection in that case.
+        for attempt in range(2):
+            conn, reused = pool.acquire()
+            try:
+                conn.request(method, path, body=body, headers=send_headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except STALE_CONNECTION_ERRORS:
+                pool.release(conn, reusable=False)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                pool.release(conn, reusable=False)
+                raise
+            pool.release(conn, reusable=not resp.will_close)
+            return resp, raw
+
+    def request(self, method, url, headers=None, body=None):
+        """Send a request and return a Response. Raises HTTPError on non-2xx.
+
+        Throttling, transient server errors and network failures are retried
+        up to self.retries times with backoff before the error is raised.
+        """
+        scheme, hostname, port, path, send_headers, body = _prepare(url, headers, body)
+        pool = self._pool_for(scheme, hostname, port)
+        attempt = 0
+        while True:
+            started = pool.enter()
+            try:
+                resp, raw = self._send_once(pool, method, path, send_headers, body)
+                if self.metrics is not None:
+                    self.metrics.record_request(hostname, time.monotonic() - started, len(raw), resp.status)
+            except (OSError, http.client.HTTPException):
+                pool.leave(started)
+                if attempt >= self.retries or method not in IDEMPOTENT_METHODS:
+                    raise
+                delay = backoff_delay(attempt)
+            except BaseException:
+                pool.leave(started)
+                raise
+            else:
+                resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+                delay = pool.leave(started, method, resp.status, resp_headers, attempt, self.retries)
+                if delay is None:
+                    break
+            with self._lock:
+                self.retried += 1
+            if self.metrics is not None:
+                self.metrics.record_retry(hostname)
+            time.sleep(delay)
+            attempt += 1
+
+        data = _decode_body(raw, resp_headers.get("content-encoding"))
+        response = Response(url, resp.status, resp.reason, resp_headers, data)
+        if not response.ok:
+            raise HTTPError(response)
+        if self.recorder is not None and method == "GET":
+            self.recorder.record(url, response)
+        return response
+
+    def get(self, url, headers=None):
+        return self.request("GET", url, headers=headers)
+
+    def get_json(self, url, headers=None):
+        return self.get(url, headers=headers).json()
+
+    def get_bytes(self, url, headers=None):
+        """Decompressed body of a GET, for callers that parse it elsewhere."""
+        return self.get(url, headers=headers).body
+
+    def rate_stats(self):
+        return _rate_stats(self.retried, self._pools)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+class AsyncHostPool:
+    """Idle keep-alive stream pairs to one host, bounded by a semaphore."""
+
+    def __init__(self, scheme, host, port, size, timeout, ssl_context):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.limit = AIMDLimit(size)
+        self._gate = asyncio.Condition()
+
+    async def enter(self):
+        async with self._gate:
+            while not self.limit.can_start(time.monotonic()):
+                wait = self.limit.wait_time(time.monotonic())
+                try:
+                    await asyncio.wait_for(self._gate.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            self.limit.in_flight += 1
+        return time.monotonic()
+
+    async def leave(self, started, method=None, status=None, headers=None, attempt=0, retries=0):
+        async with self._gate:
+            self.limit.in_flight -= 1
+            delay = None
+            if status is not None:
+                delay = self.limit.assess(started, method, status, headers, attempt, retries)
+            self._gate.notify_all()
+        return delay
+
+    async def acquire(self):
+        await self._slots.acquire()
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        try:
+            ssl_ctx = self.ssl_context if self.scheme == "https" else None
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=ssl_ctx),
+                self.timeout,
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable=True):
+        if reusable:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        self._slots.release()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+async def _read_body(reader, headers, method, status):
+    """Read a response body. Returns (raw, reusable)."""
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        return b"", True
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip trailers up to the terminating blank line
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return b"".join(chunks), True
+    length = headers.get("content-length")
+    if length is not None:
+        return await reader.readexactly(int(length)), True
+    return await reader.read(), False
+
+
+class AsyncHTTPClient:
+    """asyncio HTTP/1.1 client with keep-alive, gzip and two concurrency caps.
+
+    max_in_flight bounds requests across all hosts; per_host bounds open
+    connections (and so in-flight requests) to any single host, and is the
+    ceiling for that host's adaptive limit.
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, per_host=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, metrics=None, recorder=None):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.retried = 0
+        self.metrics = metrics
+        self.recorder = recorder
+        self._budget = asyncio.Semaphore(max_in_flight)
+        self._pools = {}
+        self._ssl = ssl.create_default_context()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _pool_for(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = AsyncHostPool(scheme, host, port, self.per_host, self.timeout, self._ssl)
+            self._pools[key] = pool
+        return pool
+
+    async def _send(self, reader, writer, method, host, path, headers, body):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        if body is not None or method in ("POST", "PUT", "PATCH"):
+            lines.append(f"Content-Length: {len(body or b'')}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise http.client.RemoteDisconnected("connection closed before response")
+            parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+            status = int(parts[1])
+            reason = parts[2] if len(parts) > 2 else ""
+            resp_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                resp_headers[name.strip().lower()] = value.strip()
+            if status != 100:
+                break
+        raw, reusable = await _read_body(reader, resp_headers, method, status)
+        if resp_headers.get("connection", "").lower() == "close":
+            reusable = False
+        return status, reason, resp_headers, raw, reusable
+
+    async def _send_once(self, pool, method, host, path, send_headers, body):
+        for attempt in range(2):
+            reader, writer, reused = await pool.acquire()
+            try:
+                result = await asyncio.wait_for(
+                    self._send(reader, writer, method, host, path, send_headers, body),
+                    self.timeout,
+                )
+            except STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,):
+                pool.release(reader, writer, reusable=False)
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                pool.release(reader, writer, reusable=False)
+                raise
+            status, reason, resp_headers, raw, reusable = result
+            pool.release(reader, writer, reusable=reusable)
+            return status, reason, resp_headers, raw
+
+    async def request(self, method, url, headers=None, body=None):
+        """Send a request and return a Response. Raises HTTPError on non-2xx.
+
+        Retries like HTTPClient.request, sleeping without holding a slot.
+        """
+        scheme, hostname, port, path, send_headers, body = _prepare(url, headers, body)
+        host = hostname if port in (80, 443) else f"{hostname}:{port}"
+        pool = self._pool_for(scheme, hostname, port)
+        attempt = 0
+        while True:
+            started = await pool.enter()
+            try:
+                async with self._budget:
+                    sent = time.monotonic()
+                    status, reason, resp_headers, raw = await self._send_once(
+                        pool, method, host, path, send_headers, body)
+                if self.metrics is not None:
+                    self.metrics.record_request(hostname, time.monotonic() - sent, len(raw), status)
+            except (OSError, http.client.HTTPException, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                await pool.leave(started)
+                if attempt >= self.retries or method not in IDEMPOTENT_METHODS:
+                    raise
+                delay = backoff_delay(attempt)
+            except BaseException:
+                await pool.leave(started)
+                raise
+            else:
+                delay = await pool.leave(started, method, status, resp_headers, attempt, self.retries)
+                if delay is None:
+                    break
+            self.retried += 1
+            if self.metrics is not None:
+                self.metrics.record_retry(hostname)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        data = _decode_body(raw, resp_headers.get("content-encoding"))
+        response = Response(url, status, reason, resp_headers, data)
+        if not response.ok:
+            raise HTTPError(response)
+        if self.recorder is not None and method == "GET":
+            self.recorder.record(url, response)
+        return response
+
+    async def get(self, url, headers=None):
+        return await self.request("GET", url, headers=headers)
+
+    async def get_json(self, url, headers=None):
+        return (await self.get(url, headers=headers)).json()
+
+    async def get_bytes(self, url, headers=None):
+        return (await self.get(url, headers=headers)).body
+
+    def rate_stats(self):
+        return _rate_stats(self.retried, self._pools)
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Follow Azure Resource Manager long-running operations to completion.
+
+ARM answers a PUT, PATCH, POST or DELETE on anything slow (deployments, VM
+power actions, disk updates) with 201/202 and tells the caller where to
+watch it:
+
+- Azure-AsyncOperation: an operation status resource whose "status" goes
+  InProgress -> Succeeded | Failed | Canceled, with "error" on failure.
+- Location: answers 202 while the operation runs and 200/204 (with the
+  result, if any) once it is done; a failure comes back as an error status.
+- Neither: a PUT/PATCH whose body carries a non-terminal
+  properties.provisioningState is followed by re-reading the resource.
+
+wait() follows whichever the response offers, sleeping for the server's
+Retry-After when it sends one and otherwise backing off from POLL_INITIAL to
+POLL_MAX, and returns as soon as the operation reaches a terminal state. A
+failed or cancelled operation raises OperationFailed with ARM's error.
+wait_all() follows many operations (e.g. a fleet of deployments) from one
+polling loop, each on its own schedule.
+Requests go through an azhttp.HTTPClient, so throttling and transient
+errors on the polls themselves are retried there.
+"""
+import concurrent.futures
+import http.client
+import time
+
+import azhttp
+
+TERMINAL_STATES = ("succeeded", "failed", "canceled")
+# Without a Retry-After hint, poll after 1 s, then back off by half each time up to 10 s
+POLL_INITIAL = 1.0
+POLL_MAX = 10.0
+POLL_FACTOR = 1.5
+DEFAULT_TIMEOUT = 1800
+# Status polls sent at once when several operations are due together
+POLL_WORKERS = 8
+
+
+class OperationFailed(Exception):
+    """A long-running operation ended Failed or Canceled, or polling it failed."""
+
+    def __init__(self, message, status=None, error=None):
+        super().__init__(message)
+        self.status = status
+        self.error = error or {}
+
+
+class OperationTimeout(OperationFailed):
+    """The operation had not finished before the deadline."""
+
+
+def error_message(body):
+    """Readable "code: message" text from an ARM error body (top-level or under "error")."""
+    error = body.get("error", body) if isinstance(body, dict) else {}
+    code = error.get("code", "")
+    message = error.get("message", "")
+    for detail in error.get("details") or ():
+        message = f"{message} {detail.get('code', '')}: {detail.get('message', '')}".strip()
+    return f"{code}: {message}" if code else message
+
+
+def provisioning_state(body):
+    return ((body or {}).get("properties") or {}).get("provisioningState")
+
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+class Operation:
+    """Polling state of one long-running operation; poll() advances it by one request.
+
+    Built from the response to the request that started the operation.
+    done is set once it reaches a terminal state, with the final body in
+    result or an OperationFailed in error. next_poll is when it should be
+    polled next: the server's Retry-After, else a growing backoff.
+    """
+
+    def __init__(self, client, response, headers=None, method="PUT", name=None):
+        self.client = client
+        self.headers = headers
+        self.method = method
+        self.name = name
+        self.url = response.url
+        self.operation_url = response.header("azure-asyncoperation")
+        self.location = response.header("location")
+        self.status = "InProgress"
+        self.done = False
+        self.result = None
+        self.error = None
+        self.delay = POLL_INITIAL
+        self.started = time.monotonic()
+        self.polls = 0
+        if self.operation_url:
+            self.mode = "operation"
+        elif self.location and response.status == 202:
+            self.mode = "location"
+        else:
+            self.mode = "provisioning"
+            body = _json(response)
+            state = provisioning_state(body)
+            if method not in ("PUT", "PATCH") or not state or state.lower() in TERMINAL_STATES:
+                self._provisioned(state, body)
+                return
+        self._schedule(response)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def _schedule(self, response=None):
+        hint = azhttp.retry_after(response.headers) if response is not None else None
+        delay = hint if hint is not None else self.delay
+        self.delay = min(POLL_MAX, self.delay * POLL_FACTOR)
+        self.next_poll = time.monotonic() + delay
+
+    def _finish(self, result=None, error=None):
+        self.done = True
+        self.result = result
+        self.error = error
+
+    def _provisioned(self, state, body):
+        if state and state.lower() != "succeeded":
+            self._finish(error=OperationFailed(f"Provisioning {state}: {error_message(body)}", state,
+                                               body.get("error")))
+        else:
+            self._finish(result=body)
+
+    def _outcome(self, operation):
+        if self.method in ("PUT", "PATCH"):
+            # The status resource only says it worked; the resource has the outcome
+            return _json(self.client.get(self.url, headers=self.headers))
+        if self.location and self.method != "DELETE":
+            return _json(self.client.get(self.location, headers=self.headers))
+        # A deleted resource has nothing left to read
+        return operation.get("properties", {})
+
+    def poll_url(self):
+        """Where the next status request goes."""
+        if self.mode == "operation":
+            return self.operation_url
+        if self.mode == "location":
+            return self.location
+        return self.url
+
+    def poll(self):
+        """Send the next status request; returns the status it reported."""
+        try:
+            response = self.client.get(self.poll_url(), headers=self.headers)
+        except azhttp.HTTPError as e:
+            response = e.response
+        except (OSError, http.client.HTTPException):
+            # The client already retried; try again at the next poll
+            response = None
+        return self.update(response)
+
+    def update(self, response):
+        """Apply the response to a status request sent some other way (e.g. azbatch).
+
+        response is None when the request itself failed; the operation is
+        then simply polled again later. Returns the status.
+        """
+        self.polls += 1
+        try:
+            if response is None:
+                pass
+            elif not response.ok:
+                raise azhttp.HTTPError(response)
+            elif self.mode == "operation":
+                operation = _json(response)
+                self.status = operation.get("status", "InProgress")
+                if self.status.lower() == "succeeded":
+                    self._finish(result=self._outcome(operation))
+                elif self.status.lower() in TERMINAL_STATES:
+                    self._finish(error=OperationFailed(f"Operation {self.status}: {error_message(operation)}",
+                                                       self.status, operation.get("error")))
+            elif self.mode == "location":
+                self.location = response.header("location") or self.location
+                self.status = "InProgress" if response.status == 202 else "Succeeded"
+                if response.status != 202:
+                    self._finish(result=_json(response))
+            else:
+                body = _json(response)
+                self.status = provisioning_state(body)
+                if not self.status or self.status.lower() in TERMINAL_STATES:
+                    self._provisioned(self.status, body)
+        except azhttp.HTTPError as e:
+            failure = _json(e.response)
+            self.status = "Failed"
+            self._finish(error=OperationFailed(f"Operation failed: HTTP {e.status} {error_message(failure)}",
+                                               "Failed", failure.get("error")))
+        except (OSError, http.client.HTTPException):
+            response = None
+        if not self.done:
+            self._schedule(response)
+        return self.status
+
+    def timed_out(self):
+        what = "Provisioning" if self.mode == "provisioning" else "Operation"
+        self._finish(error=OperationTimeout(f"{what} still running after {self.elapsed():.0f}s", self.status))
+
+
+def poll_due(operations, deadline, on_poll=None, send=None):
+    """Sleep until the earliest running operation is due, then poll every due one.
+
+    Due operations are polled concurrently, or all in one go through
+    send(urls) -> [response or None] when given (see azbatch.poller).
+    on_poll(operation) is called after each poll. Operations that would
+    next be polled after the deadline (time.monotonic() based) end with an
+    OperationTimeout.
+    Returns whether any operation is still running, so a caller can start
+    more operations between rounds.
+    """
+    running = [op for op in operations if not op.done]
+    if not running:
+        return False
+    for op in running:
+        if op.next_poll > deadline:
+            op.timed_out()
+    running = [op for op in running if not op.done]
+    if not running:
+        return False
+    time.sleep(max(0.0, min(op.next_poll for op in running) - time.monotonic()))
+    now = time.monotonic()
+    due = [op for op in running if op.next_poll <= now]
+    if send is not None:
+        try:
+            responses = send([op.poll_url() for op in due])
+        except (OperationFailed, *azhttp.REQUEST_ERRORS, http.client.HTTPException):
+            responses = [None] * len(due)
+        for op, response in zip(due, responses):
+            op.update(response)
+    elif len(due) == 1:
+        due[0].poll()
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(due), POLL_WORKERS)) as executor:
+            list(executor.map(Operation.poll, due))
+    if on_poll is not None:
+        for op in due:
+            on_poll(op)
+    return any(not op.done for op in operations)
+
+
+def wait_all(operations, timeout=DEFAULT_TIMEOUT, on_poll=None):
+    """Follow several operations from one polling loop until all are done; returns them.
+
+    Failures don't stop the others; check each operation's error.
+    """
+    deadline = time.monotonic() + timeout
+    while poll_due(operations, deadline, on_poll):
+        pass
+    return operations
+
+
+def wait(client, response, headers=None, method="PUT", timeout=DEFAULT_TIMEOUT, on_poll=None):
+    """Wait for the operation a request started; returns the final resource or result body.
+
+    response is what the initial request returned. on_poll(status, elapsed)
+    is called after every poll, e.g. to print progress.
+    """
+    operation = Operation(client, response, headers, method)
+    report = None
+    if on_poll is not None:
+        report = lambda op: on_poll(op.status, op.elapsed())
+    wait_all([operation], timeout, report)
+    if operation.error is not None:
+        raise operation.error
+    return operation.result
+
+
+def run(client, method, url, headers=None, body=None, timeout=DEFAULT_TIMEOUT, on_poll=None):
+    """Send an ARM request and wait for the operation it starts. Returns the final body.
+
+    Errors on the initial request raise azhttp.HTTPError as usual.
+    """
+    response = client.request(method, url, headers=headers, body=body)
+    return wait(client, response, headers, method, timeout, on_poll)
+
+
+def progress_dots(status, elapsed):
+    """on_poll callback printing a dot per poll, like the old fixed-interval loops."""
+    print(".", end="", flush=True)
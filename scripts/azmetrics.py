@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Build metrics for builddb.py.
+
+BuildMetrics collects, thread-safely:
+
+- time per stage (startup, sku_catalog, prices, merge, write, finalize);
+  per-region stages are summed over concurrent workers, so they can exceed
+  the build's wall time,
+- per-host request latency (histogram and percentiles), bytes received,
+  status codes and retries, fed by the azhttp clients,
+- per-region price page timings and record counts.
+
+report() turns that into a JSON-serialisable dict; --metrics writes it to a
+file and --progress prints a live one-line status while regions complete.
+"""
+import bisect
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SLOWEST_REGIONS = 10
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class BuildMetrics:
+    """Counters and timings for one build."""
+
+    def __init__(self, live=False, stream=sys.stdout):
+        self.live = live
+        self.stream = stream
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}          # name -> [seconds, count]
+        self.hosts = {}           # host -> {"latencies": [...], "bytes": n, "statuses": {...}, "retries": n}
+        self.regions = {}         # region -> {"pages": n, "page_seconds": s, "max_page": s, ...}
+        self.records = 0
+        self.regions_done = 0
+        self.regions_total = 0
+
+    # -- stages --------------------------------------------------------
+    def add_stage(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    # -- HTTP (called by azhttp clients) ---------------------------------
+    def _host(self, host):
+        entry = self.hosts.get(host)
+        if entry is None:
+            entry = self.hosts[host] = {"latencies": [], "bytes": 0, "statuses": {}, "retries": 0}
+        return entry
+
+    def record_request(self, host, seconds, nbytes, status):
+        with self._lock:
+            entry = self._host(host)
+            entry["latencies"].append(seconds)
+            entry["bytes"] += nbytes
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+    def record_retry(self, host):
+        with self._lock:
+            self._host(host)["retries"] += 1
+
+    # -- regions -------------------------------------------------------
+    def _region(self, region):
+        entry = self.regions.get(region)
+        if entry is None:
+            entry = self.regions[region] = {"pages": 0, "page_seconds": 0.0, "max_page": 0.0,
+                                            "seconds": 0.0, "records": 0}
+        return entry
+
+    def record_page(self, region, seconds):
+        with self._lock:
+            entry = self._region(region)
+            entry["pages"] += 1
+            entry["page_seconds"] += seconds
+            entry["max_page"] = max(entry["max_page"], seconds)
+
+    def record_region(self, region, seconds):
+        """Wall time from a region's first price request until its prices were in.
+
+        A region's price types are fetched as separate units side by side, so
+        it took as long as its slowest one.
+        """
+        with self._lock:
+            entry = self._region(region)
+            entry["seconds"] = max(entry["seconds"], seconds)
+
+    def region_done(self, region, records):
+        with self._lock:
+            if records is not None:
+                self._region(region)["records"] += records
+                self.records += records
+            self.regions_done += 1
+        if self.live:
+            self.stream.write("\r" + self.progress_line())
+            self.stream.flush()
+            if self.regions_done == self.regions_total:
+                self.stream.write("\n")
+
+    # -- reporting -----------------------------------------------------
+    def totals(self):
+        with self._lock:
+            requests = sum(len(h["latencies"]) for h in self.hosts.values())
+            nbytes = sum(h["bytes"] for h in self.hosts.values())
+            retries = sum(h["retries"] for h in self.hosts.values())
+        return requests, nbytes, retries
+
+    def progress_line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        requests, nbytes, retries = self.totals()
+        return (f"[{self.regions_done}/{self.regions_total}] {requests} req "
+                f"({requests / elapsed:.0f}/s), {nbytes / 1e6:.1f} MB, {retries} retries, "
+                f"{self.records} records ({self.records / elapsed:.0f}/s)")
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            hosts = {}
+            for host, entry in sorted(self.hosts.items()):
+                latencies = sorted(entry["latencies"])
+                counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+                for seconds in latencies:
+                    counts[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+                labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+                hosts[host] = {
+                    "requests": len(latencies),
+                    "bytes": entry["bytes"],
+                    "retries": entry["retries"],
+                    "statuses": {str(k): v for k, v in sorted(entry["statuses"].items())},
+                    "latency_ms": {
+                        "p50": round(_percentile(latencies, 0.50) * 1000, 1),
+                        "p90": round(_percentile(latencies, 0.90) * 1000, 1),
+                        "p99": round(_percentile(latencies, 0.99) * 1000, 1),
+                        "max": round((latencies[-1] if latencies else 0) * 1000, 1),
+                        "histogram": dict(zip(labels, counts)),
+                    },
+                }
+            regions = {r: dict(e, page_seconds=round(e["page_seconds"], 3), max_page=round(e["max_page"], 3),
+                               seconds=round(e["seconds"], 3))
+                       for r, e in sorted(self.regions.items())}
+            stages = {name: {"seconds": round(sec, 3), "count": count}
+                      for name, (sec, count) in self.stages.items()}
+            records = self.records
+        requests = sum(h["requests"] for h in hosts.values())
+        slowest = sorted(regions, key=lambda r: regions[r]["seconds"], reverse=True)[:SLOWEST_REGIONS]
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "records": records,
+            "records_per_second": round(records / elapsed, 1) if elapsed else 0.0,
+            "requests": requests,
+            "requests_per_second": round(requests / elapsed, 1) if elapsed else 0.0,
+            "bytes": sum(h["bytes"] for h in hosts.values()),
+            "retries": sum(h["retries"] for h in hosts.values()),
+            "stages": stages,
+            "hosts": hosts,
+            "slowest_regions": slowest,
+            "regions": regions,
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """A few human-readable lines for the end of a build."""
+        report = self.report()
+        lines = [f"Metrics: {report['requests']} requests ({report['requests_per_second']}/s), "
+                 f"{report['bytes'] / 1e6:.1f} MB, {report['retries']} retries, "
+                 f"{report['records_per_second']} records/s"]
+        stages = ", ".join(f"{name} {s['seconds']:.2f}s" for name, s in report["stages"].items())
+        if stages:
+            lines.append(f"  stages (summed over concurrent workers): {stages}")
+        for host, h in report["hosts"].items():
+            lat = h["latency_ms"]
+            lines.append(f"  {host}: {h['requests']} req, p50 {lat['p50']}ms, p90 {lat['p90']}ms, "
+                         f"p99 {lat['p99']}ms, max {lat['max']}ms")
+        if report["slowest_regions"]:
+            slow = ", ".join(f"{r} {report['regions'][r]['seconds']:.2f}s"
+                             for r in report["slowest_regions"][:3])
+            lines.append(f"  slowest regions: {slow}")
+        return "\n".join(lines)
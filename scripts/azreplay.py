@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""Record Azure responses once, replay them offline.
+
+builddb.py --record DIR saves every ARM / retail-price response it receives
+into DIR. This module can then serve that recording (or a synthetic one) as
+a local stand-in for management.azure.com and prices.azure.com, with knobs
+for latency, page size and throttling, so builds can be benchmarked and
+debugged without touching Azure:
+
+    python3 scripts/builddb.py --no-cache --record data/recording
+    python3 scripts/azreplay.py synth data/recording --regions 60 --skus 300
+    python3 scripts/azreplay.py serve data/recording --port 8765 --latency 40 --throttle-rate 0.02
+    ARM_ACCESS_TOKEN=replay ARM_SUBSCRIPTION_ID=<from the recording> \\
+        python3 scripts/builddb.py --endpoint http://127.0.0.1:8765 --no-cache
+
+Retail price pages are stitched back into one item list per query and
+re-paged with $skip on the fly, so --page-size can differ from the recorded
+one and speculative page prefetching past the end gets an empty page, like
+the real API.
+"""
+import argparse
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+INDEX_FILE = "index.json"
+PRICES_PATH = "/api/retail/prices"
+DEFAULT_SUBSCRIPTION = "00000000-0000-0000-0000-000000000000"
+# Absolute links inside recorded bodies (nextLink, NextPageLink) point at Azure
+AZURE_LINK_RE = re.compile(rb"https://(?:management\.azure\.com|prices\.azure\.com)(?::443)?")
+REGION_RE = re.compile(r"armRegionName eq '([^']+)'")
+PRICE_TYPE_RE = re.compile(r"priceType eq '([^']+)'")
+
+
+def request_key(url):
+    """Host-independent key for a request: path plus its sorted query parameters."""
+    parts = urllib.parse.urlsplit(url)
+    params = sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    return parts.path + ("?" + urllib.parse.urlencode(params) if params else "")
+
+
+class Recorder:
+    """azhttp recorder hook: keeps every successful response body on disk."""
+
+    def __init__(self, directory, meta=None):
+        self.directory = directory
+        self.meta = dict(meta or {})
+        self.index = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, url, response):
+        key = request_key(url)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json.gz"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(gzip.compress(response.body, compresslevel=6))
+        with self._lock:
+            self.index[key] = name
+
+    def close(self):
+        with self._lock:
+            data = {"meta": dict(self.meta, recorded_at=time.time()), "responses": self.index}
+        with open(os.path.join(self.directory, INDEX_FILE), "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+
+class Recording:
+    """A recorded (or synthesized) set of responses, loaded into memory."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            data = json.load(f)
+        self.meta = data.get("meta", {})
+        self.responses = {}
+        for key, name in data["responses"].items():
+            with gzip.open(os.path.join(directory, name), "rb") as f:
+                self.responses[key] = f.read()
+        self._index_prices()
+
+    def _index_prices(self):
+        # Stitch each price query's pages together: {query key without $skip: items}
+        pages = {}
+        for key, body in self.responses.items():
+            parts = urllib.parse.urlsplit(key)
+            if parts.path != PRICES_PATH:
+                continue
+            params = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+            skip = int(dict(params).get("$skip", 0))
+            query = tuple(sorted(p for p in params if p[0] != "$skip"))
+            pages.setdefault(query, []).append((skip, json.loads(body)))
+        self.prices = {}
+        self.prices_by_region = {}
+        self.page_size = None
+        for query, recorded in pages.items():
+            recorded.sort(key=lambda page: page[0])
+            items = [item for _, page in recorded for item in page.get("Items", [])]
+            self.prices[query] = items
+            region = price_query_region(dict(query))
+            if region:
+                self.prices_by_region.setdefault(region, items)
+            if self.page_size is None and recorded[0][1].get("Items"):
+                self.page_size = len(recorded[0][1]["Items"])
+        self.page_size = self.page_size or 100
+
+    def price_items(self, params):
+        """All items for a price query; queries with other filters fall back to the region's items
+        of the same priceType and currency."""
+        query = tuple(sorted(p for p in params if p[0] != "$skip"))
+        if query in self.prices:
+            return self.prices[query]
+        region = price_query_region(dict(params))
+        if region:
+            return self.prices_by_region.get(region)
+        return None
+
+
+def price_query_region(params):
+    """(region, priceType, currency) a retail price query asks for, or None."""
+    odata = params.get("$filter", "")
+    region = REGION_RE.search(odata)
+    if not region:
+        return None
+    price_type = PRICE_TYPE_RE.search(odata)
+    # USD is what the API returns without a currencyCode
+    currency = params.get("currencyCode", "").strip("'").upper() or "USD"
+    return region.group(1), price_type.group(1) if price_type else "Consumption", currency
+
+
+# Rough exchange rates for synthetic multi-currency recordings
+SYNTH_RATES = {"USD": 1.0, "INR": 83.0, "EUR": 0.92, "GBP": 0.79, "JPY": 150.0}
+
+
+def convert_meter(item, rate, currency):
+    """A synthetic meter priced in another currency."""
+    item = dict(item, unitPrice=round(item["unitPrice"] * rate, 4), currencyCode=currency)
+    if "savingsPlan" in item:
+        item["savingsPlan"] = [dict(plan, unitPrice=round(plan["unitPrice"] * rate, 4))
+                               for plan in item["savingsPlan"]]
+    return item
+
+
+def synthesize(directory, regions=20, skus=200, pages=10, page_size=100, subscriptions=(DEFAULT_SUBSCRIPTION,),
+               currencies=("USD",), seed=1):
+    """Write a synthetic recording shaped like a real build's responses.
+
+    Every subscription gets its own locations list and SKU catalog; all but
+    the first have a random tenth of their (SKU, region) pairs restricted.
+    Each currency gets the same meters, converted with SYNTH_RATES. Regions
+    have Linux, Windows, Spot and Low Priority meters with savings plans,
+    plus a fifth as many pages of 1 and 3 year reservations.
+    """
+    import builddb
+
+    rng = random.Random(seed)
+    subscriptions = list(subscriptions)
+    recorder = Recorder(directory, {"subscription": subscriptions[0], "subscriptions": subscriptions,
+                                    "currencies": list(currencies), "synthetic": True})
+
+    class Body:
+        def __init__(self, data):
+            self.body = json.dumps(data).encode("utf-8")
+
+    names = [f"region{i:02d}" for i in range(regions)]
+    sku_names = [f"Standard_D{i}s_v{1 + i % 5}" for i in range(1, skus + 1)]
+    shapes = {name: 2 ** (i % 7) for i, name in enumerate(sku_names, 1)}
+    ram_factor = {name: rng.choice((2, 4, 8)) for name in sku_names}
+    per_page = 50
+    for n, subscription in enumerate(subscriptions):
+        recorder.record(builddb.locations_url(subscription),
+                        Body({"value": [{"name": r, "metadata": {"regionType": "Physical"}} for r in names]}))
+        catalog_url = builddb.sku_catalog_url(subscription)
+        for start in range(0, len(sku_names), per_page):
+            value = []
+            for name in sku_names[start:start + per_page]:
+                restricted = [r for r in names if n and rng.random() < 0.1]
+                value.append({
+                    "name": name, "resourceType": "virtualMachines", "locations": names,
+                    "restrictions": [{"type": "Location", "values": restricted}] if restricted else [],
+                    "capabilities": [{"name": "vCPUs", "value": str(shapes[name])},
+                                     {"name": "MemoryGB", "value": str(shapes[name] * ram_factor[name])}],
+                })
+            body = {"value": value}
+            if start + per_page < len(sku_names):
+                body["nextLink"] = f"{catalog_url}&page={start // per_page + 1}"
+            url = catalog_url if start == 0 else f"{catalog_url}&page={start // per_page}"
+            recorder.record(url, Body(body))
+
+    def consumption_meter(region):
+        price = round(rng.uniform(0.005, 5.0), 4)
+        sku_label = rng.choice(("D2s v3", "D2s v3", "D2s v3 Spot", "D2s v3 Low Priority"))
+        meter = {"armSkuName": rng.choice(sku_names), "armRegionName": region, "unitPrice": price,
+                 "type": "Consumption", "skuName": sku_label,
+                 "productName": rng.choice(("Virtual Machines D Series", "Virtual Machines D Series Windows"))}
+        if sku_label == "D2s v3":
+            meter["savingsPlan"] = [{"term": "1 Year", "unitPrice": round(price * 0.8, 4)},
+                                    {"term": "3 Years", "unitPrice": round(price * 0.6, 4)}]
+        return meter
+
+    def reservation_meter(region):
+        term, years, discount = rng.choice((("1 Year", 1, 0.65), ("3 Years", 3, 0.45)))
+        return {"armSkuName": rng.choice(sku_names), "armRegionName": region, "type": "Reservation",
+                "reservationTerm": term, "skuName": "D2s v3", "productName": "Virtual Machines D Series",
+                "unitPrice": round(rng.uniform(0.005, 5.0) * discount * years * 365 * 24, 2)}
+
+    for region in names:
+        for price_type, count, meter in (("Consumption", pages, consumption_meter),
+                                         ("Reservation", max(1, pages // 5), reservation_meter)):
+            meters = [[meter(region) for _ in range(page_size)] for _ in range(count)]
+            for currency in currencies:
+                # USD is what the API returns without a currencyCode
+                price_filter = builddb.PriceFilter(currency=None if currency == "USD" else currency,
+                                                   price_type=price_type)
+                first = builddb.prices_url(region, price_filter)
+                rate = SYNTH_RATES.get(currency, 1.0)
+                for page, items in enumerate(meters):
+                    items = [convert_meter(item, rate, currency) for item in items]
+                    next_link = f"{first}&$skip={(page + 1) * page_size}" if page + 1 < count else None
+                    url = first if page == 0 else f"{first}&$skip={page * page_size}"
+                    recorder.record(url, Body({"Items": items, "NextPageLink": next_link, "Count": len(items)}))
+    recorder.close()
+    return recorder
+
+
+class ReplayServer(http.server.ThreadingHTTPServer):
+    """Serves a Recording with injected latency, re-paging and throttling."""
+
+    daemon_threads = True
+    # Builds open dozens of connections at once; the default backlog of 5
+    # makes the kernel drop SYNs and adds a 1 s retransmit to some requests
+    request_queue_size = 256
+
+    def __init__(self, recording, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, page_size=None,
+                 throttle_rate=0.0, max_concurrency=0, retry_after=1.0, seed=None):
+        super().__init__((host, port), ReplayHandler)
+        self.recording = recording
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size or recording.page_size
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "not_found": 0, "bytes": 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread; returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def body_for(self, path):
+        """Response body for a request path, or None if it was never recorded."""
+        parts = urllib.parse.urlsplit(path)
+        if parts.path == PRICES_PATH:
+            params = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+            items = self.recording.price_items(params)
+            if items is None:
+                return None
+            skip = int(dict(params).get("$skip", 0))
+            page = items[skip:skip + self.page_size]
+            next_link = None
+            if skip + self.page_size < len(items):
+                rest = [p for p in params if p[0] != "$skip"] + [("$skip", str(skip + self.page_size))]
+                next_link = f"{self.base_url}{PRICES_PATH}?{urllib.parse.urlencode(rest, quote_via=urllib.parse.quote)}"
+            return json.dumps({"Items": page, "NextPageLink": next_link, "Count": len(page)}).encode("utf-8")
+        body = self.recording.responses.get(request_key(path))
+        if body is None:
+            return None
+        return AZURE_LINK_RE.sub(self.base_url.encode("ascii"), body)
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.stats["requests"] += 1
+            throttle = ((server.max_concurrency and server.in_flight > server.max_concurrency)
+                        or server.random.random() < server.throttle_rate)
+        try:
+            if server.latency or server.jitter:
+                time.sleep(server.latency + server.random.uniform(0, server.jitter))
+            if throttle:
+                with server.lock:
+                    server.stats["throttled"] += 1
+                self._send(429, b'{"error":{"code":"TooManyRequests"}}', {"Retry-After": f"{server.retry_after:g}"})
+                return
+            body = server.body_for(self.path)
+            if body is None:
+                with server.lock:
+                    server.stats["not_found"] += 1
+                self._send(404, b'{"error":{"code":"NotRecorded"}}')
+                return
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, b"", {"ETag": etag})
+                return
+            self._send(200, body, {"ETag": etag})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send(self, status, body, headers=None):
+        if body and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.stats["bytes"] += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve or synthesize recorded Azure responses for builddb.py.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    srv = sub.add_parser("serve", help="Replay a recording as a local Azure stand-in")
+    srv.add_argument("recording")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8765)
+    srv.add_argument("--latency", type=float, default=0, help="Per-request latency in ms")
+    srv.add_argument("--jitter", type=float, default=0, help="Extra random latency, up to this many ms")
+    srv.add_argument("--page-size", type=int, help="Retail price page size (default: as recorded)")
+    srv.add_argument("--throttle-rate", type=float, default=0, help="Fraction of requests answered with 429")
+    srv.add_argument("--max-concurrency", type=int, default=0,
+                     help="Answer 429 whenever more requests than this are in flight (0: no limit)")
+    srv.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on injected 429s")
+
+    syn = sub.add_parser("synth", help="Write a synthetic recording (no Azure access needed)")
+    syn.add_argument("recording")
+    syn.add_argument("--regions", type=int, default=20)
+    syn.add_argument("--skus", type=int, default=200)
+    syn.add_argument("--pages", type=int, default=10, help="Price pages per region")
+    syn.add_argument("--page-size", type=int, default=100)
+    syn.add_argument("--subscription", dest="subscriptions", action="append", default=[],
+                     help=f"Repeatable (default {DEFAULT_SUBSCRIPTION})")
+    syn.add_argument("--currency", dest="currencies", action="append", default=[],
+                     help=f"Repeatable, one of {', '.join(SYNTH_RATES)} (default USD)")
+
+    args = parser.parse_args(argv)
+    if args.command == "synth":
+        subscriptions = args.subscriptions or [DEFAULT_SUBSCRIPTION]
+        recorder = synthesize(args.recording, args.regions, args.skus, args.pages, args.page_size,
+                              subscriptions, [c.upper() for c in args.currencies] or ["USD"])
+        print(f"Wrote {len(recorder.index)} responses to {args.recording} "
+              f"(subscriptions {', '.join(subscriptions)}).")
+        return
+
+    recording = Recording(args.recording)
+    server = ReplayServer(recording, args.host, args.port, args.latency / 1000, args.jitter / 1000,
+                          args.page_size, args.throttle_rate, args.max_concurrency, args.retry_after)
+    print(f"Replaying {len(recording.responses)} responses from {args.recording} on {server.base_url}")
+    print(f"  ARM_ACCESS_TOKEN=replay ARM_SUBSCRIPTION_ID={recording.meta.get('subscription', '?')} "
+          f"python3 scripts/builddb.py --endpoint {server.base_url} --no-cache")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n{server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Shared ARM access tokens for the build, deployment and debug scripts.
+
+get_token() returns a bearer token for management.azure.com: ARM_ACCESS_TOKEN
+if the caller already has one, otherwise one of two identities:
+
+- a Service Principal (ARM_CLIENT_ID / ARM_CLIENT_SECRET / ARM_TENANT_ID),
+  via the v2 client-credentials endpoint, or
+- the logged-in az CLI account (`az account get-access-token`).
+
+Tokens are cached on disk (ARM_TOKEN_CACHE, default
+~/.cache/azure-vm-optimizer/tokens.json, mode 0600) keyed by identity and
+scope, and refreshed REFRESH_MARGIN seconds before they expire. Chained
+scripts therefore pay for one login, not one per script, and never start the
+az CLI while a cached token is still good.
+
+Usage:
+    python3 scripts/aztoken.py            # show cached tokens and their expiry
+    python3 scripts/aztoken.py --clear    # forget every cached token
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.parse
+from urllib import request, error
+
+MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+LOGIN_URL = "https://login.microsoftonline.com"
+TOKEN_CACHE_FILE = os.environ.get(
+    "ARM_TOKEN_CACHE", os.path.expanduser("~/.cache/azure-vm-optimizer/tokens.json"))
+# Treat a token as expired this long before it really is, so a long build or
+# deployment never starts with one that lapses halfway through
+REFRESH_MARGIN = 5 * 60
+LOGIN_TIMEOUT = 30
+AZURE_DIR = os.path.expanduser("~/.azure")
+
+# In-process copy of the cache, so repeated calls don't re-read the file
+_memo = {}
+
+
+class TokenError(Exception):
+    """Raised when no token could be obtained."""
+
+
+def _load_cache():
+    if not TOKEN_CACHE_FILE:
+        return {}
+    try:
+        with open(TOKEN_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    if not TOKEN_CACHE_FILE:
+        return
+    directory = os.path.dirname(TOKEN_CACHE_FILE) or "."
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tokens-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, TOKEN_CACHE_FILE)
+    except OSError:
+        # A read-only home directory only costs us the cache, not the token
+        pass
+
+
+def _cached(key):
+    entry = _memo.get(key) or _load_cache().get(key)
+    if entry and entry["expires_at"] - REFRESH_MARGIN > time.time():
+        _memo[key] = entry
+        return entry["access_token"]
+    return None
+
+
+def _remember(key, token, expires_at):
+    entry = {"access_token": token, "expires_at": expires_at}
+    _memo[key] = entry
+    cache = _load_cache()
+    # Drop anything that has expired while we're rewriting the file anyway
+    now = time.time()
+    cache = {k: v for k, v in cache.items() if v.get("expires_at", 0) > now}
+    cache[key] = entry
+    _save_cache(cache)
+
+
+def _fetch_sp_token(client_id, client_secret, tenant_id, scope):
+    url = f"{LOGIN_URL}/{tenant_id}/oauth2/v2.0/token"
+    data = urllib.parse.urlencode({
+        "grant_type": "client_credentials",
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "scope": scope,
+    }).encode("utf-8")
+    try:
+        with request.urlopen(request.Request(url, data=data), timeout=LOGIN_TIMEOUT) as response:
+            result = json.load(response)
+    except error.HTTPError as e:
+        raise TokenError(f"Service Principal login failed: {e.code} {e.read().decode(errors='replace')}") from e
+    except (OSError, ValueError) as e:
+        raise TokenError(f"Service Principal login failed: {e}") from e
+    return result["access_token"], time.time() + int(result.get("expires_in", 3600))
+
+
+def _parse_cli_expiry(result):
+    # Newer CLIs report a POSIX timestamp, older ones only local time
+    if result.get("expires_on"):
+        return float(result["expires_on"])
+    expires_on = result.get("expiresOn", "")
+    try:
+        return datetime.datetime.fromisoformat(expires_on).timestamp()
+    except ValueError:
+        return time.time() + 3600
+
+
+def _run_az(args, env=None):
+    try:
+        result = subprocess.run(args, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, env=env)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout
+
+
+def _fetch_cli_token(tenant_id, scope):
+    args = ["az", "account", "get-access-token", "--scope", scope, "-o", "json"]
+    if tenant_id:
+        args += ["--tenant", tenant_id]
+    output = _run_az(args)
+    if output is None:
+        # ~/.azure is sometimes not writable for the CLI; retry on a copy
+        temp_dir = tempfile.mkdtemp(prefix="az_token_tmp_")
+        try:
+            for fname in ["msal_token_cache.json", "azureProfile.json", "clouds.config", "config"]:
+                src = os.path.join(AZURE_DIR, fname)
+                if os.path.exists(src):
+                    shutil.copy(src, temp_dir)
+            output = _run_az(args, env=dict(os.environ, AZURE_CONFIG_DIR=temp_dir))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    if output is None:
+        raise TokenError("az account get-access-token failed. Run 'az login' first.")
+    try:
+        result = json.loads(output)
+        return result["accessToken"], _parse_cli_expiry(result)
+    except (ValueError, KeyError, TypeError) as e:
+        raise TokenError(f"az account get-access-token returned unexpected output: {e}") from e
+
+
+def sp_token(client_id, client_secret, tenant_id, scope=MANAGEMENT_SCOPE, force=False):
+    """Token for a Service Principal, from the cache when still fresh."""
+    if not client_id or not client_secret or not tenant_id:
+        raise TokenError("ARM_CLIENT_ID, ARM_CLIENT_SECRET and ARM_TENANT_ID must be set.")
+    key = f"sp:{tenant_id}:{client_id}:{scope}"
+    token = None if force else _cached(key)
+    if token is None:
+        token, expires_at = _fetch_sp_token(client_id, client_secret, tenant_id, scope)
+        _remember(key, token, expires_at)
+    return token
+
+
+def _cli_default_account():
+    """The az CLI's default subscription entry from azureProfile.json, or None."""
+    config_dir = os.environ.get("AZURE_CONFIG_DIR", AZURE_DIR)
+    try:
+        # The CLI writes this file with a BOM
+        with open(os.path.join(config_dir, "azureProfile.json"), encoding="utf-8-sig") as f:
+            profile = json.load(f)
+        for sub in profile.get("subscriptions", []):
+            if sub.get("isDefault"):
+                return sub
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def cli_token(tenant_id=None, scope=MANAGEMENT_SCOPE, force=False):
+    """Token for the logged-in az CLI account, from the cache when still fresh.
+
+    The cache entry is tied to the CLI's signed-in user and default
+    subscription, so an `az login` as someone else doesn't reuse it.
+    """
+    account = _cli_default_account() or {}
+    user = (account.get("user") or {}).get("name", "")
+    key = f"cli:{user}:{account.get('id', '')}:{tenant_id or ''}:{scope}"
+    token = None if force else _cached(key)
+    if token is None:
+        token, expires_at = _fetch_cli_token(tenant_id, scope)
+        _remember(key, token, expires_at)
+    return token
+
+
+def get_token(client_id=None, client_secret=None, tenant_id=None, scope=MANAGEMENT_SCOPE, force=False):
+    """Token for the Service Principal if one is configured, else the az CLI account.
+
+    Arguments default to the ARM_* environment variables at call time. A
+    token handed over in ARM_ACCESS_TOKEN wins over both.
+    """
+    if os.environ.get("ARM_ACCESS_TOKEN") and not force:
+        return os.environ["ARM_ACCESS_TOKEN"]
+    client_id = client_id or os.environ.get("ARM_CLIENT_ID", "")
+    client_secret = client_secret or os.environ.get("ARM_CLIENT_SECRET", "")
+    tenant_id = tenant_id or os.environ.get("ARM_TENANT_ID", "")
+    if client_id and client_secret:
+        return sp_token(client_id, client_secret, tenant_id, scope, force)
+    return cli_token(tenant_id or None, scope, force)
+
+
+def subscription_id():
+    """ARM_SUBSCRIPTION_ID, else the az CLI's default subscription, or None.
+
+    The CLI default is read straight from azureProfile.json; `az account show`
+    is only started when the profile can't be read.
+    """
+    if os.environ.get("ARM_SUBSCRIPTION_ID"):
+        return os.environ["ARM_SUBSCRIPTION_ID"]
+    account = _cli_default_account()
+    if account and account.get("id"):
+        return account["id"]
+    output = _run_az(["az", "account", "show", "--query", "id", "-o", "tsv"])
+    return output.strip() if output else None
+
+
+def clear():
+    """Forget every cached token."""
+    _memo.clear()
+    if TOKEN_CACHE_FILE:
+        try:
+            os.remove(TOKEN_CACHE_FILE)
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the shared ARM token cache.")
+    parser.add_argument("--clear", action="store_true", help="Delete every cached token")
+    args = parser.parse_args(argv)
+    if args.clear:
+        clear()
+        print(f"Cleared {TOKEN_CACHE_FILE}")
+        return
+    cache = _load_cache()
+    if not cache:
+        print("No cached tokens.")
+    now = time.time()
+    for key, entry in sorted(cache.items()):
+        left = entry["expires_at"] - now
+        state = f"valid for {int(left // 60)} min" if left > 0 else "expired"
+        print(f"{key:<70} {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Offline builddb.py benchmark against an azreplay.py server.
+
+Runs builddb.py once per (engine, concurrency) setting against a local
+replay of a recording, and reports end-to-end build time, peak RSS of the
+build process and requests/s. Nothing talks to Azure, so results are
+repeatable and can be compared against a saved baseline:
+
+    python3 scripts/benchmarks/builddb_bench.py                       # synthetic recording
+    python3 scripts/benchmarks/builddb_bench.py --recording data/recording --latency 40
+    python3 scripts/benchmarks/builddb_bench.py --json bench.json     # save results
+    python3 scripts/benchmarks/builddb_bench.py --baseline bench.json # exit 1 on a regression
+
+Settings are ENGINE:N, where N is --workers for threads and --per-host for
+async (with --max-in-flight 2N).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+import azreplay
+
+DEFAULT_MATRIX = "threads:10,threads:20,threads:40,async:16,async:32,async:64"
+# A setting this much slower than its baseline counts as a regression
+DEFAULT_TOLERANCE = 0.15
+
+
+def builddb_args(setting):
+    engine, _, n = setting.partition(":")
+    n = int(n)
+    if engine == "threads":
+        return ["--engine", "threads", "--workers", str(n)]
+    if engine == "async":
+        return ["--engine", "async", "--per-host", str(n), "--max-in-flight", str(2 * n)]
+    raise ValueError(f"unknown engine in {setting!r} (expected threads:N or async:N)")
+
+
+def run_build(server, subscription, setting, workdir, extra_args=()):
+    """One build; returns {seconds, peak_rss_mb, requests, requests_per_second, records, retries, ok}."""
+    output = os.path.join(workdir, "vms.json")
+    metrics_file = os.path.join(workdir, "metrics.json")
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "builddb.py"), "--endpoint", server.base_url,
+           "--no-cache", "-o", output, "--metrics", metrics_file] + builddb_args(setting) + list(extra_args)
+    env = dict(os.environ, ARM_ACCESS_TOKEN="replay", ARM_SUBSCRIPTION_ID=subscription, ARM_TOKEN_CACHE="")
+    # Every run pays for a first history snapshot, not a growing file
+    history = output + ".history"
+    if os.path.exists(history):
+        os.unlink(history)
+    server.reset_stats()
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    try:
+        with open(metrics_file) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        report = {}
+    requests = server.stats["requests"]
+    return {
+        "seconds": round(seconds, 3),
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        "peak_rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "requests": requests,
+        "requests_per_second": round(requests / seconds, 1),
+        "throttled": server.stats["throttled"],
+        "retries": report.get("retries", 0),
+        "records": report.get("records", 0),
+        "ok": proc.returncode == 0,
+    }
+
+
+def summarize(runs):
+    """Median time and rate, worst RSS over repeated runs of one setting."""
+    return {
+        "seconds": statistics.median(r["seconds"] for r in runs),
+        "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+        "requests_per_second": statistics.median(r["requests_per_second"] for r in runs),
+        "requests": runs[-1]["requests"],
+        "retries": max(r["retries"] for r in runs),
+        "records": runs[-1]["records"],
+        "ok": all(r["ok"] for r in runs),
+        "runs": len(runs),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Settings whose build time regressed beyond tolerance against the baseline."""
+    regressions = []
+    for setting, result in results.items():
+        before = baseline.get(setting)
+        if before and result["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(f"{setting}: {before['seconds']:.2f}s -> {result['seconds']:.2f}s "
+                               f"(+{(result['seconds'] / before['seconds'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark builddb.py offline against a replayed recording.")
+    parser.add_argument("--recording", help="Directory from builddb.py --record (default: a synthetic one)")
+    parser.add_argument("--regions", type=int, default=40, help="Regions in the synthetic recording")
+    parser.add_argument("--pages", type=int, default=10, help="Price pages per region in the synthetic recording")
+    parser.add_argument("--matrix", default=DEFAULT_MATRIX, help=f"Comma-separated ENGINE:N settings (default {DEFAULT_MATRIX})")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per setting; the median is reported")
+    parser.add_argument("--latency", type=float, default=30, help="Replay latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=20, help="Extra random latency, up to this many ms")
+    parser.add_argument("--page-size", type=int, help="Retail price page size to replay with")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 above this many concurrent requests")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Allowed slowdown against --baseline (default {DEFAULT_TOLERANCE:.0%})")
+    args, extra = parser.parse_known_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="builddb_bench_") as workdir:
+        recording_dir = args.recording
+        if recording_dir is None:
+            recording_dir = os.path.join(workdir, "recording")
+            azreplay.synthesize(recording_dir, regions=args.regions, pages=args.pages)
+        recording = azreplay.Recording(recording_dir)
+        subscription = recording.meta.get("subscription", azreplay.DEFAULT_SUBSCRIPTION)
+        server = azreplay.ReplayServer(recording, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                       page_size=args.page_size, throttle_rate=args.throttle_rate,
+                                       max_concurrency=args.max_concurrency, retry_after=args.retry_after,
+                                       seed=1).start()
+        print(f"Replaying {len(recording.responses)} responses on {server.base_url} "
+              f"({args.latency:g}+{args.jitter:g} ms, throttle {args.throttle_rate:g}, "
+              f"max concurrency {args.max_concurrency or 'unlimited'})")
+        print(f"{'setting':<12} {'seconds':>8} {'req/s':>8} {'RSS MB':>7} {'requests':>9} {'retries':>8} {'records':>8}")
+
+        results = {}
+        try:
+            for setting in args.matrix.split(","):
+                setting = setting.strip()
+                runs = [run_build(server, subscription, setting, workdir, extra) for _ in range(args.repeat)]
+                r = results[setting] = summarize(runs)
+                flag = "" if r["ok"] else "  FAILED"
+                print(f"{setting:<12} {r['seconds']:>8.2f} {r['requests_per_second']:>8.1f} {r['peak_rss_mb']:>7.1f} "
+                      f"{r['requests']:>9} {r['retries']:>8} {r['records']:>8}{flag}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if len({r["records"] for r in results.values()}) > 1:
+        print("Warning: settings produced different record counts.")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+    failed = [s for s, r in results.items() if not r["ok"]]
+    if failed:
+        print(f"Error: builds failed for {', '.join(failed)}")
+        sys.exit(1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,134 +1,123 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
 import json
-import subprocess
 import concurrent.futures
+import multiprocessing
 import time
 import sys
-import os
+import re
 import urllib.parse
 
+import azcache
+import azhttp
+import azmetrics
+import aztoken
+import azreplay
+import vmdb
+import vmhistory
+
 # Configuration
 OUTPUT_FILE = "vms.json"
 MAX_WORKERS = 20  # REST API handles concurrency well
-AZURE_DIR = os.path.expanduser("~/.azure")
+HTTP_TIMEOUT = 30
+# Async engine: global in-flight budget, per-host connection cap and how many
+# retail-price pages to request ahead of the last one received.
+MAX_IN_FLIGHT = 64
+PER_HOST_LIMIT = 32
+PRICE_PAGE_WINDOW = 4
+MANAGEMENT_URL = "https://management.azure.com"
+PRICES_BASE_URL = "https://prices.azure.com/api/retail/prices"
+# The region list changes a few times a year; reuse a cached copy for a week
+REGIONS_TTL = 7 * 24 * 3600
+# Retail priceType each pricing tier (vmdb.TIERS) comes from
+TIER_PRICE_TYPES = {"ondemand": "Consumption", "spot": "Consumption", "lowpriority": "Consumption",
+                    "savings1y": "Consumption", "savings3y": "Consumption",
+                    "reserved1y": "Reservation", "reserved3y": "Reservation"}
+# Reservation unitPrice is the cost of the whole term; divide by its hours
+RESERVATION_TERMS = {"1 Year": ("reserved1y", 365 * 24), "3 Years": ("reserved3y", 3 * 365 * 24)}
+# Savings plan prices are already hourly, attached to each Consumption meter
+SAVINGS_PLAN_TERMS = {"1 Year": "savings1y", "3 Years": "savings3y"}
+# Only this API version returns the savingsPlan field
+SAVINGS_PLAN_API_VERSION = "2023-01-01-preview"
 
-def ensure_az_works():
-    """Check if az works, if not try to fix permission issues by using a temp config."""
-    try:
-        subprocess.run("az account show", shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
-    except subprocess.CalledProcessError:
-        print("Initial az check failed. Attempting permission workaround...")
-        # Create temp dir
-        import tempfile
-        import shutil
-        
-        temp_dir = tempfile.mkdtemp(prefix="az_config_tmp_")
-        print(f"Created temp config dir: {temp_dir}")
-        
-        # Copy critical files
-        files_to_copy = ["msal_token_cache.json", "azureProfile.json", "clouds.config", "config"]
-        for fname in files_to_copy:
-             src = os.path.join(AZURE_DIR, fname)
-             if os.path.exists(src):
-                 shutil.copy(src, temp_dir)
-        
-        # Set env var for this process and children
-        os.environ["AZURE_CONFIG_DIR"] = temp_dir
-        
-        # Retry
-        try:
-             subprocess.run("az account show", shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-             print("Workaround successful! Proceeding...")
-             
-             # Register cleanup
-             import atexit
-             def cleanup():
-                 shutil.rmtree(temp_dir, ignore_errors=True)
-             atexit.register(cleanup)
-             
-             return True
-        except subprocess.CalledProcessError as e:
-             print("Workaround failed. Please fix your Azure CLI installation.")
-             return False
-
-def run_command(command, use_shell=True):
-    """Run a shell command and return the output as a string.
-    If command is a list, use_shell should be False (or it's ignored on posix).
-    """
-    try:
-        if isinstance(command, list):
-            use_shell = False
-            
-        result = subprocess.run(
-            command, shell=use_shell, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        # Some regions might fail or have no access, just warn and continue
-        # print(f"Warning: Command failed: {command}\nError: {e.stderr.strip()}", file=sys.stderr)
-        return None
+def get_token_and_subs(subscriptions=()):
+    """Get access token and subscription IDs without going through the az CLI.
 
-def get_token_and_sub():
-    """Get access token and subscription ID."""
+    Both come from the environment or aztoken's on-disk cache when possible;
+    az only runs when there is no cached token to reuse. Without explicit
+    subscriptions the default one (ARM_SUBSCRIPTION_ID or the CLI's) is used.
+    """
     print("Getting access token...")
-    token = run_command("az account get-access-token --query accessToken -o tsv")
-    sub_id = run_command("az account show --query id -o tsv")
-    if not token or not sub_id:
+    try:
+        token = aztoken.get_token()
+    except aztoken.TokenError as e:
+        print(e)
+        token = None
+    subs = list(dict.fromkeys(subscriptions)) or [aztoken.subscription_id()]
+    if not token or not all(subs):
         print("Failed to get token or subscription ID.")
         sys.exit(1)
-    return token, sub_id
+    return token, subs
+
+def locations_url(sub_id):
+    return f"{MANAGEMENT_URL}/subscriptions/{sub_id}/locations?api-version=2022-12-01"
 
-def get_regions():
-    """Get list of all Azure regions."""
-    # We can use az here since it's just one call (or fetch from management API)
+def get_regions(token, sub_id, cache=None, recorder=None):
+    """Get list of all physical Azure regions from the ARM locations endpoint.
+
+    The list barely changes, so a cached copy is reused for REGIONS_TTL.
+    """
     print("Fetching list of regions...")
-    cmd = "az account list-locations --query '[].name' -o tsv"
-    output = run_command(cmd)
-    if not output:
-        return []
-    return output.split()
-
-def get_vm_skus_rest(region, token, sub_id):
-    """Get VM SKUs using REST API."""
-    # Encode the filter properly
-    filter_val = f"location eq '{region}'"
-    filter_enc = urllib.parse.quote(filter_val)
-    url = f"https://management.azure.com/subscriptions/{sub_id}/providers/Microsoft.Compute/skus?api-version=2021-07-01&$filter={filter_enc}"
-    
-    # Use list args to avoid shell quoting hell
-    cmd = [
-        "curl", "-s", "-X", "GET", url,
-        "-H", f"Authorization: Bearer {token}",
-        "-H", "Content-Type: application/json",
-        "--connect-timeout", "10",
-        "--max-time", "30"
-    ]
-    output = run_command(cmd, use_shell=False)
-    if not output:
-        # print(f"DEBUG: No output for {region}")
-        return {}
-    
+    client = azhttp.HTTPClient(pool_size=1, timeout=HTTP_TIMEOUT, recorder=recorder)
+    url = locations_url(sub_id)
     try:
-        data = json.loads(output)
-        items = data.get('value', [])
-        # if not items:
-        #     print(f"DEBUG: Empty items for {region}. Output snippet: {output[:200]}")
-    except json.JSONDecodeError:
-        # print(f"DEBUG: JSON decode error for {region}. Output snippet: {output[:200]}")
-        return {}
+        if cache is not None:
+            data = azcache.CachedClient(client, cache).get_json(url, arm_headers(token), ttl=REGIONS_TTL)
+        else:
+            data = client.get_json(url, arm_headers(token))
+    except azhttp.REQUEST_ERRORS as e:
+        print(f"Failed to list regions: {e}")
+        return []
+    finally:
+        client.close()
+    # Logical locations ("global", "asia", ...) never carry retail prices
+    return [loc['name'] for loc in data.get('value', [])
+            if loc.get('metadata', {}).get('regionType', 'Physical') == 'Physical']
+
+class ScrapeError(Exception):
+    """A request still failed after the HTTP client's retries."""
 
-    sku_map = {}
+def sku_catalog_url(sub_id):
+    """Subscription-wide Compute SKUs endpoint (every region in one listing)."""
+    return f"{MANAGEMENT_URL}/subscriptions/{sub_id}/providers/Microsoft.Compute/skus?api-version=2021-07-01"
+
+def arm_headers(token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+def index_sku_items(items, catalog=None):
+    """Index Compute SKU items as {region: {sku_name: {'vcpu', 'ram'}}}.
+
+    A SKU is left out of a region when it carries a Location restriction for
+    that region, same as the old per-region `location eq` query did.
+    """
+    if catalog is None:
+        catalog = {}
     for item in items:
         name = item.get('name')
         # resourceType should be virtualMachines to ensure it's computable
         if item.get('resourceType') != 'virtualMachines':
             continue
-            
-        restrictions = item.get('restrictions', [])
-        if restrictions and len(restrictions) > 0:
-            if any(r.get('type') == 'Location' for r in restrictions):
-                continue
+
+        locations = [loc.lower() for loc in item.get('locations', [])]
+        restricted = set()
+        for r in item.get('restrictions', []):
+            if r.get('type') == 'Location':
+                # No explicit values means the restriction covers every listed location
+                restricted.update(v.lower() for v in (r.get('values') or locations))
 
         caps = {cap['name']: cap['value'] for cap in item.get('capabilities', [])}
         
@@ -136,110 +125,713 @@ def get_vm_skus_rest(region, token, sub_id):
         ram = caps.get('MemoryGB')
         
         if vcpu and ram:
-            sku_map[name] = {
+            spec = {
                 'vcpu': float(vcpu),
                 'ram': float(ram)
             }
+            for loc in locations:
+                if loc not in restricted:
+                    catalog.setdefault(loc, {})[name] = spec
             
-    return sku_map
+    return catalog
+
+def get_sku_catalog_rest(client, token, sub_id, metrics=None):
+    """Fetch the whole SKU catalog in one paginated pass and index it by region."""
+    start = time.perf_counter()
+    catalog = {}
+    url = sku_catalog_url(sub_id)
+    headers = arm_headers(token)
+    while url:
+        try:
+            data = client.get_json(url, headers=headers)
+        except azhttp.REQUEST_ERRORS as e:
+            raise ScrapeError(f"SKU catalog fetch failed: {e}") from e
+        index_sku_items(data.get('value', []), catalog)
+        url = data.get('nextLink')
+    if metrics is not None:
+        metrics.add_stage('sku_catalog', time.perf_counter() - start)
+    return catalog
+
+class PriceFilter:
+    """Which retail price meters to scrape.
+
+    Positive conditions go into the OData $filter so the API never sends the
+    other meters. Exclusions can't be expressed with the `contains` operator
+    the API is known to support, so every condition is re-checked per item
+    in keep() as pages arrive. One filter covers one priceType; tiers are
+    the vmdb.TIERS kept from it. The OS and Spot conditions only apply to
+    Consumption meters (reservations are OS-independent and never Spot).
+    """
+
+    def __init__(self, os_type="all", spot="all", families=(), currency=None, price_type="Consumption",
+                 tiers=vmdb.TIERS):
+        self.os_type = os_type        # all | linux | windows
+        self.spot = spot              # all | exclude | only
+        self.families = tuple(families)
+        self.currency = currency
+        self.price_type = price_type  # Consumption | Reservation
+        self.tiers = tuple(t for t in tiers if TIER_PRICE_TYPES[t] == price_type)
 
-def get_regional_prices_rest(region):
+    def odata(self, region):
+        clauses = [
+            "serviceName eq 'Virtual Machines'",
+            f"armRegionName eq '{region}'",
+            f"priceType eq '{self.price_type}'",
+        ]
+        if self.os_type == "windows" and self.price_type == "Consumption":
+            clauses.append("contains(productName, 'Windows')")
+        if self.spot == "only" and self.price_type == "Consumption":
+            clauses.append("contains(skuName, 'Spot')")
+        if self.families:
+            families = " or ".join(f"contains(armSkuName, '{f}')" for f in self.families)
+            clauses.append(f"({families})" if len(self.families) > 1 else families)
+        return " and ".join(clauses)
+
+    def currency_code(self):
+        """Currency of the prices this filter fetches."""
+        return (self.currency or vmdb.DEFAULT_CURRENCY).upper()
+
+    def wants_savings_plans(self):
+        return any(t in self.tiers for t in SAVINGS_PLAN_TERMS.values())
+
+    def signature(self):
+        """Stable description of the filter, recorded per region for --incremental."""
+        return (f"os={self.os_type};spot={self.spot};families={','.join(self.families)};"
+                f"currency={self.currency or ''};priceType={self.price_type};tiers={','.join(self.tiers)}")
+
+    def covers(self, key):
+        """Whether a vmhistory series key (region, sku, tier, os, currency) is one this filter fetches."""
+        _, sku, tier, os_name, currency = key
+        if tier not in self.tiers or currency != self.currency_code():
+            return False
+        if self.families and not sku.startswith(self.families):
+            return False
+        # Reservation prices carry no OS
+        return self.os_type == "all" or os_name in ("", self.os_type)
+
+    def keep(self, item):
+        if self.families and not (item.get('armSkuName') or '').startswith(self.families):
+            return False
+        if self.price_type != "Consumption":
+            return True
+        is_windows = 'Windows' in (item.get('productName') or '')
+        if self.os_type == "linux" and is_windows:
+            return False
+        if self.os_type == "windows" and not is_windows:
+            return False
+        sku_label = item.get('skuName') or ''
+        is_spot = 'Spot' in sku_label or 'Low Priority' in sku_label
+        if self.spot == "exclude" and is_spot:
+            return False
+        if self.spot == "only" and 'Spot' not in sku_label:
+            return False
+        return True
+
+DEFAULT_PRICE_FILTER = PriceFilter()
+
+def prices_url(region, price_filter=DEFAULT_PRICE_FILTER):
+    """First page of the retail prices query for a region."""
+    url = f"{PRICES_BASE_URL}?$filter={urllib.parse.quote(price_filter.odata(region))}"
+    if price_filter.wants_savings_plans():
+        url += f"&api-version={SAVINGS_PLAN_API_VERSION}"
+    if price_filter.currency:
+        # The API expects the code quoted, e.g. currencyCode='INR'
+        currency = urllib.parse.quote(f"'{price_filter.currency.upper()}'")
+        url += f"&currencyCode={currency}"
+    return url
+
+def consumption_tier(item):
+    """(tier, os) of a Consumption meter: Spot and Low Priority are their own tiers."""
+    sku_label = item.get('skuName') or ''
+    if 'Spot' in sku_label:
+        tier = 'spot'
+    elif 'Low Priority' in sku_label:
+        tier = 'lowpriority'
+    else:
+        tier = 'ondemand'
+    return tier, 'windows' if 'Windows' in (item.get('productName') or '') else 'linux'
+
+def project_items(items, price_filter):
+    """Keep only wanted meters, trimmed to the (armSkuName, tier, os, hourly price) rows the merge uses.
+
+    A Consumption meter yields its own row plus one per savings plan term;
+    a reservation yields its term price spread over the term's hours, with
+    os None since reservations cover either OS.
+    """
+    rows = []
+    tiers = price_filter.tiers
+    for item in items:
+        unit_price = item.get('unitPrice')
+        if unit_price is None or not price_filter.keep(item):
+            continue
+        sku_name = item.get('armSkuName')
+        if item.get('type') == 'Reservation':
+            tier, hours = RESERVATION_TERMS.get(item.get('reservationTerm'), (None, 0))
+            if tier in tiers:
+                rows.append((sku_name, tier, None, round(unit_price / hours, 6)))
+            continue
+        tier, os_name = consumption_tier(item)
+        if tier in tiers:
+            rows.append((sku_name, tier, os_name, unit_price))
+        for plan in item.get('savingsPlan') or ():
+            tier = SAVINGS_PLAN_TERMS.get(plan.get('term'))
+            if tier in tiers and plan.get('unitPrice') is not None:
+                rows.append((sku_name, tier, os_name, plan['unitPrice']))
+    return rows
+
+def parse_price_page(body, price_filter):
+    """Parse a raw retail price page into (rows, NextPageLink), rows as from project_items.
+
+    Module-level so --parse-workers can run it in a worker process and send
+    back only the compact rows instead of the whole parsed page.
+    """
+    data = json.loads(body) if body else {}
+    return project_items(data.get('Items', []), price_filter), data.get('NextPageLink')
+
+def fetch_price_page(client, url, price_filter, parse_pool=None):
+    """GET one price page and parse it here, or in parse_pool when given."""
+    body = client.get_bytes(url)
+    if parse_pool is None:
+        return parse_price_page(body, price_filter)
+    return parse_pool.submit(parse_price_page, body, price_filter).result()
+
+def record_page(metrics, region, start):
+    """Time one price page (no-op without metrics)."""
+    if metrics is not None:
+        metrics.record_page(region, time.perf_counter() - start)
+
+def get_regional_prices_rest(client, region, price_filter=DEFAULT_PRICE_FILTER, metrics=None, parse_pool=None):
     """Fetch retail prices for Virtual Machines in a region using REST API (public)."""
-    base_url = "https://prices.azure.com/api/retail/prices"
-    filter_str = f"serviceName eq 'Virtual Machines' and armRegionName eq '{region}' and priceType eq 'Consumption'"
-    filter_enc = urllib.parse.quote(filter_str)
-    
-    items = []
-    url = f"{base_url}?$filter={filter_enc}"
+    rows = []
+    url = prices_url(region, price_filter)
     
     while url:
-        cmd = ["curl", "-s", url, "--connect-timeout", "10", "--max-time", "30"]
-        output = run_command(cmd, use_shell=False)
-        if not output:
-            break
-            
-        try:
-            data = json.loads(output)
-            items.extend(data.get('Items', []))
-            url = data.get('NextPageLink')
-        except json.JSONDecodeError:
-            break
+        start = time.perf_counter()
+        page_rows, url = fetch_price_page(client, url, price_filter, parse_pool)
+        record_page(metrics, region, start)
+        rows.extend(page_rows)
             
-    return items
+    return rows
+
+def dedupe_rows(price_rows):
+    """One price per (armSkuName, tier, os).
+
+    A region can list several meters for the same SKU and tier (e.g. a
+    product's old and new meter); the cheapest non-zero one wins, so the
+    result doesn't depend on page order.
+    """
+    best = {}
+    for sku_name, tier, os_name, price in price_rows:
+        key = (sku_name, tier, os_name)
+        current = best.get(key)
+        if current is None or (price <= 0, price) < (current <= 0, current):
+            best[key] = price
+    return [key + (price,) for key, price in best.items()]
+
+def merge_region(region, sku_specs, price_rows, **keys):
+    """Join deduplicated (armSkuName, tier, os, price) rows onto SKU specs, one record per row.
 
-def process_region(region, token, sub_id):
-    """Process a single region: fetch SKUs, fetch prices, merge."""
+    Each SKU's fields are laid out once per region and copied per price row,
+    instead of looking up the spec and building the record field by field.
+    keys (subscription, currency) are added to every record.
+    """
+    templates = {name: {'region': region, 'sku': name, 'vcpu': spec['vcpu'], 'ram': spec['ram'],
+                        'price': None, **keys}
+                 for name, spec in sku_specs.items()}
+    lookup = templates.get
+    records = []
+    for sku_name, tier, os_name, price in price_rows:
+        template = lookup(sku_name)
+        if template is None:
+            continue
+        rec = dict(template, price=float(price), tier=tier)
+        if os_name:
+            rec['os'] = os_name
+        records.append(rec)
+    return records
+
+def merge_subscriptions(region, specs_by_sub, price_rows, currency):
+    """merge_region once per subscription: the public prices are shared, availability is not."""
+    price_rows = dedupe_rows(price_rows)
+    records = []
+    for sub, sku_specs in specs_by_sub.items():
+        records.extend(merge_region(region, sku_specs, price_rows, subscription=sub, currency=currency))
+    return records
+
+def region_specs(catalogs, region):
+    """{subscription: that subscription's SKU specs in region}, for subscriptions offering any."""
+    return {sub: catalog[region] for sub, catalog in catalogs.items() if catalog.get(region)}
+
+def process_region(client, region, specs_by_sub, price_filter=DEFAULT_PRICE_FILTER, metrics=None, parse_pool=None):
+    """Process a single region: fetch prices, merge with each subscription's SKU specs.
+
+    Returns None when the region could not be fetched (after retries), so the
+    caller can tell a failed region from one with no matching VMs.
+    """
     # print(f"Processing {region}...") # overly verbose with many threads
     try:
-        # 1. Get Hardware Specs via REST
-        sku_specs = get_vm_skus_rest(region, token, sub_id)
-        if not sku_specs:
+        # 1. Hardware specs come from the shared catalogs; skip regions with none
+        if not specs_by_sub:
             return []
             
-        # 2. Get Prices via REST
-        price_items = get_regional_prices_rest(region)
-        
-        merged_data = []
-        for p in price_items:
-            sku_name = p.get('armSkuName')
-            unit_price = p.get('unitPrice')
-            
-            if unit_price is None:
-                continue
-                
-            spec = sku_specs.get(sku_name)
-            if spec:
-                merged_data.append({
-                    'region': region,
-                    'sku': sku_name,
-                    'vcpu': spec['vcpu'],
-                    'ram': spec['ram'],
-                    'price': float(unit_price)
-                })
+        # 2. Get Prices via REST (once, whatever the number of subscriptions)
+        start = time.perf_counter()
+        price_rows = get_regional_prices_rest(client, region, price_filter, metrics, parse_pool)
+        currency = price_filter.currency_code()
+        if metrics is None:
+            return merge_subscriptions(region, specs_by_sub, price_rows, currency)
+        metrics.record_region(region, time.perf_counter() - start)
+        metrics.add_stage('prices', time.perf_counter() - start)
+        with metrics.stage('merge'):
+            return merge_subscriptions(region, specs_by_sub, price_rows, currency)
         
-        return merged_data
-        
-    except Exception as e:
+    except azhttp.REQUEST_ERRORS as e:
         print(f"Error processing region {region}: {e}")
+        return None
+
+# ------------------------------------------
+# Async engine
+# ------------------------------------------
+SKIP_RE = re.compile(r"([?&]\$skip=)(\d+)")
+
+def page_skip(url):
+    """Return the $skip offset of a retail prices page link, or None."""
+    m = SKIP_RE.search(url or "")
+    return int(m.group(2)) if m else None
+
+def with_skip(url, skip):
+    return SKIP_RE.sub(lambda m: f"{m.group(1)}{skip}", url, count=1)
+
+async def get_sku_catalog_async(client, token, sub_id, metrics=None):
+    start = time.perf_counter()
+    catalog = {}
+    url = sku_catalog_url(sub_id)
+    headers = arm_headers(token)
+    while url:
+        try:
+            data = await client.get_json(url, headers=headers)
+        except azhttp.REQUEST_ERRORS as e:
+            raise ScrapeError(f"SKU catalog fetch failed: {e}") from e
+        index_sku_items(data.get('value', []), catalog)
+        url = data.get('nextLink')
+    if metrics is not None:
+        metrics.add_stage('sku_catalog', time.perf_counter() - start)
+    return catalog
+
+async def get_sku_catalogs_async(client, token, subs, metrics=None):
+    """{subscription: catalog}, fetched concurrently."""
+    catalogs = await asyncio.gather(*(get_sku_catalog_async(client, token, sub, metrics) for sub in subs))
+    return dict(zip(subs, catalogs))
+
+async def timed_page(client, url, region, metrics, price_filter, parse_pool=None):
+    """Fetch and parse one price page: (rows, NextPageLink).
+
+    Parsing happens on the event loop unless a parse_pool takes it over.
+    """
+    start = time.perf_counter()
+    body = await client.get_bytes(url)
+    if parse_pool is None:
+        page = parse_price_page(body, price_filter)
+    else:
+        page = await asyncio.get_running_loop().run_in_executor(parse_pool, parse_price_page, body, price_filter)
+    record_page(metrics, region, start)
+    return page
+
+async def get_regional_prices_async(client, region, price_filter=DEFAULT_PRICE_FILTER, window=PRICE_PAGE_WINDOW,
+                                    metrics=None, parse_pool=None):
+    """Fetch all price pages for a region.
+
+    The retail API pages with a plain $skip offset, so once the first page
+    reveals the page size the next `window` pages are requested concurrently
+    instead of strictly following NextPageLink one hop at a time.
+    """
+    rows, next_link = await timed_page(client, prices_url(region, price_filter), region, metrics, price_filter,
+                                       parse_pool)
+    page_size = page_skip(next_link)
+
+    if not page_size:
+        # Unknown paging scheme: fall back to following links serially
+        while next_link:
+            page_rows, next_link = await timed_page(client, next_link, region, metrics, price_filter, parse_pool)
+            rows.extend(page_rows)
+        return rows
+
+    skip = page_size
+    while True:
+        urls = [with_skip(next_link, skip + i * page_size) for i in range(window)]
+        pages = await asyncio.gather(*(timed_page(client, u, region, metrics, price_filter, parse_pool)
+                                       for u in urls))
+        for page_rows, page_next in pages:
+            rows.extend(page_rows)
+            if not page_next:
+                return rows
+        skip += window * page_size
+
+async def process_region_async(client, region, catalog_task, price_filter=DEFAULT_PRICE_FILTER, metrics=None,
+                               parse_pool=None):
+    """Async process_region: price pages are fetched while the catalog loads.
+
+    A catalog failure propagates (it fails every region); a price failure
+    returns None like process_region.
+    """
+    start = time.perf_counter()
+    try:
+        price_rows = await get_regional_prices_async(client, region, price_filter, metrics=metrics,
+                                                     parse_pool=parse_pool)
+    except azhttp.REQUEST_ERRORS as e:
+        print(f"Error processing region {region}: {e}")
+        return None
+    specs_by_sub = region_specs(await catalog_task, region)
+    if not specs_by_sub:
         return []
+    currency = price_filter.currency_code()
+    if metrics is None:
+        return merge_subscriptions(region, specs_by_sub, price_rows, currency)
+    metrics.record_region(region, time.perf_counter() - start)
+    metrics.add_stage('prices', time.perf_counter() - start)
+    with metrics.stage('merge'):
+        return merge_subscriptions(region, specs_by_sub, price_rows, currency)
 
-def main():
-    print(f"Starting Azure VM Database Builder (REST API Optimized)")
-    
-    if not ensure_az_works():
-        sys.exit(1)
-        
-    token, sub_id = get_token_and_sub()
-    
-    start_time = time.time()
-    regions = get_regions()
-    # regions = regions[:5] # uncomment for quick test
-    
-    print(f"Found {len(regions)} regions. Starting parallel processing with {MAX_WORKERS} workers...")
-    
-    all_vms = []
-    processed_count = 0
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_region = {executor.submit(process_region, r, token, sub_id): r for r in regions}
+def catalog_summary(catalogs):
+    entries = sum(len(v) for catalog in catalogs.values() for v in catalog.values())
+    regions = len({r for catalog in catalogs.values() for r in catalog})
+    subs = f"{len(catalogs)} subscription{'s' * (len(catalogs) > 1)}"
+    return f"SKU catalog: {entries} (region, sku) entries across {regions} regions and {subs}."
+
+async def scrape_async(units, token, subs, max_in_flight, per_host, on_region, cache=None,
+                       retries=azhttp.DEFAULT_RETRIES, metrics=None, recorder=None, parse_pool=None):
+    """Run every (region, price_filter) unit on one event loop, handing its records to on_region.
+
+    on_region gets None instead of records for a unit that failed.
+    """
+    http = azhttp.AsyncHTTPClient(max_in_flight=max_in_flight, per_host=per_host, timeout=HTTP_TIMEOUT,
+                                  retries=retries, metrics=metrics, recorder=recorder)
+    client = http
+    if cache is not None:
+        client = azcache.AsyncCachedClient(http, cache)
+    async with client:
+        catalog_task = asyncio.ensure_future(get_sku_catalogs_async(client, token, subs, metrics))
+
+        async def run(unit):
+            region, price_filter = unit
+            return unit, await process_region_async(client, region, catalog_task, price_filter, metrics,
+                                                    parse_pool)
+
+        tasks = [asyncio.ensure_future(run(u)) for u in units]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                unit, data = await fut
+                on_region(unit, data)
+        finally:
+            # A catalog failure surfaces through the first region; stop the rest
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        print(catalog_summary(await catalog_task))
+        print(f"Rate control: {http.rate_stats()}")
+
+# ------------------------------------------
+# Threaded engine
+# ------------------------------------------
+def scrape_threads(units, token, subs, workers, on_region, cache=None, retries=azhttp.DEFAULT_RETRIES,
+                   metrics=None, recorder=None, parse_pool=None):
+    """Run (region, price_filter) units on a thread pool sharing one keep-alive client.
+
+    on_region(unit, records) is called from this thread as each unit
+    completes, with records None for a unit that failed.
+    """
+    # One keep-alive pool per host, sized so every worker can hold a
+    # connection; the host's adaptive limit decides how many actually do
+    http = azhttp.HTTPClient(pool_size=workers, timeout=HTTP_TIMEOUT, retries=retries, metrics=metrics,
+                             recorder=recorder)
+    client = http
+    if cache is not None:
+        client = azcache.CachedClient(http, cache)
+    with client, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        print("Fetching global SKU catalog...")
+        catalogs = dict(zip(subs, executor.map(
+            lambda sub: get_sku_catalog_rest(client, token, sub, metrics), subs)))
+        print(catalog_summary(catalogs))
+        future_to_unit = {executor.submit(process_region, client, region, region_specs(catalogs, region),
+                                          price_filter, metrics, parse_pool): (region, price_filter)
+                          for region, price_filter in units}
         
-        for i, future in enumerate(concurrent.futures.as_completed(future_to_region)):
-            region = future_to_region[future]
+        for future in concurrent.futures.as_completed(future_to_unit):
+            unit = future_to_unit[future]
             try:
                 data = future.result()
-                all_vms.extend(data)
-                processed_count += 1
-                if processed_count % 5 == 0 or processed_count == len(regions):
-                    print(f"[{processed_count}/{len(regions)}] Processed {region} ({len(data)} VMs found)...")
             except Exception as exc:
-                print(f"{region} generated an exception: {exc}")
+                print(f"{unit[0]} generated an exception: {exc}")
+                data = None
+            on_region(unit, data)
+        print(f"Rate control: {http.rate_stats()}")
+
+# ------------------------------------------
+# Incremental rebuilds
+# ------------------------------------------
+def unit_key(region, currency, price_type):
+    """Key of a (region, currency, priceType) unit in the manifest and in load_existing_db."""
+    return f"{region}/{currency}/{price_type}"
+
+def filter_unit_key(region, price_filter):
+    return unit_key(region, price_filter.currency_code(), price_filter.price_type)
+
+def unit_signature(price_filter, subs):
+    """What a unit was scraped with: its filter and the subscriptions merged in."""
+    return f"{price_filter.signature()};subscriptions={','.join(sorted(subs))}"
+
+def load_existing_db(path):
+    """Group an existing database by unit key. Empty if missing or unreadable."""
+    by_unit = {}
+    try:
+        for rec in vmdb.iter_records(path):
+            key = unit_key(rec['region'], vmdb.record_currency(rec), TIER_PRICE_TYPES[vmdb.record_tier(rec)])
+            by_unit.setdefault(key, []).append(rec)
+    except (OSError, ValueError):
+        return {}
+    return by_unit
+
+def stale_units(units, existing, manifest, ttl, subs):
+    """Units with no existing records, scraped with other filters or subscriptions, or older than ttl."""
+    now = time.time()
+    stale = []
+    for region, price_filter in units:
+        key = filter_unit_key(region, price_filter)
+        entry = manifest.get(key, {})
+        if (key not in existing or entry.get('filter') != unit_signature(price_filter, subs)
+                or now - entry.get('fetched_at', 0) >= ttl):
+            stale.append((region, price_filter))
+    return stale
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Azure VM pricing database.")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="Scrape engine: thread pool (default) or a single asyncio event loop")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help=f"Thread pool size for --engine threads (default {MAX_WORKERS})")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help=f"Global in-flight request budget for --engine async (default {MAX_IN_FLIGHT})")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT,
+                        help=f"Max concurrent connections per host for --engine async (default {PER_HOST_LIMIT})")
+    parser.add_argument("--retries", type=int, default=azhttp.DEFAULT_RETRIES,
+                        help=f"Retries per request on throttling/transient errors (default {azhttp.DEFAULT_RETRIES})")
+    parser.add_argument("-o", "--output", default=OUTPUT_FILE,
+                        help=f"Output file (default {OUTPUT_FILE})")
+    parser.add_argument("--format", choices=vmdb.FORMATS, default=None,
+                        help="Output format: json array, ndjson, columnar or sqlite (default: from the output extension)")
+    parser.add_argument("--cache-dir", default=azcache.DEFAULT_CACHE_DIR,
+                        help=f"On-disk HTTP response cache (default {azcache.DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-ttl", type=float, default=azcache.DEFAULT_TTL / 3600,
+                        help=f"Hours a cached response without validators stays fresh (default {azcache.DEFAULT_TTL // 3600})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the response cache and fetch everything")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-fetch regions whose data is stale and merge them into the existing output")
+    parser.add_argument("--os", dest="os_type", choices=["all", "linux", "windows"], default="all",
+                        help="Only keep Linux or Windows meters (default all)")
+    parser.add_argument("--spot", choices=["all", "exclude", "only"], default="all",
+                        help="Keep, drop (incl. Low Priority) or only keep Spot meters (default all)")
+    parser.add_argument("--tier", dest="tiers", action="append", choices=vmdb.TIERS, default=[],
+                        help="Pricing tier to fetch (repeatable; default: every tier allowed by --spot)")
+    parser.add_argument("--family", action="append", default=[], metavar="PREFIX",
+                        help="Only keep SKUs whose name starts with PREFIX, e.g. Standard_D (repeatable)")
+    parser.add_argument("--currency", dest="currencies", action="append", default=[],
+                        help="Retail price currencyCode, e.g. INR (repeatable; default: API default, USD)")
+    parser.add_argument("--subscription", dest="subscriptions", action="append", default=[], metavar="ID",
+                        help="Subscription whose SKU availability to include (repeatable; default: "
+                             "ARM_SUBSCRIPTION_ID or the az CLI default)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write a JSON report: stage timings, per-host latency histograms, bytes, retries, per-region pages")
+    parser.add_argument("--progress", action="store_true",
+                        help="Show a live progress line instead of a line every five regions")
+    parser.add_argument("--parse-workers", type=int, default=0, metavar="N",
+                        help="Parse and filter price pages in N worker processes instead of the scraping threads "
+                             "(default 0: parse in-process)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Don't append this build's price changes to the history next to the output")
+    parser.add_argument("--record", metavar="DIR",
+                        help="Save every Azure response to DIR for offline replay with azreplay.py (needs --no-cache)")
+    parser.add_argument("--endpoint", metavar="URL",
+                        help="Send ARM and retail price requests to URL instead of Azure, e.g. an azreplay.py server")
+    args = parser.parse_args(argv)
+    if args.incremental and args.no_cache:
+        parser.error("--incremental needs the response cache; drop --no-cache")
+    if args.record and not args.no_cache:
+        parser.error("--record must see every response from the network; add --no-cache")
+    return args
+
+def scope_summary(units, price_filters, subs):
+    regions = len({region for region, _ in units})
+    currencies = ", ".join(dict.fromkeys(pf.currency_code() for pf in price_filters))
+    tiers = ", ".join(dict.fromkeys(t for pf in price_filters for t in pf.tiers))
+    return (f"Found {regions} regions to scrape ({currencies}; {tiers}; "
+            f"{len(subs)} subscription{'s' * (len(subs) > 1)})")
+
+def select_tiers(tiers, spot):
+    """The tiers to fetch: those asked for (default all), narrowed by --spot."""
+    tiers = list(dict.fromkeys(tiers)) or list(vmdb.TIERS)
+    if spot == "only":
+        return [t for t in tiers if t == "spot"]
+    if spot == "exclude":
+        return [t for t in tiers if t not in ("spot", "lowpriority")]
+    return tiers
+
+def main(argv=None):
+    global MANAGEMENT_URL, PRICES_BASE_URL
+    args = parse_args(argv)
+    if args.endpoint:
+        MANAGEMENT_URL = args.endpoint.rstrip('/')
+        PRICES_BASE_URL = MANAGEMENT_URL + "/api/retail/prices"
+    print(f"Starting Azure VM Database Builder (REST API Optimized)")
+    start_time = time.time()
+    metrics = azmetrics.BuildMetrics(live=args.progress)
 
-    print(f"Saving {len(all_vms)} records to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(all_vms, f, indent=2)
+    with metrics.stage('startup'):
+        token, subs = get_token_and_subs(args.subscriptions)
+
+        cache = None
+        if not args.no_cache:
+            cache = azcache.ResponseCache(args.cache_dir, ttl=args.cache_ttl * 3600)
+        recorder = None
+        if args.record:
+            recorder = azreplay.Recorder(args.record, {"subscription": subs[0], "subscriptions": subs})
+
+        # Union of every subscription's regions, in first-seen order
+        regions = list(dict.fromkeys(r for sub in subs for r in get_regions(token, sub, cache, recorder)))
+    if not regions:
+        print("No regions found.")
+        sys.exit(1)
+    print(f"Ready to scrape after {time.time() - start_time:.2f} seconds.")
+    # regions = regions[:5] # uncomment for quick test
+
+    # Public prices are fetched once per (region, currency, priceType) and
+    # shared by every subscription; only the SKU catalogs are per subscription.
+    # Consumption and Reservation queries for a region run side by side.
+    tiers = select_tiers(args.tiers, args.spot)
+    if not tiers:
+        print("Error: --spot and --tier leave no pricing tier to fetch.")
+        sys.exit(1)
+    price_types = dict.fromkeys(TIER_PRICE_TYPES[t] for t in tiers)
+    price_filters = [PriceFilter(args.os_type, args.spot, args.family, currency, price_type, tiers)
+                     for currency in dict.fromkeys(c.upper() for c in args.currencies) or [None]
+                     for price_type in price_types]
+    units = [(region, price_filter) for region in regions for price_filter in price_filters]
+
+    existing = {}
+    manifest = {}
+    todo = units
+    if args.incremental:
+        existing = load_existing_db(args.output)
+        manifest = cache.load_manifest()
+        todo = stale_units(units, existing, manifest, cache.ttl, subs)
+        print(f"Incremental build: {len(units) - len(todo)} price queries fresh, re-fetching {len(todo)}.")
+
+    # Each unit is streamed to <output>.partial as soon as it completes and
+    # the file is only moved into place once every unit is written.
+    fetched = {}
+    failed = []
+    writer = vmdb.open_writer(args.output, args.format)
+    frontier = vmdb.FrontierWriter(vmdb.frontier_path(args.output))
+    # A --family/--os/--spot build only delists prices it could have fetched
+    history = None if args.no_history else vmhistory.HistoryWriter(
+        vmhistory.history_path(args.output), scope=lambda key: any(f.covers(key) for f in price_filters))
+
+    metrics.regions_total = len(todo)
+
+    def on_region(unit, data):
+        region, price_filter = unit
+        key = filter_unit_key(region, price_filter)
+        label = region if len(price_filters) == 1 else key
+        metrics.region_done(region, None if data is None else len(data))
+        if not args.progress and (metrics.regions_done % 5 == 0 or metrics.regions_done == len(todo)):
+            found = "failed" if data is None else f"{len(data)} VMs found"
+            print(f"[{metrics.regions_done}/{len(todo)}] Processed {label} ({found})...")
+        if data is None:
+            # Failed even after retries: keep what --incremental already had
+            # and report it, rather than writing the region as empty
+            failed.append(label)
+            data = existing.get(key, [])
+        else:
+            fetched[key] = (len(data), price_filter)
+        existing.pop(key, None)
+        with metrics.stage('write'):
+            writer.write_records(data)
+            frontier.add_region(region, data)
+            if history is not None:
+                history.add_region(region, data)
+
+    # Pipeline mode: raw page bytes go to worker processes, compact rows come back
+    parse_pool = None
+    if args.parse_workers > 0:
+        # spawn: forking a process that already runs scraping threads is unsafe
+        parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.parse_workers,
+                                                            mp_context=multiprocessing.get_context("spawn"))
+        print(f"Parsing price pages in {args.parse_workers} worker processes.")
+
+    try:
+        finalize_start = None
+        with writer:
+            if not todo:
+                pass
+            elif args.engine == "async":
+                print(f"{scope_summary(todo, price_filters, subs)}. Starting async engine "
+                      f"({args.max_in_flight} in flight, {args.per_host} per host)...")
+                asyncio.run(scrape_async(todo, token, subs, args.max_in_flight, args.per_host, on_region,
+                                         cache, args.retries, metrics, recorder, parse_pool))
+            else:
+                print(f"{scope_summary(todo, price_filters, subs)}. Starting parallel processing with {args.workers} workers...")
+                scrape_threads(todo, token, subs, args.workers, on_region, cache, args.retries,
+                               metrics, recorder, parse_pool)
+            if failed and not args.incremental:
+                # Nothing to fall back on for the failed regions; keep the previous
+                # database rather than replace it with one that lacks them
+                raise ScrapeError(f"{len(failed)} regions failed after retries: {', '.join(sorted(failed))}")
+
+            # Fresh units carried over unchanged from the previous build
+            with metrics.stage('write'):
+                for data in existing.values():
+                    writer.write_records(data)
+                    frontier.add_region(data[0]['region'], data)
+                    if history is not None:
+                        history.add_region(data[0]['region'], data)
+            finalize_start = time.perf_counter()
+    except ScrapeError as e:
+        # Without the catalog, or the regions that failed, the new file would have gaps; keep the old one
+        print(f"Error: {e}. {args.output} was left untouched.")
+        sys.exit(1)
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {len(recorder.index)} responses to {args.record}.")
+    frontier.finalize()
+    if history is not None:
+        history.finalize(start_time)
+    metrics.add_stage('finalize', time.perf_counter() - finalize_start)
+
+    if cache is not None:
+        print(f"Cache: {cache.stats()}")
+        now = time.time()
+        for key, (count, price_filter) in fetched.items():
+            if count:
+                manifest[key] = {'fetched_at': now, 'records': count,
+                                 'filter': unit_signature(price_filter, subs)}
+        cache.save_manifest(manifest)
+
+    print(f"Saved {writer.count} records to {args.output} (Pareto frontier in {frontier.path}).")
+    if history is not None:
+        print(f"History: {history.changes} prices changed since the last build, appended to {history.path}.")
         
     elapsed = time.time() - start_time
     print(f"Done! Database built in {elapsed:.2f} seconds.")
+    print(metrics.summary())
+    if args.metrics:
+        metrics.write(args.metrics)
+        print(f"Metrics report written to {args.metrics}")
+    if failed:
+        print(f"Warning: {len(failed)} regions failed after retries and are missing or stale: {', '.join(sorted(failed))}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
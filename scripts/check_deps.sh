@@ -1,10 +1,11 @@
 #!/bin/bash
 # Checks if python3 is available.
 # We are using standard library only in builddb.py to avoid pip install issues,
-# but we need to make sure 'az' and 'curl' are in path.
+# but we need to make sure 'curl' is in path, and 'az' unless a Service
+# Principal or a ready-made ARM_ACCESS_TOKEN is configured.
 
-if ! command -v az &> /dev/null; then
-    echo "Azure CLI (az) could not be found. Please install it."
+if [ -z "$ARM_ACCESS_TOKEN" ] && [ -z "$ARM_CLIENT_SECRET" ] && ! command -v az &> /dev/null; then
+    echo "Azure CLI (az) could not be found. Please install it (or set ARM_CLIENT_ID/ARM_CLIENT_SECRET/ARM_TENANT_ID)."
     exit 1
 fi
 
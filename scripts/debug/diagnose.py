@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""One-shot diagnostics for a deployment: status, operations, NSG rules and VMs.
+
+Gets one token, then fetches every section at once over a shared
+keep-alive pool, so checking a broken deployment takes about one
+round-trip. VMs are listed with their instance view (power state, agent
+and boot status) in the same request.
+
+--inventory checks every VM of a deploy_fleet.py fleet instead, reading
+their instance views in ARM batch calls (azbatch) rather than one request
+per VM.
+
+--watch keeps re-polling the sections that are still moving (a running
+deployment and its operations, VMs that are provisioning or changing power
+state) and prints a section again only when its content changed. It stops
+once everything has settled.
+
+Usage:
+    python3 scripts/debug/diagnose.py
+    python3 scripts/debug/diagnose.py --deployment ollama-sp-deploy --watch
+    python3 scripts/debug/diagnose.py --only vms --only nsg --resource-group ollama-fleet-rg
+    python3 scripts/debug/diagnose.py --inventory logs/fleet_inventory.json --watch
+"""
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import azbatch
+import azhttp
+import azlro
+import aztoken
+
+MANAGEMENT_URL = "https://management.azure.com"
+RESOURCE_GROUP = "ollama-rg"
+DEPLOYMENT_NAME = "ollama-sp-deploy"
+SECTIONS = ("deployment", "operations", "nsg", "vms", "ips", "fleet")
+INVENTORY_FILE = "logs/fleet_inventory.json"
+WATCH_INTERVAL = 5
+# Power states a VM passes through on its way to running/stopped/deallocated
+TRANSITIONAL_POWER_STATES = ("starting", "stopping", "deallocating")
+
+
+def section_urls(sub_id, resource_group, deployment):
+    group = f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourceGroups/{resource_group}"
+    deployment_url = f"{group}/providers/Microsoft.Resources/deployments/{deployment}"
+    return {
+        "deployment": f"{deployment_url}?api-version=2021-04-01",
+        "operations": f"{deployment_url}/operations?api-version=2021-04-01",
+        "nsg": f"{group}/providers/Microsoft.Network/networkSecurityGroups?api-version=2023-05-01",
+        "vms": f"{group}/providers/Microsoft.Compute/virtualMachines?api-version=2023-09-01&$expand=instanceView",
+        "ips": f"{group}/providers/Microsoft.Network/publicIPAddresses?api-version=2023-05-01",
+    }
+
+
+def fetch(client, headers, url):
+    """The JSON body of a GET, or {"error": ...} when it fails."""
+    try:
+        return client.get_json(url, headers=headers)
+    except azhttp.HTTPError as e:
+        try:
+            body = e.response.json()
+        except ValueError:
+            body = {}
+        return {"error": {"code": f"HTTP {e.status}", "message": azlro.error_message(body) or e.response.reason}}
+    except azhttp.REQUEST_ERRORS as e:
+        return {"error": {"code": type(e).__name__, "message": str(e)}}
+
+
+def fetch_fleet(client, headers, sub_id, inventory):
+    """Instance view of every VM in a deploy_fleet.py inventory, in ARM batch calls."""
+    group = f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourceGroups/{inventory['resourceGroup']}"
+    requests = [("GET", f"{group}/providers/Microsoft.Compute/virtualMachines/{vm['name']}/instanceView"
+                        f"?api-version=2023-09-01", None) for vm in inventory["vms"]]
+    try:
+        responses = azbatch.send(client, requests, headers)
+    except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+        return {"error": {"code": type(e).__name__, "message": str(e)}}
+    vms = []
+    for vm, response in zip(inventory["vms"], responses):
+        entry = dict(vm)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.ok:
+            entry["instanceView"] = body
+        else:
+            entry["error"] = f"HTTP {response.status} {azlro.error_message(body) or response.reason}"
+        vms.append(entry)
+    return {"value": vms}
+
+
+def fetch_all(fetchers, sections):
+    """Run the sections' fetchers concurrently; returns {section: body}."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        bodies = executor.map(lambda name: fetchers[name](), sections)
+        return dict(zip(sections, bodies))
+
+
+def view_state(view, kind="PowerState"):
+    """A VM instance view's PowerState (or ProvisioningState) code, e.g. running."""
+    for status in (view or {}).get("statuses", []):
+        if status.get("code", "").startswith(kind + "/"):
+            return status["code"].split("/", 1)[1]
+    return "unknown"
+
+
+def power_state(vm):
+    return view_state(vm.get("properties", {}).get("instanceView"))
+
+
+def settled(section, data):
+    """Whether a section has stopped changing, so --watch can leave it alone."""
+    if "error" in data:
+        # A deployment that doesn't exist yet may still appear; the rest won't fix themselves
+        return section not in ("deployment", "operations")
+    if section in ("deployment", "operations"):
+        states = [data.get("properties", {}).get("provisioningState")] if section == "deployment" else \
+            [op.get("properties", {}).get("provisioningState") for op in data.get("value", [])]
+        return all((state or "").lower() in azlro.TERMINAL_STATES for state in states)
+    if section == "vms":
+        return all(vm.get("properties", {}).get("provisioningState", "").lower() in azlro.TERMINAL_STATES
+                   and power_state(vm) not in TRANSITIONAL_POWER_STATES for vm in data.get("value", []))
+    if section == "fleet":
+        return all("error" in vm or (view_state(vm["instanceView"], "ProvisioningState") in azlro.TERMINAL_STATES
+                                     and view_state(vm["instanceView"]) not in TRANSITIONAL_POWER_STATES)
+                   for vm in data.get("value", []))
+    return True
+
+
+def render_error(data):
+    error = data["error"]
+    return [f"  ❌ {error.get('code', '')}: {error.get('message', '')}"]
+
+
+def render_deployment(data):
+    props = data.get("properties", {})
+    lines = [f"  State: {props.get('provisioningState', 'N/A')}  (started {props.get('timestamp', 'N/A')}, "
+             f"took {props.get('duration', 'N/A')})"]
+    if props.get("error"):
+        lines.append(f"  Error: {azlro.error_message(props['error'])}")
+    for name, output in (props.get("outputs") or {}).items():
+        lines.append(f"  Output {name}: {output.get('value')}")
+    return lines
+
+
+def render_operations(data):
+    lines = []
+    for op in data.get("value", []):
+        props = op.get("properties", {})
+        target = props.get("targetResource", {})
+        status = props.get("provisioningState", "N/A")
+        lines.append(f"  {'❌' if status == 'Failed' else '✅' if status == 'Succeeded' else '⏳'} "
+                     f"{target.get('resourceName', 'N/A')} ({target.get('resourceType', 'N/A')}): {status}")
+        if status == "Failed":
+            error = props.get("statusMessage", {}).get("error", {})
+            lines.append(f"      {azlro.error_message(error) or 'N/A'}")
+    return lines or ["  No operations."]
+
+
+def render_nsg(data):
+    lines = []
+    for nsg in data.get("value", []):
+        lines.append(f"  {nsg['name']}:")
+        rules = sorted(nsg.get("properties", {}).get("securityRules", []),
+                       key=lambda rule: rule.get("properties", {}).get("priority", 0))
+        for rule in rules:
+            p = rule.get("properties", {})
+            ports = p.get("destinationPortRange") or ",".join(p.get("destinationPortRanges", [])) or "*"
+            source = p.get("sourceAddressPrefix") or ",".join(p.get("sourceAddressPrefixes", [])) or "*"
+            lines.append(f"    {p.get('priority', '')!s:>5} {p.get('direction', ''):<8} {p.get('access', ''):<5} "
+                         f"{p.get('protocol', '')} {source} -> {ports}  ({rule['name']})")
+        if not rules:
+            lines.append("    No custom rules (default rules only: inbound SSH is blocked).")
+    return lines or ["  No NSGs in the resource group."]
+
+
+def render_vms(data):
+    lines = []
+    for vm in data.get("value", []):
+        props = vm.get("properties", {})
+        view = props.get("instanceView", {})
+        state = power_state(vm)
+        lines.append(f"  {'✅' if state == 'running' else '⚠️'} {vm['name']}: "
+                     f"{props.get('hardwareProfile', {}).get('vmSize')} in {vm.get('location')}, "
+                     f"provisioning {props.get('provisioningState')}, power {state}")
+        agent = view.get("vmAgent", {}).get("statuses", [])
+        if agent:
+            lines.append(f"      Agent: {agent[0].get('displayStatus')}")
+        for status in view.get("statuses", []):
+            if status.get("level") == "Error":
+                lines.append(f"      {status.get('code')}: {status.get('message', '')}")
+    return lines or ["  ❌ No VMs found in resource group!"]
+
+
+def render_ips(data):
+    lines = []
+    for pip in data.get("value", []):
+        config = pip.get("properties", {}).get("ipConfiguration", {}).get("id", "")
+        attached = config.split("/networkInterfaces/")[-1].split("/")[0] if config else "not attached"
+        lines.append(f"  {pip['name']}: {pip.get('properties', {}).get('ipAddress', 'not assigned')} ({attached})")
+    return lines or ["  No public IPs."]
+
+
+def render_fleet(data):
+    lines = []
+    running = 0
+    for vm in data.get("value", []):
+        where = f"{vm['name']} ({vm.get('vmSize')} in {vm.get('region')}, {vm.get('ip') or 'no IP'})"
+        if "error" in vm:
+            lines.append(f"  ❌ {where}: {vm['error']}")
+            continue
+        state = view_state(vm["instanceView"])
+        running += state == "running"
+        lines.append(f"  {'✅' if state == 'running' else '⚠️'} {where}: power {state}, "
+                     f"provisioning {view_state(vm['instanceView'], 'ProvisioningState')}")
+    return [f"  {running}/{len(lines)} running"] + lines if lines else ["  The inventory lists no VMs."]
+
+
+RENDERERS = {
+    "deployment": ("Deployment", render_deployment),
+    "operations": ("Deployment operations", render_operations),
+    "nsg": ("NSG rules", render_nsg),
+    "vms": ("VMs", render_vms),
+    "ips": ("Public IPs", render_ips),
+    "fleet": ("Fleet", render_fleet),
+}
+
+
+def render(section, data):
+    title, renderer = RENDERERS[section]
+    return [f"{title}:"] + (render_error(data) if "error" in data else renderer(data))
+
+
+def main(argv=None):
+    global MANAGEMENT_URL
+    parser = argparse.ArgumentParser(description="Deployment status, operations, NSG rules and VMs in one report.")
+    parser.add_argument("--resource-group", default=RESOURCE_GROUP, help=f"default {RESOURCE_GROUP}")
+    parser.add_argument("--deployment", default=DEPLOYMENT_NAME, help=f"default {DEPLOYMENT_NAME}")
+    parser.add_argument("--only", action="append", choices=SECTIONS, default=[],
+                        help="Only these sections (repeatable)")
+    parser.add_argument("--inventory", nargs="?", const=INVENTORY_FILE, metavar="FILE",
+                        help=f"Check every VM of a deploy_fleet.py inventory (default {INVENTORY_FILE}) instead")
+    parser.add_argument("--watch", action="store_true", help="Re-poll what is still changing until it settles")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL,
+                        help=f"Seconds between --watch polls (default {WATCH_INTERVAL})")
+    parser.add_argument("--raw", action="store_true", help="Print the raw JSON responses instead of the report")
+    parser.add_argument("--endpoint", metavar="URL", help="Send ARM requests to URL instead of Azure")
+    args = parser.parse_args(argv)
+    if args.endpoint:
+        MANAGEMENT_URL = args.endpoint.rstrip('/')
+    if args.inventory:
+        try:
+            with open(args.inventory) as f:
+                inventory = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error reading {args.inventory}: {e}")
+            sys.exit(1)
+        default = ("fleet",)
+    else:
+        if "fleet" in args.only:
+            parser.error("the fleet section needs --inventory")
+        default = SECTIONS[:-1]
+    sections = [name for name in SECTIONS if name in (args.only or default)]
+
+    try:
+        token = aztoken.get_token()
+    except aztoken.TokenError as e:
+        print(f"❌ Failed to get a token: {e}")
+        sys.exit(1)
+    sub_id = aztoken.subscription_id()
+    if not sub_id:
+        print("❌ Error: no subscription ID; set ARM_SUBSCRIPTION_ID.")
+        sys.exit(1)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    urls = section_urls(sub_id, args.resource_group, args.deployment)
+
+    shown = {}
+    with azhttp.HTTPClient(pool_size=len(sections) + azbatch.MAX_PARALLEL_BATCHES) as client:
+        fetchers = {name: functools.partial(fetch, client, headers, url) for name, url in urls.items()}
+        if args.inventory:
+            fetchers["fleet"] = functools.partial(fetch_fleet, client, headers, sub_id, inventory)
+        pending = sections
+        while True:
+            data = fetch_all(fetchers, pending)
+            if args.raw:
+                print(json.dumps(data, indent=2))
+            else:
+                changed = [name for name in pending if render(name, data[name]) != shown.get(name)]
+                if changed and shown:
+                    print(f"\n--- {datetime.datetime.now():%H:%M:%S} ---")
+                for name in changed:
+                    shown[name] = render(name, data[name])
+                    print("\n".join(shown[name]))
+            moving = {name for name in pending if not settled(name, data[name])}
+            if "deployment" in moving and "operations" in sections:
+                # A running deployment keeps starting operations
+                moving.add("operations")
+            pending = [name for name in sections if name in moving]
+            if not args.watch or not pending:
+                break
+            try:
+                time.sleep(args.interval)
+            except KeyboardInterrupt:
+                break
+
+
+if __name__ == "__main__":
+    main()
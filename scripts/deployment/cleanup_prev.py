@@ -1,78 +1,394 @@
-import json
+#!/usr/bin/env python3
+"""Tear down the Ollama resources in a resource group, in dependency order.
+
+Every matching resource is read once and the forward references in its
+body give the dependency graph: a VM uses its NICs and disks, a NIC its
+public IP, NSG and subnet (so its VNet), a shutdown schedule its VM. A
+resource is deleted as soon as nothing left references it, so each layer
+(VM -> NIC/disk -> PIP/NSG/VNet) goes in parallel and the next one starts
+when the deletes it waits on have completed, followed through azlro.
+Reads, deletes and status polls go out as ARM batch calls (azbatch).
+Deletes rejected because the resource is still in use (409, NIC
+reservations, in-use subnets) are retried with backoff.
+
+Usage:
+    python3 scripts/deployment/cleanup_prev.py
+    python3 scripts/deployment/cleanup_prev.py --resource-group ollama-fleet-rg --dry-run
+"""
+import argparse
 import os
 import sys
 import time
-import urllib.parse
-from urllib import request, error
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import azbatch
+import azhttp
+import azlro
+import aztoken
 
 # ==========================================
-# Service Principal Config
+# Cleanup Config
 # ==========================================
-CLIENT_ID = os.environ.get("ARM_CLIENT_ID", "")
-CLIENT_SECRET = os.environ.get("ARM_CLIENT_SECRET", "")
-TENANT_ID = os.environ.get("ARM_TENANT_ID", "")
-SUBSCRIPTION_ID = os.environ.get("ARM_SUBSCRIPTION_ID", "")
+MANAGEMENT_URL = "https://management.azure.com"
 RESOURCE_GROUP = "ollama-rg"
 VM_NAME = "ollama-worker"
+# Resources whose name contains any of these are torn down
+NAME_PATTERNS = (VM_NAME, "ollama")
+# api-version per resource type; other types are looked up from their provider
+API_VERSIONS = {
+    "microsoft.compute/virtualmachines": "2023-09-01",
+    "microsoft.compute/disks": "2023-04-02",
+    "microsoft.network/networkinterfaces": "2023-05-01",
+    "microsoft.network/publicipaddresses": "2023-05-01",
+    "microsoft.network/networksecuritygroups": "2023-05-01",
+    "microsoft.network/virtualnetworks": "2023-05-01",
+    "microsoft.devtestlab/schedules": "2018-09-15",
+}
+# Error codes meaning "still in use, try again shortly" rather than a real failure
+CONFLICT_CODES = {
+    "Conflict", "AnotherOperationInProgress", "OperationNotAllowed", "RetryableError",
+    "NicReservedForAnotherVm", "NicInUse", "InUseSubnetCannotBeDeleted",
+    "InUseNetworkSecurityGroupCannotBeDeleted", "PublicIPAddressCannotBeDeleted",
+    "InUseRouteTableCannotBeDeleted", "DiskBeingDetached", "OperationNotAllowedOnDiskInUse",
+}
+# Conflict retries back off from 5 s to 30 s (a deleted VM's NIC stays reserved for 180 s)
+RETRY_INITIAL = 5
+RETRY_MAX = 30
+DELETE_TIMEOUT = 1800
+WORKERS = 16
+
+
+def resource_type(resource_id):
+    """Microsoft.Network/virtualNetworks/subnets from a resource ID."""
+    parts = resource_id.strip("/").split("/")
+    provider = parts.index("providers")
+    return "/".join([parts[provider + 1]] + parts[provider + 2::2])
+
+
+def api_version(client, headers, sub_id, rtype, cache):
+    """Newest stable api-version of a resource type, from the table or its provider."""
+    key = rtype.lower()
+    if key in API_VERSIONS:
+        return API_VERSIONS[key]
+    if key not in cache:
+        namespace, _, name = rtype.partition("/")
+        url = f"{MANAGEMENT_URL}/subscriptions/{sub_id}/providers/{namespace}?api-version=2021-04-01"
+        versions = []
+        try:
+            for entry in client.get_json(url, headers=headers).get("resourceTypes", []):
+                if entry.get("resourceType", "").lower() == name.lower():
+                    versions = entry.get("apiVersions", [])
+        except azhttp.REQUEST_ERRORS:
+            pass
+        stable = sorted((v for v in versions if "preview" not in v), reverse=True)
+        cache[key] = stable[0] if stable else "2021-04-01"
+    return cache[key]
+
+
+def list_resources(client, headers, sub_id, resource_group, patterns):
+    """Resources in the group whose name matches one of the patterns (all if none)."""
+    url = f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourceGroups/{resource_group}/resources?api-version=2021-04-01"
+    resources = []
+    while url:
+        page = client.get_json(url, headers=headers)
+        resources += [res for res in page.get("value", [])
+                      if not patterns or any(p in res["name"] for p in patterns)]
+        url = page.get("nextLink")
+    return resources
+
+
+# Where each type points at the resources it uses (and so must be deleted before).
+# ARM bodies also carry back-references (a NIC's virtualMachine, a disk's
+# managedBy, a PIP's ipConfiguration, an NSG's networkInterfaces, a subnet's
+# ipConfigurations); following those would make every pair a cycle.
+FORWARD_REFERENCES = {
+    "microsoft.compute/virtualmachines": (
+        "properties.networkProfile.networkInterfaces[].id",
+        "properties.storageProfile.osDisk.managedDisk.id",
+        "properties.storageProfile.dataDisks[].managedDisk.id",
+    ),
+    "microsoft.network/networkinterfaces": (
+        "properties.ipConfigurations[].properties.publicIPAddress.id",
+        "properties.ipConfigurations[].properties.subnet.id",
+        "properties.networkSecurityGroup.id",
+    ),
+    "microsoft.network/virtualnetworks": (
+        "properties.subnets[].properties.networkSecurityGroup.id",
+        "properties.subnets[].properties.routeTable.id",
+    ),
+    "microsoft.compute/disks": (),
+    "microsoft.network/publicipaddresses": (),
+    "microsoft.network/networksecuritygroups": (),
+}
+
+
+def references(value):
+    """Every ARM resource ID string anywhere in a resource body."""
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from references(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from references(item)
+    elif isinstance(value, str) and value.lower().startswith("/subscriptions/"):
+        yield value
+
+
+def _follow(value, path):
+    """Values at a dotted path; "name[]" steps into every item of a list."""
+    if not path:
+        if isinstance(value, str):
+            yield value
+        return
+    step, rest = path[0], path[1:]
+    if not isinstance(value, dict):
+        return
+    if step.endswith("[]"):
+        for item in value.get(step[:-2]) or ():
+            yield from _follow(item, rest)
+    else:
+        yield from _follow(value.get(step), rest)
+
+
+def forward_references(rtype, body):
+    """IDs a resource depends on: the known forward paths for its type, else every ID in it."""
+    paths = FORWARD_REFERENCES.get(rtype.lower())
+    if paths is None:
+        # e.g. a shutdown schedule's targetResourceId
+        return list(references(body))
+    return [ref for path in paths for ref in _follow(body, path.split("."))]
+
+
+def dependency_graph(resources, bodies):
+    """{id: ids of the listed resources it depends on}, IDs lowercased.
+
+    A reference to a child (a VNet's subnet) counts as one to its parent.
+    """
+    ids = [res["id"].lower() for res in resources]
+    graph = {}
+    for res in resources:
+        own = res["id"].lower()
+        graph[own] = set()
+        for ref in forward_references(res["type"], bodies.get(own, {})):
+            ref = ref.lower()
+            for other in ids:
+                if other != own and (ref == other or ref.startswith(other + "/")) \
+                        and not own.startswith(other + "/"):
+                    graph[own].add(other)
+    return graph
+
+
+def layers(graph):
+    """Resources grouped into the order they can be deleted in (referrers first)."""
+    remaining = {rid: set(refs) for rid, refs in graph.items()}
+    result = []
+    while remaining:
+        referenced = set().union(*remaining.values())
+        layer = sorted(rid for rid in remaining if rid not in referenced)
+        if not layer:
+            # A reference cycle; delete the rest together and let conflict retries sort it out
+            layer = sorted(remaining)
+        result.append(layer)
+        for rid in layer:
+            del remaining[rid]
+    return result
+
+
+def reachable(graph, start):
+    """Every resource referenced, directly or not, from the ones in start."""
+    seen = set()
+    stack = list(start)
+    while stack:
+        rid = stack.pop()
+        if rid not in seen:
+            seen.add(rid)
+            stack.extend(graph[rid])
+    return seen
+
+
+def is_conflict(status, error):
+    return status == 409 or (error or {}).get("code") in CONFLICT_CODES
+
+
+def teardown(client, headers, resources, graph, versions, timeout=DELETE_TIMEOUT):
+    """Delete the resources, each once everything referencing it is gone.
+
+    Returns (deleted, failed): resource IDs, and {id: reason} for the ones
+    that could not be deleted (including those left behind because
+    something referencing them wasn't).
+    """
+    by_id = {res["id"].lower(): res for res in resources}
+    started = time.monotonic()
+    deadline = started + timeout
+    waiting = set(by_id)
+    retry_at = {}
+    attempts = {}
+    conflicts = {}
+    forced = set()
+    running = []
+    deleted = []
+    failed = {}
+
+    def ready(rid):
+        # Nothing still present references it, and its conflict backoff is over
+        present = waiting | set(failed) | {op.name for op in running}
+        return (retry_at.get(rid, 0) <= time.monotonic()
+                and (rid in forced or not any(rid in graph[other] for other in present)))
+
+    def start(batch):
+        # One batch call deletes a whole layer; returns (id, response, error) per resource
+        requests = [("DELETE", f"{MANAGEMENT_URL}{by_id[rid]['id']}?api-version={versions[rid]}", None)
+                    for rid in batch]
+        try:
+            responses = azbatch.send(client, requests, headers)
+        except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+            return [(rid, None, {"message": str(e)}) for rid in batch]
+        results = []
+        for rid, response in zip(batch, responses):
+            error = None
+            if not response.ok:
+                try:
+                    error = response.json().get("error", {})
+                except ValueError:
+                    error = {}
+            results.append((rid, response, error))
+        return results
+
+    def gone(rid):
+        deleted.append(rid)
+        res = by_id[rid]
+        print(f"✅ Deleted {res['name']} ({res['type']}) [{time.monotonic() - started:.0f}s]")
+
+    def rejected(rid, status, error):
+        res = by_id[rid]
+        if is_conflict(status, error) and time.monotonic() < deadline:
+            attempts[rid] = attempts.get(rid, 0) + 1
+            delay = min(RETRY_MAX, RETRY_INITIAL * 2 ** (attempts[rid] - 1))
+            retry_at[rid] = time.monotonic() + delay
+            conflicts[rid] = azlro.error_message({"error": error}) or f"HTTP {status}"
+            waiting.add(rid)
+            print(f"⏳ {res['name']} still in use ({error.get('code', status)}), retrying in {delay}s")
+        else:
+            failed[rid] = azlro.error_message({"error": error}) or f"HTTP {status}"
+            print(f"❌ {res['name']} ({res['type']}): {failed[rid]}")
+
+    while waiting or running:
+        batch = [rid for rid in sorted(waiting) if ready(rid)]
+        waiting.difference_update(batch)
+        for rid in batch:
+            print(f"🗑️ Deleting {by_id[rid]['name']} ({by_id[rid]['type']})")
+        for rid, response, error in (start(batch) if batch else ()):
+            if response is None:
+                rejected(rid, None, error)
+            elif error is not None:
+                if response.status == 404:
+                    gone(rid)
+                else:
+                    rejected(rid, response.status, error)
+            else:
+                running.append(azlro.Operation(client, response, headers, method="DELETE", name=rid))
+
+        if running:
+            azlro.poll_due(running, deadline, send=azbatch.poller(client, headers))
+        elif waiting and not batch:
+            # Resources on a reference cycle never become ready on their own: delete
+            # them together, as layers() does, and let conflict retries sort them out
+            cycle = {rid for rid in waiting - forced if rid in reachable(graph, graph[rid] & waiting)}
+            if cycle:
+                forced.update(cycle)
+                continue
+            now = time.monotonic()
+            backoff = [retry_at[rid] for rid in waiting if retry_at.get(rid, 0) > now]
+            if not backoff or min(backoff) > deadline:
+                # The rest is held by a resource that failed
+                break
+            time.sleep(min(backoff) - now)
+        for op in [op for op in running if op.done]:
+            running.remove(op)
+            if op.error is None:
+                gone(op.name)
+            else:
+                rejected(op.name, None, op.error.error or {"message": str(op.error)})
+
+    for rid in waiting:
+        if rid in conflicts:
+            failed[rid] = f"still in use at the timeout ({conflicts[rid]})"
+        else:
+            failed[rid] = "still referenced by a resource that wasn't deleted"
+    return deleted, failed
+
+
+def main(argv=None):
+    global MANAGEMENT_URL
+    parser = argparse.ArgumentParser(description="Delete the Ollama VM and its resources in dependency order.")
+    parser.add_argument("--resource-group", default=RESOURCE_GROUP, help=f"default {RESOURCE_GROUP}")
+    parser.add_argument("--match", dest="patterns", action="append", default=[], metavar="TEXT",
+                        help=f"Delete resources whose name contains TEXT (repeatable; default {', '.join(NAME_PATTERNS)})")
+    parser.add_argument("--all", action="store_true", help="Delete every resource in the group")
+    parser.add_argument("--timeout", type=int, default=DELETE_TIMEOUT,
+                        help=f"Give up after this many seconds (default {DELETE_TIMEOUT})")
+    parser.add_argument("--dry-run", action="store_true", help="Print the deletion order and exit")
+    parser.add_argument("--endpoint", metavar="URL", help="Send ARM requests to URL instead of Azure")
+    args = parser.parse_args(argv)
+    if args.endpoint:
+        MANAGEMENT_URL = args.endpoint.rstrip('/')
+    patterns = () if args.all else (args.patterns or NAME_PATTERNS)
 
-def get_sp_token():
-    print(f"Getting token for SP {CLIENT_ID}...")
-    url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "https://management.azure.com/.default"
-    }
-    encoded_data = urllib.parse.urlencode(data).encode("utf-8")
-    req = request.Request(url, data=encoded_data)
-    with request.urlopen(req) as response:
-        return json.load(response)["access_token"]
-
-def dpreq(url, token, method="GET", body=None):
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    encoded_body = None
-    if body:
-        encoded_body = json.dumps(body).encode("utf-8")
-    
-    req = request.Request(url, data=encoded_body, headers=headers, method=method)
     try:
-        with request.urlopen(req) as response:
-            if response.status == 204: return {}
-            return json.load(response)
-    except error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason}")
-        print(e.read().decode())
-        return None
-
-def delete_resources(token):
-    print(f"🗑️ Deleting VM: {VM_NAME}...")
-    base_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/providers/Microsoft.Compute/virtualMachines/{VM_NAME}?api-version=2023-09-01"
-    
-    # Delete VM
-    dpreq(base_url, token, method="DELETE")
-    
-    # We should wait for VM deletion before deleting NIC/Disks to avoid locks
-    print("⏳ Waiting for VM deletion to initiate...")
-    time.sleep(10)
-    
-    print("🗑️ Deleting associated Disks and NICs in {RESOURCE_GROUP}...")
-    # List all resources in the group and delete them if they match the name pattern
-    resources_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/{RESOURCE_GROUP}/resources?api-version=2021-04-01"
-    res_list = dpreq(resources_url, token)
-    
-    if res_list and "value" in res_list:
-        for res in res_list["value"]:
-            if VM_NAME in res["name"] or "ollama" in res["name"]:
-                print(f"Deleting resource: {res['name']} ({res['type']})")
-                del_url = f"https://management.azure.com{res['id']}?api-version=2021-04-01"
-                # Use individual API versions if needed, but 2021-04-01 is generic enough for many
-                dpreq(del_url, token, method="DELETE")
+        token = aztoken.get_token()
+    except aztoken.TokenError as e:
+        print(f"❌ Failed to get a token: {e}")
+        sys.exit(1)
+    sub_id = aztoken.subscription_id()
+    if not sub_id:
+        print("❌ Error: no subscription ID; set ARM_SUBSCRIPTION_ID.")
+        sys.exit(1)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    with azhttp.HTTPClient(pool_size=WORKERS) as client:
+        try:
+            resources = list_resources(client, headers, sub_id, args.resource_group, patterns)
+        except azhttp.REQUEST_ERRORS as e:
+            print(f"❌ Error listing {args.resource_group}: {e}")
+            sys.exit(1)
+        if not resources:
+            print(f"Nothing to delete in {args.resource_group}.")
+            return
+
+        # Read every resource once for the IDs it references
+        cache = {}
+        versions = {res["id"].lower(): api_version(client, headers, sub_id, resource_type(res["id"]), cache)
+                    for res in resources}
+
+        urls = [f"{MANAGEMENT_URL}{res['id']}?api-version={versions[res['id'].lower()]}" for res in resources]
+        try:
+            bodies = azbatch.get_json(client, urls, headers)
+        except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+            print(f"❌ Error reading the resources: {e}")
+            sys.exit(1)
+        bodies = {res["id"].lower(): body or {} for res, body in zip(resources, bodies)}
+        graph = dependency_graph(resources, bodies)
+
+        names = {res["id"].lower(): f"{res['name']} ({res['type']})" for res in resources}
+        print(f"🗑️ Tearing down {len(resources)} resources in {args.resource_group}:")
+        for n, layer in enumerate(layers(graph), 1):
+            print(f"  {n}. " + ", ".join(names[rid] for rid in layer))
+        if args.dry_run:
+            return
+
+        deleted, failed = teardown(client, headers, resources, graph, versions, args.timeout)
+
+    print("\n------------------------------------------------")
+    if failed:
+        print(f"⚠️ Deleted {len(deleted)}/{len(resources)} resources; left behind:")
+        for rid, reason in failed.items():
+            print(f"  {names[rid]}: {reason}")
+    else:
+        print(f"✅ Deleted all {len(deleted)} resources.")
+    print("------------------------------------------------")
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
-    token = get_sp_token()
-    delete_resources(token)
-    print("✅ Deletion requests sent!")
+    main()
@@ -13,6 +13,7 @@ RG="ollama-rg"
 LOC="centralindia"
 VM_NAME="worker-vm-4vcpu"
 # Standard_D4as_v5: 4 vCPU, 16 GB RAM (~$0.11/hr Standard, ~$0.02/hr Spot)
+# Current prices per tier: python3 scripts/vmquery.py sku Standard_D4as_v5 --region centralindia --tier all
 SIZE="Standard_D4as_v5" 
 IMAGE="Ubuntu2204"
 
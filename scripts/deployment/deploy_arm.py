@@ -2,10 +2,11 @@ import json
 import os
 import subprocess
 import sys
-import shutil
-import tempfile
-import urllib.parse
-from urllib import request, error
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import azhttp
+import azlro
+import aztoken
 
 # Constants
 SUBSCRIPTION_ID = os.environ.get("ARM_SUBSCRIPTION_ID", "")
@@ -14,6 +15,8 @@ LOCATION = "centralindia"
 DEPLOYMENT_NAME = "ollama-deployment"
 ARM_TEMPLATE_FILE = "deploy.json"
 SSH_KEY_FILE = "ollama_key.pub"
+PIP_NAME = "ollama-worker-pip"
+DEPLOY_TIMEOUT = 1200
 
 def run_command(command, env=None):
     try:
@@ -25,36 +28,18 @@ def run_command(command, env=None):
         print(f"Error running command: {command}\nStderr: {e.stderr}", file=sys.stderr)
         return None
 
-def get_token_temp_config():
-    """Get access token using temp config workaround."""
-    print("Setting up temp config for token retrieval...")
-    temp_dir = tempfile.mkdtemp(prefix="az_deploy_tmp_")
-    
-    # Copy auth files
-    az_dir = os.path.expanduser("~/.azure")
-    for fname in ["msal_token_cache.json", "azureProfile.json", "clouds.config", "config"]:
-        src = os.path.join(az_dir, fname)
-        if os.path.exists(src):
-            shutil.copy(src, temp_dir)
-            
-    env = os.environ.copy()
-    env["AZURE_CONFIG_DIR"] = temp_dir
-    
+def get_cli_token():
+    """Get access token for the az CLI account (cached across runs)."""
     # Use specific tenant to reduce token size
     tenant_id = os.environ.get("ARM_TENANT_ID", "")
     print(f"Getting access token for tenant {tenant_id}...")
-    # Get token for management API
-    token = run_command(f"az account get-access-token --tenant {tenant_id} --query accessToken -o tsv", env=env)
-    
-    # Clean up
-    shutil.rmtree(temp_dir, ignore_errors=True)
-    
-    if not token:
-        raise Exception("Failed to retrieve access token")
-    return token
+    try:
+        return aztoken.cli_token(tenant_id or None)
+    except aztoken.TokenError as e:
+        raise Exception(f"Failed to retrieve access token: {e}")
 
 def deploy_template(token):
-    """Deploy ARM template using REST API."""
+    """Deploy ARM template using REST API, wait for it and return the VM's public IP (or None)."""
     print(f"Deploying ARM template to RG: {RESOURCE_GROUP}...")
     
     # Read ARM template
@@ -80,81 +65,59 @@ def deploy_template(token):
         }
     }
     
-    # Create RG if not exists (using curl/mgmt api)
-    # Actually, let's assume RG was created by previous script or create it now via REST
-    # Create RG URL
     rg_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}?api-version=2021-04-01"
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
-    
-    rg_body = json.dumps({"location": LOCATION})
-    req = request.Request(rg_url, data=rg_body.encode('utf-8'), headers=headers, method='PUT')
-    try:
-        with request.urlopen(req) as response:
+
+    with azhttp.HTTPClient(pool_size=1) as client:
+        try:
+            azlro.run(client, "PUT", rg_url, headers, {"location": LOCATION})
             print("Resource Group created/verified.")
-    except error.HTTPError as e:
-        print(f"Error creating RG: {e.read().decode()}")
-        # Proceed anyway, maybe it exists
-        
-    # Deployment URL
-    deploy_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Resources/deployments/{DEPLOYMENT_NAME}?api-version=2021-04-01"
-    
-    data = json.dumps(payload).encode('utf-8')
-    req = request.Request(deploy_url, data=data, headers=headers, method='PUT')
-    
-    print("Sending deployment request...")
-    try:
-        with request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            print("Deployment started successfully!")
-            # Deployment is async usually, but this returns the initial state
-            # For "Complete" status we need to poll, but let's just wait a bit or return
-            # The output publicIP might not be ready in the immediate response if async.
-            return result
-    except error.HTTPError as e:
-        print(f"Deployment failed: {e.code} {e.reason}")
-        print(e.read().decode())
-        return None
+        except azhttp.HTTPError as e:
+            print(f"Error creating RG: {e.response.body.decode(errors='replace')}")
+            # Proceed anyway, maybe it exists
 
-def main():
-    try:
-        token = get_token_temp_config()
-        result = deploy_template(token)
-        print("Deployment request sent. Check Azure Portal or wait for completion.")
-        
-        # We can implement polling here if needed, but for now let's just rely on user checking or script re-check
-        # Actually, let's try to get the IP from the deployment result if usually synchronous for small things?
-        # No, typically 201 Created and then we poll.
-        
-        # Poll for public IP
-        import time
-        print("Polling for Public IP (timeout 180s)...")
-        for i in range(18):
-            # Check IP resource directly
-            pip_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Network/publicIPAddresses/ollama-worker-pip?api-version=2020-11-01"
-            headers = {"Authorization": f"Bearer {token}"}
-            req = request.Request(pip_url, headers=headers, method='GET')
+        # Deployment URL
+        deploy_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Resources/deployments/{DEPLOYMENT_NAME}?api-version=2021-04-01"
+
+        print("Sending deployment request...")
+        try:
+            response = client.request("PUT", deploy_url, headers=headers, body=payload)
+        except azhttp.HTTPError as e:
+            raise Exception(f"Deployment failed: {e.status} {e.response.reason}\n"
+                            f"{e.response.body.decode(errors='replace')}")
+        print("Deployment started successfully!")
+
+        # Follow the deployment's async operation; raises azlro.OperationFailed on failure
+        print(f"Waiting for the deployment (timeout {DEPLOY_TIMEOUT}s)...")
+        deployment = azlro.wait(client, response, headers, timeout=DEPLOY_TIMEOUT, on_poll=azlro.progress_dots)
+        print()
+
+        # The template outputs the public IP; read the resource if it doesn't
+        ip = deployment.get('properties', {}).get('outputs', {}).get('publicIP', {}).get('value')
+        if not ip:
+            pip_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Network/publicIPAddresses/{PIP_NAME}?api-version=2020-11-01"
             try:
-                with request.urlopen(req) as response:
-                    data = json.loads(response.read().decode())
-                    ip = data.get('properties', {}).get('ipAddress')
-                    if ip:
-                        print("\n------------------------------------------------")
-                        print("✅ Deployment Complete!")
-                        print(f"Public IP: {ip}")
-                        print(f"Connect: ssh -i ollama_key azureuser@{ip}")
-                        print("------------------------------------------------")
-                        return
-            except Exception:
+                ip = client.get_json(pip_url, headers=headers).get('properties', {}).get('ipAddress')
+            except azhttp.REQUEST_ERRORS:
                 pass
-            
-            print(".", end="", flush=True)
-            time.sleep(10)
-            
-        print("\nTimed out waiting for Public IP.")
-        
+        return ip
+
+def main():
+    try:
+        token = get_cli_token()
+        ip = deploy_template(token)
+        if not ip:
+            print("Deployment finished without a public IP yet. Check the Azure Portal.")
+            return
+        print("------------------------------------------------")
+        print("✅ Deployment Complete!")
+        print(f"Public IP: {ip}")
+        print(f"Connect: ssh -i ollama_key azureuser@{ip}")
+        print("------------------------------------------------")
+
     except Exception as e:
         print(f"FAILED: {e}")
 
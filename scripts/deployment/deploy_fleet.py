@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""Deploy a fleet of Ollama workers across regions in parallel.
+
+Each VM is its own ARM deployment of templates/deploy.json (named
+<prefix>-NNN, with its own NSG, VNet, public IP and NIC) in one resource
+group. Up to --parallel deployments run at once; all of them are followed
+from a single azlro polling loop whose status checks go out as ARM batch
+calls, so bringing up N VMs takes about as long as the slowest one rather
+than N times one.
+
+The fleet is a list of (region, vmSize, count) entries, given with --vm,
+read from a JSON plan or picked from the price database with --best.
+When it is done, the VMs' public IPs are written to an inventory file.
+
+Usage:
+    python3 scripts/deployment/deploy_fleet.py --vm centralindia:Standard_D4as_v5:3 --vm eastus:Standard_D4as_v5:2
+    python3 scripts/deployment/deploy_fleet.py --best 4 --min-vcpu 8 --min-ram 32 --per-region 2
+    python3 scripts/deployment/deploy_fleet.py --plan fleet.json --parallel 10
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import azbatch
+import azhttp
+import azlro
+import aztoken
+import deploy_sp
+import vmquery
+
+MANAGEMENT_URL = "https://management.azure.com"
+RESOURCE_GROUP = "ollama-fleet-rg"
+VM_PREFIX = "ollama-fleet"
+INVENTORY_FILE = "logs/fleet_inventory.json"
+# ARM runs deployments in one resource group side by side; this caps how many at once
+DEFAULT_PARALLEL = 8
+
+
+def parse_vm(text):
+    """REGION:SIZE[:COUNT] -> (region, size, count)."""
+    parts = text.split(":")
+    if len(parts) not in (2, 3) or not all(parts):
+        raise argparse.ArgumentTypeError(f"expected REGION:SIZE[:COUNT], got {text!r}")
+    try:
+        count = int(parts[2]) if len(parts) == 3 else 1
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"count must be a number in {text!r}")
+    return parts[0], parts[1], count
+
+
+def load_plan(path):
+    """Entries from a JSON list of {"region", "vmSize", "count"} objects."""
+    with open(path) as f:
+        plan = json.load(f)
+    return [(e["region"], e["vmSize"], int(e.get("count", 1))) for e in plan]
+
+
+def best_entries(db, regions_wanted, min_vcpu, min_ram, per_region, regions=None):
+    """The cheapest VM in each of the cheapest regions, from the price database."""
+    rows = vmquery.best_for(db, min_vcpu, min_ram, regions)[:regions_wanted]
+    return [(rec["region"], rec["sku"], per_region) for rec in rows]
+
+
+def expand(entries, prefix):
+    """One (name, region, size) per VM, numbered across the whole fleet."""
+    vms = []
+    for region, size, count in entries:
+        for _ in range(count):
+            vms.append((f"{prefix}-{len(vms) + 1:03d}", region, size))
+    return vms
+
+
+def deployment_url(sub_id, resource_group, name):
+    return (f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourcegroups/{resource_group}"
+            f"/providers/Microsoft.Resources/deployments/{name}-deploy?api-version=2021-04-01")
+
+
+def public_ip_url(sub_id, resource_group, name):
+    return (f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourcegroups/{resource_group}"
+            f"/providers/Microsoft.Network/publicIPAddresses/{name}-pip?api-version=2020-11-01")
+
+
+def deploy_fleet(client, headers, sub_id, resource_group, vms, template, ssh_key, parallel, timeout):
+    """Deploy every VM, at most `parallel` at a time; returns one inventory entry per VM."""
+    started = time.monotonic()
+    deadline = started + timeout
+    queue = list(vms)
+    running = []
+    results = {}
+
+    def finished(name, region, size, ip=None, error=None):
+        entry = {"name": name, "region": region, "vmSize": size, "ip": ip,
+                 "status": "Failed" if error else "Succeeded", "seconds": round(time.monotonic() - started)}
+        if error:
+            entry["error"] = str(error)
+            print(f"❌ {name} ({size} in {region}): {error}")
+        else:
+            print(f"✅ {name} ({size} in {region}): {ip or 'no public IP yet'} [{entry['seconds']}s]")
+        results[name] = entry
+
+    while queue or running:
+        # Keep up to `parallel` deployments in flight
+        while queue and len(running) < parallel:
+            name, region, size = queue.pop(0)
+            if time.monotonic() > deadline:
+                finished(name, region, size, error="not started before the timeout")
+                continue
+            payload = deploy_sp.deployment_payload(template, ssh_key, size, name, region)
+            try:
+                response = client.request("PUT", deployment_url(sub_id, resource_group, name), headers, payload)
+            except azhttp.HTTPError as e:
+                try:
+                    detail = azlro.error_message(e.response.json())
+                except ValueError:
+                    detail = e.response.reason
+                finished(name, region, size, error=f"HTTP {e.status} {detail}")
+                continue
+            except azhttp.REQUEST_ERRORS as e:
+                finished(name, region, size, error=e)
+                continue
+            print(f"🚀 {name}: deploying {size} in {region}")
+            running.append(azlro.Operation(client, response, headers, name=(name, region, size)))
+
+        azlro.poll_due(running, deadline, send=azbatch.poller(client, headers))
+        for op in [op for op in running if op.done]:
+            running.remove(op)
+            name, region, size = op.name
+            if op.error is not None:
+                finished(name, region, size, error=op.error)
+                continue
+            ip = op.result.get('properties', {}).get('outputs', {}).get('publicIP', {}).get('value')
+            if not ip:
+                try:
+                    ip = client.get_json(public_ip_url(sub_id, resource_group, name),
+                                         headers=headers).get('properties', {}).get('ipAddress')
+                except azhttp.REQUEST_ERRORS:
+                    pass
+            finished(name, region, size, ip)
+    return [results[name] for name, _, _ in vms]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deploy many Ollama worker VMs across regions in parallel.")
+    parser.add_argument("--vm", dest="vms", action="append", default=[], type=parse_vm, metavar="REGION:SIZE[:COUNT]",
+                        help="VMs to deploy (repeatable)")
+    parser.add_argument("--plan", metavar="FILE", help='JSON list of {"region", "vmSize", "count"} entries')
+    parser.add_argument("--best", type=int, metavar="N",
+                        help="Deploy the cheapest VM of the N cheapest regions from the price database")
+    parser.add_argument("--min-vcpu", type=float, default=0, help="With --best")
+    parser.add_argument("--min-ram", type=float, default=0, help="With --best, GB")
+    parser.add_argument("--region", dest="regions", action="append", default=[],
+                        help="With --best, only consider these regions (repeatable)")
+    parser.add_argument("--per-region", type=int, default=1, help="With --best, VMs per region (default 1)")
+    parser.add_argument("--db", help="Price database for --best (default: first of data/vms.{db,vmdb,json,ndjson})")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL,
+                        help=f"Deployments in flight at once (default {DEFAULT_PARALLEL})")
+    parser.add_argument("--resource-group", default=RESOURCE_GROUP, help=f"default {RESOURCE_GROUP}")
+    parser.add_argument("--prefix", default=VM_PREFIX, help=f"VM name prefix (default {VM_PREFIX})")
+    parser.add_argument("--timeout", type=int, default=deploy_sp.DEPLOY_TIMEOUT,
+                        help=f"Give up on the fleet after this many seconds (default {deploy_sp.DEPLOY_TIMEOUT})")
+    parser.add_argument("--inventory", default=INVENTORY_FILE, help=f"Where to write the IPs (default {INVENTORY_FILE})")
+    parser.add_argument("--dry-run", action="store_true", help="Print the fleet and exit")
+    parser.add_argument("--endpoint", metavar="URL", help="Send ARM requests to URL instead of Azure")
+    args = parser.parse_args(argv)
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+    if not (args.vms or args.plan or args.best):
+        parser.error("nothing to deploy; give --vm, --plan or --best")
+    return args
+
+
+def main(argv=None):
+    global MANAGEMENT_URL
+    args = parse_args(argv)
+    if args.endpoint:
+        MANAGEMENT_URL = args.endpoint.rstrip('/')
+
+    entries = list(args.vms)
+    if args.plan:
+        entries += load_plan(args.plan)
+    if args.best:
+        db = args.db or vmquery.find_db()
+        if not db or not os.path.exists(db):
+            print("❌ Error: no VM database found. Run scripts/builddb.py first!")
+            sys.exit(1)
+        picked = best_entries(db, args.best, args.min_vcpu, args.min_ram, args.per_region, args.regions)
+        if not picked:
+            print("❌ Error: no VM in the database matches that shape.")
+            sys.exit(1)
+        entries += picked
+    vms = expand(entries, args.prefix)
+    if not vms:
+        print("❌ Error: the fleet is empty.")
+        sys.exit(1)
+
+    print(f"Fleet: {len(vms)} VMs in {len({region for _, region, _ in vms})} regions "
+          f"(RG {args.resource_group}, {args.parallel} at a time)")
+    for region, size, count in entries:
+        print(f"  {count} x {size} in {region}")
+    if args.dry_run:
+        return
+
+    try:
+        token = aztoken.get_token()
+    except aztoken.TokenError as e:
+        print(f"❌ Failed to get a token: {e}")
+        sys.exit(1)
+    sub_id = aztoken.subscription_id()
+    if not sub_id:
+        print("❌ Error: no subscription ID; set ARM_SUBSCRIPTION_ID.")
+        sys.exit(1)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    with open(deploy_sp.ARM_TEMPLATE_FILE) as f:
+        template = json.load(f)
+    ssh_key = deploy_sp.read_ssh_key()
+
+    started = time.monotonic()
+    with azhttp.HTTPClient(pool_size=azlro.POLL_WORKERS) as client:
+        rg_url = (f"{MANAGEMENT_URL}/subscriptions/{sub_id}/resourcegroups/{args.resource_group}"
+                  f"?api-version=2021-04-01")
+        try:
+            azlro.run(client, "PUT", rg_url, headers, {"location": vms[0][1]})
+            print(f"✅ Resource Group '{args.resource_group}' ready.")
+        except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+            print(f"❌ Error creating RG: {e}")
+            sys.exit(1)
+        inventory = deploy_fleet(client, headers, sub_id, args.resource_group, vms, template, ssh_key,
+                                 args.parallel, args.timeout)
+    elapsed = time.monotonic() - started
+
+    os.makedirs(os.path.dirname(args.inventory) or ".", exist_ok=True)
+    with open(args.inventory, "w") as f:
+        json.dump({"resourceGroup": args.resource_group,
+                   "deployedAt": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "seconds": round(elapsed), "vms": inventory}, f, indent=2)
+
+    key = deploy_sp.SSH_KEY_FILE[:-len(".pub")]
+    up = [vm for vm in inventory if vm["status"] == "Succeeded"]
+    print("\n------------------------------------------------")
+    print(f"{'✅' if len(up) == len(inventory) else '⚠️'} {len(up)}/{len(inventory)} VMs deployed in {elapsed:.0f}s")
+    for vm in up:
+        if vm["ip"]:
+            print(f"{vm['name']:<20} {vm['region']:<16} ssh -i {key} azureuser@{vm['ip']}")
+    print(f"Inventory: {args.inventory}")
+    print("------------------------------------------------")
+    if len(up) < len(inventory):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,11 @@ import json
 import os
 import subprocess
 import sys
-import time
-import shutil
-import tempfile
-import urllib.parse
-from urllib import request, error
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import azhttp
+import azlro
+import aztoken
 
 # ==========================================
 # Service Principal Config (Fill these in!)
@@ -28,6 +28,9 @@ LOCATION = "centralindia"
 DEPLOYMENT_NAME = "ollama-sp-deploy"
 ARM_TEMPLATE_FILE = "templates/deploy.json"
 SSH_KEY_FILE = "keys/ollama_key.pub"
+PIP_NAME = "ollama-worker-pip"
+# Give up on the deployment after this long (it normally takes 2-4 minutes)
+DEPLOY_TIMEOUT = 1200
 
 def run_command(command, env=None):
     try:
@@ -40,62 +43,59 @@ def run_command(command, env=None):
         return None
 
 def get_sp_token():
-    """Get access token using Service Principal."""
+    """Get access token using Service Principal (cached across runs)."""
     if not CLIENT_ID or not CLIENT_SECRET:
         print("❌ Error: CLIENT_ID and CLIENT_SECRET must be set.")
         sys.exit(1)
 
     print(f"Getting token for SP {CLIENT_ID}...")
-    
-    url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/token"
-    data = urllib.parse.urlencode({
-        'grant_type': 'client_credentials',
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'resource': 'https://management.azure.com/'
-    }).encode('utf-8')
-    
-    req = request.Request(url, data=data, method='POST')
     try:
-        with request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            return result['access_token']
-    except error.HTTPError as e:
+        return aztoken.sp_token(CLIENT_ID, CLIENT_SECRET, TENANT_ID)
+    except aztoken.TokenError as e:
         print(f"❌ Failed to login as Service Principal: {e}")
-        print(e.read().decode())
         sys.exit(1)
 
-def deploy_template(token):
-    """Deploy ARM template using REST API."""
-    print(f"Deploying ARM template to RG: {RESOURCE_GROUP}...")
-    
-    # Read ARM template
-    with open(ARM_TEMPLATE_FILE, 'r') as f:
-        template = json.load(f)
-        
-    # Read SSH Key
+def read_ssh_key():
+    """Public key put on the VMs, generating a key pair first if there is none."""
     if not os.path.exists(SSH_KEY_FILE):
         print("Generating new SSH key...")
-        subprocess.run(f'ssh-keygen -t rsa -b 4096 -f ollama_key -N "" -q', shell=True)
+        os.makedirs(os.path.dirname(SSH_KEY_FILE), exist_ok=True)
+        subprocess.run(f'ssh-keygen -t rsa -b 4096 -f {SSH_KEY_FILE[:-len(".pub")]} -N "" -q', shell=True)
         
     with open(SSH_KEY_FILE, 'r') as f:
-        ssh_key = f.read().strip()
-        
-    # Prepare payload
-    payload = {
+        return f.read().strip()
+
+def deployment_payload(template, ssh_key, vm_size="Standard_E8as_v5", vm_name=None, location=None):
+    """Incremental deployment of the ARM template; vm_name/location default to the template's."""
+    parameters = {
+        "sshPublicKey": {
+            "value": ssh_key
+        },
+        "vmSize": {
+            "value": vm_size
+        }
+    }
+    if vm_name:
+        parameters["vmName"] = {"value": vm_name}
+    if location:
+        parameters["location"] = {"value": location}
+    return {
         "properties": {
             "mode": "Incremental",
             "template": template,
-            "parameters": {
-                "sshPublicKey": {
-                    "value": ssh_key
-                },
-                "vmSize": {
-                    "value": "Standard_E8as_v5" 
-                }
-            }
+            "parameters": parameters
         }
     }
+
+def deploy_template(token):
+    """Deploy ARM template using REST API."""
+    print(f"Deploying ARM template to RG: {RESOURCE_GROUP}...")
+    
+    # Read ARM template
+    with open(ARM_TEMPLATE_FILE, 'r') as f:
+        template = json.load(f)
+        
+    payload = deployment_payload(template, read_ssh_key())
     
     # Headers
     headers = {
@@ -103,55 +103,55 @@ def deploy_template(token):
         "Content-Type": "application/json"
     }
     
-    # 1. Ensure Resource Group Exists
-    rg_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}?api-version=2021-04-01"
-    rg_body = json.dumps({"location": LOCATION})
-    req = request.Request(rg_url, data=rg_body.encode('utf-8'), headers=headers, method='PUT')
-    try:
-        with request.urlopen(req) as response:
+    with azhttp.HTTPClient(pool_size=1) as client:
+        # 1. Ensure Resource Group Exists
+        rg_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}?api-version=2021-04-01"
+        try:
+            azlro.run(client, "PUT", rg_url, headers, {"location": LOCATION})
             print(f"✅ Resource Group '{RESOURCE_GROUP}' ready.")
-    except error.HTTPError as e:
-        print(f"❌ Error creating RG: {e.read().decode()}")
-        sys.exit(1)
-        
-    # 2. Deploy
-    deploy_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Resources/deployments/{DEPLOYMENT_NAME}?api-version=2021-04-01"
-    data = json.dumps(payload).encode('utf-8')
-    req = request.Request(deploy_url, data=data, headers=headers, method='PUT')
-    
-    print("🚀 Sending deployment request...")
-    try:
-        with request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            print("Deployment accepted!")
-    except error.HTTPError as e:
-        print(f"❌ Deployment failed: {e.code} {e.reason}")
-        print(e.read().decode())
-        sys.exit(1)
+        except azhttp.HTTPError as e:
+            print(f"❌ Error creating RG: {e.response.body.decode(errors='replace')}")
+            sys.exit(1)
+        except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+            print(f"❌ Error creating RG: {e}")
+            sys.exit(1)
 
-    # 3. Poll for IP
-    print("⏳ Polling for Public IP (timeout 180s)...")
-    for i in range(18):
-        pip_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Network/publicIPAddresses/ollama-worker-pip?api-version=2020-11-01"
-        req = request.Request(pip_url, headers=headers, method='GET')
+        # 2. Deploy, following ARM's async operation until it finishes
+        deploy_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Resources/deployments/{DEPLOYMENT_NAME}?api-version=2021-04-01"
+        print("🚀 Sending deployment request...")
         try:
-            with request.urlopen(req) as response:
-                data = json.loads(response.read().decode())
-                ip = data.get('properties', {}).get('ipAddress')
-                if ip:
-                    print("\n------------------------------------------------")
-                    print("✅ Deployment Complete!")
-                    print(f"Public IP: {ip}")
-                    print(f"Connect: ssh -i ollama_key azureuser@{ip}")
-                    print("------------------------------------------------")
-                    return
-        except Exception:
-            pass
-        
-        print(".", end="", flush=True)
-        time.sleep(10)
-        
-    print("\n⚠️ Timed out waiting for Public IP.")
+            response = client.request("PUT", deploy_url, headers=headers, body=payload)
+        except azhttp.HTTPError as e:
+            print(f"❌ Deployment failed: {e.status} {e.response.reason}")
+            print(e.response.body.decode(errors='replace'))
+            sys.exit(1)
+        except azhttp.REQUEST_ERRORS as e:
+            print(f"❌ Deployment failed: {e}")
+            sys.exit(1)
+        print("Deployment accepted!")
+        print(f"⏳ Waiting for the deployment (timeout {DEPLOY_TIMEOUT}s)...")
+        try:
+            deployment = azlro.wait(client, response, headers, timeout=DEPLOY_TIMEOUT, on_poll=azlro.progress_dots)
+        except (azlro.OperationFailed, *azhttp.REQUEST_ERRORS) as e:
+            print(f"\n❌ Deployment failed: {e}")
+            sys.exit(1)
+
+        # 3. The template outputs the public IP; read the resource if it doesn't
+        ip = deployment.get('properties', {}).get('outputs', {}).get('publicIP', {}).get('value')
+        if not ip:
+            pip_url = f"https://management.azure.com/subscriptions/{SUBSCRIPTION_ID}/resourcegroups/{RESOURCE_GROUP}/providers/Microsoft.Network/publicIPAddresses/{PIP_NAME}?api-version=2020-11-01"
+            try:
+                ip = client.get_json(pip_url, headers=headers).get('properties', {}).get('ipAddress')
+            except azhttp.REQUEST_ERRORS:
+                pass
+    if not ip:
+        print("\n⚠️ Deployment succeeded but the public IP isn't assigned yet.")
+        return
+    print("\n------------------------------------------------")
+    print("✅ Deployment Complete!")
+    print(f"Public IP: {ip}")
+    print(f"Connect: ssh -i ollama_key azureuser@{ip}")
+    print("------------------------------------------------")
 
 if __name__ == "__main__":
     if len(sys.argv) == 3:
@@ -1,11 +1,8 @@
 #!/bin/bash
+# Thin wrapper around the Python search engine (vmquery.py search).
+# Works on any database builddb.py writes; set DB_FILE to pick one explicitly.
 
-DB_FILE="vms.json"
-
-if [ ! -f "$DB_FILE" ]; then
-    echo "Error: $DB_FILE not found. Run ./builddb.py first!"
-    exit 1
-fi
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
 MAX_PRICE=$1
 
@@ -15,13 +12,12 @@ if [ -z "$MAX_PRICE" ]; then
     exit 1
 fi
 
-# Use jq to filter, sort, and format the output
-jq -r --argjson budget "$MAX_PRICE" '
-  map(select(.price <= $budget))
-  | sort_by(.price)
-  | .[]
-  | "\(.region) | \(.sku) | \(.vcpu) vCPU | \(.ram) GB | $\(.price)/hr"
-' "$DB_FILE" | column -t -s "|" | head -n 20
+DB_ARGS=()
+if [ -n "$DB_FILE" ]; then
+    DB_ARGS=(--db "$DB_FILE")
+fi
+
+python3 "$SCRIPT_DIR/vmquery.py" "${DB_ARGS[@]}" search --max-price "$MAX_PRICE" --limit 20 || exit 1
 
 echo "..."
 echo "Showing top 20 results (sorted by price cheapest first)."
@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""Read and write the VM price database produced by builddb.py.
+
+Four on-disk formats hold the same records ({region, sku, vcpu, ram, price},
+plus the subscription that can deploy the SKU, the price's currency, its
+pricing tier and OS in databases built since multi-subscription builds; see
+KEY_COLUMNS):
+
+- json:     a JSON array. builddb writes one record per line so it can be
+            streamed; older pretty-printed files are still readable.
+- ndjson:   one JSON record per line, no surrounding array.
+- columnar: compact binary file (.vmdb) with interned region/SKU string
+            tables and fixed-width array columns, loaded with mmap.
+- sqlite:   indexed SQLite database (.db/.sqlite), queried via vmquery.py.
+
+Next to any of them builddb writes `<path>.frontier.json`: per tier, currency
+and region, the Pareto frontier of (price, vcpu, ram) with precomputed vcpu/ram-per-dollar,
+so "cheapest VM with at least N GB" never has to touch the full database.
+
+The json/ndjson writer appends a region's records as soon as they are ready
+into `<path>.partial` and only renames it over `<path>` in finalize(), so
+readers never see a half-written database and a crashed build keeps what it
+had. The sqlite writer commits each region as it arrives and builds its
+indexes at finalize(). The columnar writer holds its (small) columns in
+memory and writes the file in one go at finalize().
+
+Usage:
+    python3 scripts/vmdb.py convert data/vms.json data/vms.vmdb
+"""
+import argparse
+import itertools
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import urllib.parse
+from array import array
+
+FORMATS = ("json", "ndjson", "columnar", "sqlite")
+PARTIAL_SUFFIX = ".partial"
+
+# String keys a record carries besides region and sku, in this order. Older
+# databases don't have them; a missing currency or tier means the default
+# (KEY_DEFAULTS). Reservations are OS-independent, so their records have no os.
+KEY_COLUMNS = ("subscription", "currency", "tier", "os")
+DEFAULT_CURRENCY = "USD"
+DEFAULT_TIER = "ondemand"
+KEY_DEFAULTS = {"currency": DEFAULT_CURRENCY, "tier": DEFAULT_TIER}
+# Pricing tiers; price is always the effective hourly cost in that tier
+TIERS = ("ondemand", "spot", "lowpriority", "reserved1y", "reserved3y", "savings1y", "savings3y")
+
+# Columnar layout (all little-endian):
+#   header  = COLUMNAR_HEADER, then one COLUMNAR_KEY per key column (v3+)
+#   strings = "\n".join(regions + skus + each key's values), utf-8
+#   columns = region_idx, sku_idx (H or I), vcpu, ram, price (d),
+#             then one index column per key (v3+), each starting on an
+#             8-byte boundary so it can be cast in place.
+# Version 2 files store rows in ascending price order, so budget scans can
+# stop at the first row over the limit. Version 1 files are unordered.
+# Version 3 adds the key columns; an empty key string means "not recorded".
+# Version 4 adds tier and os to them.
+COLUMNAR_MAGIC = b"VMDB"
+COLUMNAR_VERSION = 4
+COLUMNAR_READABLE_VERSIONS = (1, 2, 3, 4)
+COLUMNAR_KEY_COLUMNS = {3: ("subscription", "currency"), 4: KEY_COLUMNS}
+COLUMNAR_HEADER = struct.Struct("<4sHccQIIQQQQQQQ")
+COLUMNAR_KEY = struct.Struct("<c3xIQ")   # typecode, number of strings, column offset
+FLOAT_COLUMNS = ("vcpu", "ram", "price")
+
+SQLITE_MAGIC = b"SQLite format 3\0"
+# price_per_vcpu / price_per_gb are precomputed at build time so ranking by
+# efficiency is an index walk instead of a sort over every row
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vms (
+    region         TEXT NOT NULL,
+    sku            TEXT NOT NULL,
+    vcpu           REAL NOT NULL,
+    ram            REAL NOT NULL,
+    price          REAL NOT NULL,
+    price_per_vcpu REAL NOT NULL,
+    price_per_gb   REAL NOT NULL,
+    subscription   TEXT,
+    currency       TEXT,
+    tier           TEXT,
+    os             TEXT
+);
+"""
+# Built after the bulk load: budget scans, per-region budgets, SKU and shape
+# lookups, efficiency rankings
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_vms_price ON vms(price);
+CREATE INDEX IF NOT EXISTS idx_vms_region_price ON vms(region, price);
+CREATE INDEX IF NOT EXISTS idx_vms_sku ON vms(sku);
+CREATE INDEX IF NOT EXISTS idx_vms_vcpu_ram ON vms(vcpu, ram);
+CREATE INDEX IF NOT EXISTS idx_vms_price_per_vcpu ON vms(price_per_vcpu);
+CREATE INDEX IF NOT EXISTS idx_vms_price_per_gb ON vms(price_per_gb);
+CREATE INDEX IF NOT EXISTS idx_vms_currency_price ON vms(currency, price);
+CREATE INDEX IF NOT EXISTS idx_vms_tier_price ON vms(tier, price);
+CREATE INDEX IF NOT EXISTS idx_vms_key ON vms(subscription, region, sku, currency, tier, os);
+"""
+FRONTIER_SUFFIX = ".frontier.json"
+
+
+def record_currency(rec):
+    """Currency of a record's price; records from older builds are in DEFAULT_CURRENCY."""
+    return rec.get("currency") or DEFAULT_CURRENCY
+
+
+def record_tier(rec):
+    """Pricing tier of a record; records from older builds count as DEFAULT_TIER."""
+    return rec.get("tier") or DEFAULT_TIER
+
+
+def guess_format(path):
+    """Pick a format from the file extension; json when unknown."""
+    if path.endswith(".vmdb"):
+        return "columnar"
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return "sqlite"
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "json"
+
+
+def _read_magic(path, size=16):
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+def is_columnar(path):
+    return _read_magic(path).startswith(COLUMNAR_MAGIC)
+
+
+def is_sqlite(path):
+    return _read_magic(path) == SQLITE_MAGIC
+
+
+def open_writer(path, fmt=None):
+    """Return the writer for the requested format (all share one interface)."""
+    fmt = fmt or guess_format(path)
+    if fmt == "columnar":
+        return ColumnarWriter(path)
+    if fmt == "sqlite":
+        return SQLiteWriter(path)
+    return StreamingWriter(path, fmt)
+
+
+class StreamingWriter:
+    """Append records region by region, then atomically publish the file."""
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or guess_format(path)
+        if self.fmt not in ("json", "ndjson"):
+            raise ValueError(f"Unknown database format: {self.fmt}")
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.count = 0
+        self._file = open(self.partial_path, "w")
+        if self.fmt == "json":
+            self._file.write("[")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.abort()
+
+    def write_records(self, records):
+        """Append a batch of records and flush them to disk."""
+        f = self._file
+        for rec in records:
+            line = json.dumps(rec, separators=(",", ":"))
+            if self.fmt == "json":
+                f.write(",\n" if self.count else "\n")
+                f.write(line)
+            else:
+                f.write(line)
+                f.write("\n")
+            self.count += 1
+        f.flush()
+
+    def finalize(self):
+        """Close the partial file and rename it over the target path."""
+        if self._file is None:
+            return
+        if self.fmt == "json":
+            self._file.write("\n]\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        """Stop writing; the .partial file is left behind for inspection."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _iter_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(path):
+    """Lazily yield records from a json, ndjson or columnar database file.
+
+    Files written by StreamingWriter (and partial files from a crashed build)
+    are read line by line. Legacy pretty-printed arrays fall back to a full
+    json.load since they cannot be split per line.
+    """
+    magic = _read_magic(path)
+    if magic.startswith(COLUMNAR_MAGIC):
+        with ColumnarDB(path) as db:
+            yield from db
+        return
+    if magic == SQLITE_MAGIC:
+        conn = connect_sqlite(path)
+        try:
+            columns = ["region", "sku", "vcpu", "ram", "price"] + sqlite_key_columns(conn)
+            for row in conn.execute(f"SELECT {', '.join(columns)} FROM vms ORDER BY rowid"):
+                yield {name: value for name, value in zip(columns, row) if value is not None}
+        finally:
+            conn.close()
+        return
+
+    with open(path) as f:
+        first = f.readline()
+        head = first.strip()
+        if not head.startswith("["):
+            yield from _iter_ndjson(itertools.chain([first], f))
+            return
+        if head != "[":
+            # Whole array on one line (e.g. "[]" or a compact dump)
+            f.seek(0)
+            yield from json.load(f)
+            return
+
+        yielded = False
+        for line in f:
+            line = line.strip()
+            if line.endswith(","):
+                line = line[:-1]
+            if not line:
+                continue
+            if line == "]":
+                return
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                if yielded:
+                    raise
+                break
+            yielded = True
+            yield rec
+        else:
+            return
+
+    # Legacy multi-line array written with indent=2
+    with open(path) as f:
+        yield from json.load(f)
+
+
+def load_records(path):
+    return list(iter_records(path))
+
+
+def _pad8(f):
+    pos = f.tell()
+    if pos % 8:
+        f.write(b"\0" * (8 - pos % 8))
+    return f.tell()
+
+
+class ColumnarWriter:
+    """Build a columnar database in memory-light arrays, then write it out.
+
+    Same write_records()/finalize()/abort() interface as StreamingWriter.
+    Only the compact columns are kept while the build runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fmt = "columnar"
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.count = 0
+        self._regions = {}
+        self._skus = {}
+        self._region_idx = array("I")
+        self._sku_idx = array("I")
+        self._columns = {name: array("d") for name in FLOAT_COLUMNS}
+        self._keys = {name: {} for name in KEY_COLUMNS}
+        self._key_idx = {name: array("I") for name in KEY_COLUMNS}
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.abort()
+
+    def write_records(self, records):
+        regions, skus = self._regions, self._skus
+        vcpu, ram, price = (self._columns[name] for name in FLOAT_COLUMNS)
+        for rec in records:
+            self._region_idx.append(regions.setdefault(rec["region"], len(regions)))
+            self._sku_idx.append(skus.setdefault(rec["sku"], len(skus)))
+            vcpu.append(rec["vcpu"])
+            ram.append(rec["ram"])
+            price.append(rec["price"])
+            for name in KEY_COLUMNS:
+                table = self._keys[name]
+                self._key_idx[name].append(table.setdefault(rec.get(name) or "", len(table)))
+            self.count += 1
+
+    def finalize(self):
+        if self._done:
+            return
+        self._done = True
+        regions = list(self._regions)
+        skus = list(self._skus)
+        keys = [list(self._keys[name]) for name in KEY_COLUMNS]
+        strings = "\n".join(regions + skus + [value for values in keys for value in values]).encode("utf-8")
+        region_code = "H" if len(regions) <= 0xFFFF else "I"
+        sku_code = "H" if len(skus) <= 0xFFFF else "I"
+        key_codes = ["H" if len(values) <= 0xFFFF else "I" for values in keys]
+
+        # Store rows cheapest first (see COLUMNAR_VERSION)
+        price = self._columns["price"]
+        order = sorted(range(self.count), key=price.__getitem__)
+        columns = [
+            array(region_code, (self._region_idx[i] for i in order)),
+            array(sku_code, (self._sku_idx[i] for i in order)),
+        ] + [array("d", (self._columns[name][i] for i in order)) for name in FLOAT_COLUMNS]
+        columns += [array(code, (self._key_idx[name][i] for i in order))
+                    for name, code in zip(KEY_COLUMNS, key_codes)]
+        if sys.byteorder != "little":
+            for col in columns:
+                col.byteswap()
+
+        with open(self.partial_path, "wb") as f:
+            f.write(b"\0" * (COLUMNAR_HEADER.size + COLUMNAR_KEY.size * len(KEY_COLUMNS)))
+            strings_off = _pad8(f)
+            f.write(strings)
+            offsets = []
+            for col in columns:
+                offsets.append(_pad8(f))
+                col.tofile(f)
+            base_columns = 2 + len(FLOAT_COLUMNS)
+            f.seek(0)
+            f.write(COLUMNAR_HEADER.pack(
+                COLUMNAR_MAGIC, COLUMNAR_VERSION,
+                region_code.encode(), sku_code.encode(),
+                self.count, len(regions), len(skus),
+                strings_off, len(strings), *offsets[:base_columns],
+            ))
+            for code, values, offset in zip(key_codes, keys, offsets[base_columns:]):
+                f.write(COLUMNAR_KEY.pack(code.encode(), len(values), offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        """Nothing is on disk until finalize(), so there is nothing to keep."""
+        self._done = True
+
+
+class ColumnarDB:
+    """Memory-mapped read access to a columnar database.
+
+    regions/skus are the interned string tables; region_idx, sku_idx, vcpu,
+    ram and price are memoryviews over the mapped file (no copy is made on
+    little-endian hosts), indexable like lists. price_sorted tells whether
+    rows are in ascending price order. keys maps each key column the file
+    has (KEY_COLUMNS since version 4) to (strings, index column).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, region_code, sku_code, n, n_regions, n_skus,
+         strings_off, strings_len, *offsets) = COLUMNAR_HEADER.unpack_from(self._mm, 0)
+        if magic != COLUMNAR_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a columnar VM database")
+        if version not in COLUMNAR_READABLE_VERSIONS:
+            self.close()
+            raise ValueError(f"{path}: unsupported columnar version {version}")
+        self.price_sorted = version >= 2
+        key_names = COLUMNAR_KEY_COLUMNS.get(version, ())
+        key_entries = [COLUMNAR_KEY.unpack_from(self._mm, COLUMNAR_HEADER.size + i * COLUMNAR_KEY.size)
+                       for i in range(len(key_names))]
+
+        names = bytes(self._mm[strings_off:strings_off + strings_len]).decode("utf-8")
+        names = names.split("\n") if names else []
+        self.regions = names[:n_regions]
+        self.skus = names[n_regions:n_regions + n_skus]
+        key_strings = []
+        start = n_regions + n_skus
+        for _, count, _ in key_entries:
+            key_strings.append(names[start:start + count])
+            start += count
+        self._count = n
+
+        self._views = []
+        typecodes = [region_code.decode(), sku_code.decode()] + ["d"] * len(FLOAT_COLUMNS)
+        typecodes += [code.decode() for code, _, _ in key_entries]
+        offsets = list(offsets) + [offset for _, _, offset in key_entries]
+        columns = []
+        for off, code in zip(offsets, typecodes):
+            size = array(code).itemsize * n
+            if sys.byteorder == "little":
+                view = memoryview(self._mm)[off:off + size].cast(code)
+                self._views.append(view)
+                columns.append(view)
+            else:
+                col = array(code, self._mm[off:off + size])
+                col.byteswap()
+                columns.append(col)
+        self.region_idx, self.sku_idx, self.vcpu, self.ram, self.price = columns[:5]
+        self.keys = {name: (strings, column)
+                     for name, strings, column in zip(key_names, key_strings, columns[5:])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, i):
+        rec = {
+            "region": self.regions[self.region_idx[i]],
+            "sku": self.skus[self.sku_idx[i]],
+            "vcpu": self.vcpu[i],
+            "ram": self.ram[i],
+            "price": self.price[i],
+        }
+        for name, (strings, column) in self.keys.items():
+            if strings[column[i]]:
+                rec[name] = strings[column[i]]
+        return rec
+
+    def __iter__(self):
+        if self.keys:
+            for i in range(self._count):
+                yield self.record(i)
+            return
+        regions, skus = self.regions, self.skus
+        for r, s, v, m, p in zip(self.region_idx, self.sku_idx, self.vcpu, self.ram, self.price):
+            yield {"region": regions[r], "sku": skus[s], "vcpu": v, "ram": m, "price": p}
+
+    def close(self):
+        for view in getattr(self, "_views", []):
+            view.release()
+        self._views = []
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SQLiteWriter:
+    """Load records into an indexed SQLite database.
+
+    Same write_records()/finalize()/abort() interface as StreamingWriter; each
+    batch is committed to `<path>.partial` and indexes are built once at the end.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fmt = "sqlite"
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.count = 0
+        if os.path.exists(self.partial_path):
+            os.unlink(self.partial_path)
+        self._conn = sqlite3.connect(self.partial_path)
+        # The partial file is thrown away on failure, so skip the fsyncs
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.executescript(SQLITE_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.abort()
+
+    def write_records(self, records):
+        rows = [(r["region"], r["sku"], r["vcpu"], r["ram"], r["price"],
+                 r["price"] / r["vcpu"], r["price"] / r["ram"],
+                 r.get("subscription"), r.get("currency"), r.get("tier"), r.get("os")) for r in records]
+        with self._conn:
+            self._conn.executemany("INSERT INTO vms VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.count += len(rows)
+
+    def finalize(self):
+        if self._conn is None:
+            return
+        with self._conn:
+            self._conn.executescript(SQLITE_INDEXES)
+        self._conn.execute("ANALYZE")
+        self._conn.close()
+        self._conn = None
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def connect_sqlite(path):
+    """Open a SQLite price database read-only."""
+    uri = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def sqlite_key_columns(conn):
+    """The KEY_COLUMNS this SQLite database has (none for older databases)."""
+    names = {row[1] for row in conn.execute("PRAGMA table_info(vms)")}
+    return [name for name in KEY_COLUMNS if name in names]
+
+
+def pareto_frontier(records):
+    """Records not dominated on (lower price, more vcpu, more ram), cheapest first.
+
+    Entries get vcpu_per_dollar and ram_per_dollar added. Zero-priced meters
+    are left out: they would dominate everything and are not real offers.
+    """
+    candidates = sorted((r for r in records if r["price"] > 0),
+                        key=lambda r: (r["price"], -r["vcpu"], -r["ram"]))
+    frontier = []
+    for rec in candidates:
+        # Everything already kept is at most as expensive, so rec only
+        # survives if no kept entry matches it on both vcpu and ram
+        if any(f["vcpu"] >= rec["vcpu"] and f["ram"] >= rec["ram"] for f in frontier):
+            continue
+        frontier.append(rec)
+    return [dict(rec,
+                 vcpu_per_dollar=rec["vcpu"] / rec["price"],
+                 ram_per_dollar=rec["ram"] / rec["price"]) for rec in frontier]
+
+
+def frontier_path(path):
+    """Sidecar path for a database: data/vms.json -> data/vms.json.frontier.json.
+
+    The extension stays in the name so databases of different formats built
+    into one directory (vms.json, vms.vmdb) each get their own.
+    """
+    return path + FRONTIER_SUFFIX
+
+
+class FrontierWriter:
+    """Collect per-tier, per-currency, per-region Pareto frontiers during a build, write them at the end.
+
+    Prices in different currencies can't be compared, and a Spot price would
+    dominate every on-demand one, so each (tier, currency) gets its own
+    frontier; subscriptions and OSes share one (entries keep theirs).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.frontiers = {}       # tier -> currency -> region -> frontier
+
+    def add_region(self, region, records):
+        groups = {}
+        for rec in records:
+            groups.setdefault((record_tier(rec), record_currency(rec)), []).append(rec)
+        for (tier, currency), recs in groups.items():
+            by_region = self.frontiers.setdefault(tier, {}).setdefault(currency, {})
+            frontier = pareto_frontier(by_region.get(region, []) + recs)
+            if frontier:
+                by_region[region] = frontier
+
+    def finalize(self):
+        data = json.dumps({"tiers": self.frontiers}, separators=(",", ":"), sort_keys=True)
+        tmp = self.path + PARTIAL_SUFFIX
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+def load_frontier(path, currency=None, tier=None):
+    """Return {region: [frontier entries]} for one currency and tier (defaults
+    DEFAULT_CURRENCY, DEFAULT_TIER) from a sidecar file."""
+    with open(path) as f:
+        data = json.load(f)
+    currency = (currency or DEFAULT_CURRENCY).upper()
+    tier = tier or DEFAULT_TIER
+    if "tiers" in data:
+        return data["tiers"].get(tier, {}).get(currency, {})
+    # Older sidecars hold one unlabelled tier, and before multi-currency
+    # builds one unlabelled currency
+    if tier != DEFAULT_TIER:
+        return {}
+    if "regions" in data:
+        return data["regions"] if currency == DEFAULT_CURRENCY else {}
+    return data["currencies"].get(currency, {})
+
+
+def convert(src, dst, fmt=None):
+    """Rewrite a database in another format (and its frontier). Returns the record count."""
+    frontier = FrontierWriter(frontier_path(dst))
+    by_region = {}
+    with open_writer(dst, fmt) as writer:
+        for rec in iter_records(src):
+            by_region.setdefault(rec["region"], []).append(rec)
+        for region, records in by_region.items():
+            writer.write_records(records)
+            frontier.add_region(region, records)
+    frontier.finalize()
+    return writer.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VM price database tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    conv = sub.add_parser("convert", help="Convert a database between formats")
+    conv.add_argument("src")
+    conv.add_argument("dst")
+    conv.add_argument("--format", choices=FORMATS, default=None,
+                      help="Output format (default: from the destination extension)")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        count = convert(args.src, args.dst, args.format)
+        print(f"Wrote {count} records to {args.dst}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Append-only price history for the VM price database.
+
+Every builddb.py run appends one snapshot to `<path>.history` next to the
+database (data/vms.json -> data/vms.json.history). A snapshot only holds the
+prices that changed since the previous one, so daily builds of a database
+whose prices rarely move cost a few KB each instead of a full copy.
+
+A price series is keyed by (region, sku, tier, os, currency); prices are
+public, so subscriptions share one series. File layout:
+
+    HISTORY_MAGIC, then one segment per build:
+    SEGMENT_HEADER (build time, payload length, crc32 of payload)
+    payload = zlib(varint-encoded):
+        new keys:     count, byte length, "\\n".join("\\t".join(key))
+        changed keys: count, then per key in id order the id delta and the
+                      zigzag delta of the price in millionths from the
+                      key's previous price
+        removed keys: count, then the id deltas
+
+Keys get ids in order of first appearance. A torn trailing segment (from a
+crashed build) is ignored when reading and overwritten by the next append.
+
+Usage:
+    python3 scripts/vmhistory.py info data/vms.json.history
+"""
+import argparse
+import datetime
+import os
+import struct
+import sys
+import zlib
+
+import vmdb
+
+HISTORY_MAGIC = b"VMHIST01"
+HISTORY_SUFFIX = ".history"
+SEGMENT_HEADER = struct.Struct("<dII")
+# Prices are stored as integer millionths; retail prices have at most 6 decimals
+PRICE_SCALE = 1000000
+
+
+def history_path(path):
+    """History path for a database: data/vms.json -> data/vms.json.history.
+
+    Like vmdb.frontier_path(), one per database file, not per name: a .json
+    and a .vmdb build of the same data must not append to one history.
+    """
+    return path + HISTORY_SUFFIX
+
+
+def series_key(rec):
+    """(region, sku, tier, os, currency) of a record; os is "" when not recorded."""
+    return (rec["region"], rec["sku"], vmdb.record_tier(rec), rec.get("os") or "", vmdb.record_currency(rec))
+
+
+def _put_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _unzigzag(n):
+    return n // 2 if not n & 1 else -(n + 1) // 2
+
+
+class PriceHistory:
+    """Read access to a history file, fully loaded.
+
+    keys lists the series keys by id, series holds each key's
+    [(build time, price or None once removed)] and timestamps every build's
+    time, ascending. With series=False only the latest prices are kept,
+    which is all appending needs.
+    """
+
+    def __init__(self, path, series=True):
+        self.path = path
+        self._keep_series = series
+        self.keys = []
+        self.series = []
+        self.timestamps = []
+        self.current = {}          # key id -> price in millionths, for keys still listed
+        self._ids = {}
+        self.end = len(HISTORY_MAGIC)   # offset after the last good segment
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(HISTORY_MAGIC):
+            raise ValueError(f"{self.path} is not a VM price history file")
+        pos = len(HISTORY_MAGIC)
+        while pos + SEGMENT_HEADER.size <= len(data):
+            timestamp, length, crc = SEGMENT_HEADER.unpack_from(data, pos)
+            start = pos + SEGMENT_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            self._apply(timestamp, zlib.decompress(payload))
+            pos = self.end = start + length
+
+    def _apply(self, timestamp, buf):
+        self.timestamps.append(timestamp)
+        count, pos = _get_varint(buf, 0)
+        size, pos = _get_varint(buf, pos)
+        if count:
+            for line in buf[pos:pos + size].decode("utf-8").split("\n"):
+                self._add_key(tuple(line.split("\t")))
+        pos += size
+        count, pos = _get_varint(buf, pos)
+        key_id = 0
+        for _ in range(count):
+            delta, pos = _get_varint(buf, pos)
+            key_id += delta
+            change, pos = _get_varint(buf, pos)
+            price = self.current.get(key_id, 0) + _unzigzag(change)
+            self.current[key_id] = price
+            if self._keep_series:
+                self.series[key_id].append((timestamp, price / PRICE_SCALE))
+        count, pos = _get_varint(buf, pos)
+        key_id = 0
+        for _ in range(count):
+            delta, pos = _get_varint(buf, pos)
+            key_id += delta
+            self.current.pop(key_id, None)
+            if self._keep_series:
+                self.series[key_id].append((timestamp, None))
+
+    def _add_key(self, key):
+        self._ids[key] = len(self.keys)
+        self.keys.append(key)
+        self.series.append([])
+        return self._ids[key]
+
+    def find(self, region=None, sku=None, tier=None, os_type=None, currency=None):
+        """Ids of the series matching every given key part."""
+        wanted = (region, sku, tier, os_type, currency.upper() if currency else None)
+        return [i for i, key in enumerate(self.keys)
+                if all(w is None or w == part for w, part in zip(wanted, key))]
+
+    def price_at(self, key_id, when):
+        """Price of a series as of time `when`, or None (not listed then)."""
+        price = None
+        for timestamp, value in self.series[key_id]:
+            if timestamp > when:
+                break
+            price = value
+        return price
+
+    def window(self, key_id, start, end):
+        """(min, max, last, changes) of the prices in effect between start and end, or None.
+
+        last is None when the series was delisted by the end of the window.
+        """
+        prices = []
+        for timestamp, value in self.series[key_id]:
+            if timestamp > end:
+                break
+            if timestamp <= start:
+                prices = [value]
+            else:
+                prices.append(value)
+        listed = [p for p in prices if p is not None]
+        if not listed:
+            return None
+        return min(listed), max(listed), prices[-1], len(prices) - 1
+
+    def encode(self, snapshot, scope=None):
+        """Payload for a snapshot ({key: price}) against the current state, and its change count.
+
+        Keys missing from the snapshot are only recorded as removed when the
+        snapshot covers their (region, tier, currency) and, if given,
+        scope(key) is true, so a build limited to some tiers, currencies,
+        families or OSes doesn't delist the others.
+        """
+        scale = PRICE_SCALE
+        new_keys = [key for key in snapshot if key not in self._ids]
+        ids = dict(self._ids)
+        for key in new_keys:
+            ids[key] = len(ids)
+        changed = []
+        for key, price in snapshot.items():
+            key_id = ids[key]
+            micro = round(price * scale)
+            previous = self.current.get(key_id)
+            if previous != micro:
+                changed.append((key_id, micro - (previous or 0)))
+        covered = {(key[0], key[2], key[4]) for key in snapshot}
+        removed = [key_id for key_id in self.current
+                   if self.keys[key_id] not in snapshot
+                   and (self.keys[key_id][0], self.keys[key_id][2], self.keys[key_id][4]) in covered
+                   and (scope is None or scope(self.keys[key_id]))]
+
+        out = bytearray()
+        names = "\n".join("\t".join(key) for key in new_keys).encode("utf-8")
+        _put_varint(out, len(new_keys))
+        _put_varint(out, len(names))
+        out += names
+        _put_varint(out, len(changed))
+        last = 0
+        for key_id, delta in sorted(changed):
+            _put_varint(out, key_id - last)
+            _put_varint(out, _zigzag(delta))
+            last = key_id
+        _put_varint(out, len(removed))
+        last = 0
+        for key_id in sorted(removed):
+            _put_varint(out, key_id - last)
+            last = key_id
+        return bytes(out), len(changed) + len(removed)
+
+
+class HistoryWriter:
+    """Collect a build's prices region by region, append them as one snapshot at the end.
+
+    Same add_region()/finalize() interface as vmdb.FrontierWriter. scope,
+    if given, says which series keys the build fetched at all; see
+    PriceHistory.encode().
+    """
+
+    def __init__(self, path, scope=None):
+        self.path = path
+        self.scope = scope
+        self.snapshot = {}
+        self.changes = 0
+
+    def add_region(self, region, records):
+        for rec in records:
+            self.snapshot[series_key(rec)] = rec["price"]
+
+    def finalize(self, timestamp):
+        """Append the snapshot taken at `timestamp`; returns the number of changed prices."""
+        history = PriceHistory(self.path, series=False)
+        if history.timestamps and timestamp < history.timestamps[-1]:
+            raise ValueError(f"{self.path} already has a snapshot newer than this build")
+        payload, self.changes = history.encode(self.snapshot, self.scope)
+        payload = zlib.compress(payload, 9)
+        mode = "r+b" if os.path.exists(self.path) else "wb"
+        with open(self.path, mode) as f:
+            if mode == "wb":
+                f.write(HISTORY_MAGIC)
+            # Drop a torn segment a crashed build may have left behind
+            f.seek(history.end)
+            f.truncate()
+            f.write(SEGMENT_HEADER.pack(timestamp, len(payload), zlib.crc32(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        return self.changes
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VM price history tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="Snapshots, series and size of a history file")
+    info.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        if not os.path.exists(args.path):
+            print(f"Error: {args.path} not found.")
+            sys.exit(1)
+        history = PriceHistory(args.path)
+        listed = len(history.current)
+        changes = sum(len(s) for s in history.series)
+        print(f"{args.path}: {os.path.getsize(args.path) / 1024:.1f} KB, {len(history.timestamps)} snapshots, "
+              f"{len(history.keys)} series ({listed} listed now), {changes} recorded changes")
+        if history.timestamps:
+            print(f"  from {format_time(history.timestamps[0])} to {format_time(history.timestamps[-1])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""Query the VM price database.
+
+With a SQLite database (builddb.py --format sqlite) every lookup is an index
+seek, and with the columnar format search() runs straight over the mapped
+columns. Any other format still works through a streaming scan over
+vmdb.iter_records, so callers don't have to care which one exists.
+
+Usage:
+    python3 scripts/vmquery.py search --min-vcpu 4 --min-ram 16 --max-price 0.2 \
+        [--region centralindia ...] [--family Standard_D ...] [--rank price_per_gb] [--limit 20] \
+        [--currency INR] [--subscription SUB_ID ...] [--tier reserved3y] [--os linux]
+    python3 scripts/vmquery.py budget 0.15 [--region centralindia] [--limit 20]
+    python3 scripts/vmquery.py sku Standard_E8as_v5 Standard_E16as_v5 [--region centralindia] [--tier all]
+    python3 scripts/vmquery.py shape --min-vcpu 4 --min-ram 16 [--max-price 0.2]
+    python3 scripts/vmquery.py best --min-ram 16 [--min-vcpu 4] [--region centralindia ...] [--currency INR]
+    python3 scripts/vmquery.py at Standard_D4as_v5 --when 2026-09-01 [--region centralindia] [--tier spot]
+    python3 scripts/vmquery.py window Standard_D4as_v5 --since 30d [--until 2026-10-01] [--tier spot]
+
+Databases built for several currencies should be queried with --currency
+(prices in different currencies are not comparable); without it, rows of
+every currency are ranked together. Prices are effective hourly costs in
+their pricing tier; the command line looks at on-demand prices unless
+--tier names another tier (or all of them). `at` and `window` answer from
+the price history builddb keeps next to the database (see vmhistory.py).
+"""
+import argparse
+import datetime
+import heapq
+import os
+import re
+import sys
+import time
+
+import vmdb
+import vmhistory
+
+DEFAULT_LIMIT = 20
+# Searched relative to the repo root, then the current directory
+DB_CANDIDATES = [
+    "data/vms.db", "data/vms.vmdb", "data/vms.json", "data/vms.ndjson",
+    "vms.db", "vms.vmdb", "vms.json", "vms.ndjson",
+]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS = ("region", "sku", "vcpu", "ram", "price")
+
+# Ranking keys for search(): all ascending, cheaper first
+RANKS = {
+    "price": lambda price, vcpu, ram: price,
+    "price_per_vcpu": lambda price, vcpu, ram: price / vcpu,
+    "price_per_gb": lambda price, vcpu, ram: price / ram,
+}
+RANK_SQL = {
+    "price": "price",
+    "price_per_vcpu": "price / vcpu",
+    "price_per_gb": "price / ram",
+}
+# Databases built since the ratios were precomputed have indexed columns for them
+RANK_COLUMNS = {"price_per_vcpu", "price_per_gb"}
+# Key columns whose missing value matches any constraint: reservations apply
+# to either OS. A missing currency or tier is vmdb.KEY_DEFAULTS; any other
+# missing key matches nothing.
+WILDCARD_KEYS = {"os"}
+
+
+def find_db(candidates=DB_CANDIDATES):
+    """Return the first existing database path, preferring indexed formats."""
+    for root in (REPO_ROOT, os.getcwd()):
+        for name in candidates:
+            path = os.path.join(root, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _where(clauses):
+    return (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+def _wanted_keys(currency=None, subscriptions=None, tier=None, os_type=None):
+    """{key column: allowed values} for the constraints that are set."""
+    wanted = {"currency": {currency.upper()} if currency else None,
+              "subscription": set(subscriptions) if subscriptions else None,
+              "tier": {tier} if tier else None,
+              "os": {os_type} if os_type else None}
+    return {name: values for name, values in wanted.items() if values}
+
+
+def _key_ok(name, value, wanted):
+    """Whether a record's key value (None or "" when not recorded) is allowed."""
+    if not value:
+        if name not in vmdb.KEY_DEFAULTS:
+            return name in WILDCARD_KEYS
+        value = vmdb.KEY_DEFAULTS[name]
+    return value in wanted
+
+
+def _key_clauses(conn, wanted):
+    """SQL for the key constraints, and the key columns to select."""
+    keys = vmdb.sqlite_key_columns(conn)
+    clauses, params = [], []
+    for name, values in wanted.items():
+        null_ok = _key_ok(name, None, values)
+        if name not in keys:
+            # Older databases: every row has the missing value
+            if not null_ok:
+                clauses.append("0")
+            continue
+        clause = f"{name} IN ({', '.join('?' * len(values))})"
+        clauses.append(f"({clause} OR {name} IS NULL)" if null_ok else clause)
+        params.extend(sorted(values))
+    return clauses, params, keys
+
+
+def _row(columns, row):
+    return {name: value for name, value in zip(columns, row) if value is not None}
+
+
+def _sqlite_query(path, clauses, params, wanted):
+    conn = vmdb.connect_sqlite(path)
+    try:
+        key_clauses, key_params, keys = _key_clauses(conn, wanted)
+        columns = COLUMNS + tuple(keys)
+        sql = f"SELECT {', '.join(columns)} FROM vms{_where(clauses + key_clauses)} ORDER BY price"
+        return [_row(columns, row) for row in conn.execute(sql, params + key_params)]
+    finally:
+        conn.close()
+
+
+def _scan(path, keep):
+    return sorted((rec for rec in vmdb.iter_records(path) if keep(rec)), key=lambda rec: rec["price"])
+
+
+def _key_matcher(wanted):
+    """Record predicate for the key constraints, or None for no constraint."""
+    if not wanted:
+        return None
+    return lambda rec: all(_key_ok(name, rec.get(name), values) for name, values in wanted.items())
+
+
+def search(path, min_vcpu=0, min_ram=0, max_price=None, regions=None, families=None,
+           rank="price", limit=DEFAULT_LIMIT, currency=None, subscriptions=None, tier=None, os_type=None):
+    """Top-k records matching every constraint, ordered by a ranking key.
+
+    regions is a list of region names and families a list of SKU name
+    prefixes (e.g. Standard_D); either may be empty for no constraint. Ties
+    on the ranking key go to the cheaper, then the bigger (more vCPU) VM.
+    currency (e.g. INR), subscriptions (a list of IDs), tier (see
+    vmdb.TIERS) and os_type (linux or windows) restrict the search to those
+    keys; prices are effective hourly costs, so within one tier this ranks
+    SKUs by what they really cost per hour.
+    """
+    if rank not in RANKS:
+        raise ValueError(f"Unknown rank {rank!r}, expected one of {', '.join(RANKS)}")
+    regions = list(regions or [])
+    families = tuple(families or ())
+    wanted = _wanted_keys(currency, subscriptions, tier, os_type)
+    if vmdb.is_sqlite(path):
+        return _search_sqlite(path, min_vcpu, min_ram, max_price, regions, families, rank, limit, wanted)
+    if vmdb.is_columnar(path):
+        with vmdb.ColumnarDB(path) as db:
+            return _search_columnar(db, min_vcpu, min_ram, max_price, regions, families, rank, limit, wanted)
+
+    key = RANKS[rank]
+    wanted_regions = set(regions)
+    key_ok = _key_matcher(wanted)
+    rows = (
+        (key(rec["price"], rec["vcpu"], rec["ram"]), rec["price"], -rec["vcpu"], i, rec)
+        for i, rec in enumerate(vmdb.iter_records(path))
+        if rec["vcpu"] >= min_vcpu and rec["ram"] >= min_ram
+        and (max_price is None or rec["price"] <= max_price)
+        and (not wanted_regions or rec["region"] in wanted_regions)
+        and (not families or rec["sku"].startswith(families))
+        and (key_ok is None or key_ok(rec))
+    )
+    return [row[-1] for row in heapq.nsmallest(limit, rows)]
+
+
+def _search_sqlite(path, min_vcpu, min_ram, max_price, regions, families, rank, limit, wanted):
+    # Only emit real constraints so the planner can pick the price index
+    clauses, params = [], []
+    if min_vcpu:
+        clauses.append("vcpu >= ?")
+        params.append(min_vcpu)
+    if min_ram:
+        clauses.append("ram >= ?")
+        params.append(min_ram)
+    if max_price is not None:
+        clauses.append("price <= ?")
+        params.append(max_price)
+    if regions:
+        clauses.append(f"region IN ({', '.join('?' * len(regions))})")
+        params.extend(regions)
+    if families:
+        # Prefix match as a range on the sku index (LIKE would treat '_' as a wildcard)
+        clauses.append("(" + " OR ".join("(sku >= ? AND sku < ?)" for _ in families) + ")")
+        for prefix in families:
+            params.extend([prefix, prefix + "\uffff"])
+    conn = vmdb.connect_sqlite(path)
+    try:
+        key_clauses, key_params, keys = _key_clauses(conn, wanted)
+        clauses += key_clauses
+        params += key_params + [limit]
+        order = RANK_SQL[rank]
+        if rank in RANK_COLUMNS:
+            names = {row[1] for row in conn.execute("PRAGMA table_info(vms)")}
+            if rank in names:
+                order = rank
+        columns = COLUMNS + tuple(keys)
+        sql = (f"SELECT {', '.join(columns)} FROM vms{_where(clauses)} "
+               f"ORDER BY {order}, price, vcpu DESC LIMIT ?")
+        return [_row(columns, row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def _search_columnar(db, min_vcpu, min_ram, max_price, regions, families, rank, limit, wanted):
+    # Resolve region/family constraints once per interned string, not per record
+    region_ok = None
+    if regions:
+        wanted_regions = set(regions)
+        region_ok = [name in wanted_regions for name in db.regions]
+    sku_ok = None
+    if families:
+        sku_ok = [name.startswith(families) for name in db.skus]
+    # Key constraints as (index column, allowed-per-string) pairs
+    key_ok = []
+    for name, values in wanted.items():
+        if name not in db.keys:
+            if _key_ok(name, None, values):
+                continue
+            return []
+        strings, column = db.keys[name]
+        key_ok.append((column, [_key_ok(name, value, values) for value in strings]))
+    if max_price is None:
+        max_price = float("inf")
+    by_price = rank == "price"
+    per_vcpu = rank == "price_per_vcpu"
+
+    # Max-heap of the k best (negated keys); `worst` is the key to beat once full
+    heap = []
+    worst = float("inf")
+    for i, (r, s, vcpu, ram, price) in enumerate(
+            zip(db.region_idx, db.sku_idx, db.vcpu, db.ram, db.price)):
+        if price > max_price:
+            if db.price_sorted:
+                break
+            continue
+        if vcpu < min_vcpu or ram < min_ram:
+            continue
+        if region_ok is not None and not region_ok[r]:
+            continue
+        if sku_ok is not None and not sku_ok[s]:
+            continue
+        if key_ok and not all(allowed[column[i]] for column, allowed in key_ok):
+            continue
+        key = price if by_price else price / (vcpu if per_vcpu else ram)
+        if key > worst:
+            if by_price and db.price_sorted:
+                break
+            continue
+        entry = (-key, -price, vcpu, -i)
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            continue
+        if len(heap) == limit:
+            worst = -heap[0][0]
+    heap.sort(reverse=True)
+    return [db.record(-entry[3]) for entry in heap]
+
+
+def under_budget(path, max_price, region=None, limit=DEFAULT_LIMIT, currency=None, subscriptions=None, tier=None,
+                 os_type=None):
+    """Cheapest records at or under max_price, optionally in one region."""
+    return search(path, max_price=max_price, regions=[region] if region else None, limit=limit,
+                  currency=currency, subscriptions=subscriptions, tier=tier, os_type=os_type)
+
+
+def lookup_skus(path, skus, region=None, currency=None, subscriptions=None, tier=None, os_type=None):
+    """All records for the given SKU names, optionally in one region."""
+    skus = list(skus)
+    wanted_keys = _wanted_keys(currency, subscriptions, tier, os_type)
+    if vmdb.is_sqlite(path):
+        clauses = [f"sku IN ({', '.join('?' * len(skus))})"]
+        params = list(skus)
+        if region:
+            clauses.append("region = ?")
+            params.append(region)
+        return _sqlite_query(path, clauses, params, wanted_keys)
+    wanted = set(skus)
+    key_ok = _key_matcher(wanted_keys)
+    return _scan(path, lambda rec: rec["sku"] in wanted
+                 and (not region or rec["region"] == region)
+                 and (key_ok is None or key_ok(rec)))
+
+
+def by_shape(path, min_vcpu=0, min_ram=0, max_price=None, region=None, limit=DEFAULT_LIMIT, currency=None,
+             subscriptions=None, tier=None, os_type=None):
+    """Cheapest records with at least min_vcpu vCPUs and min_ram GB."""
+    return search(path, min_vcpu, min_ram, max_price, [region] if region else None, limit=limit,
+                  currency=currency, subscriptions=subscriptions, tier=tier, os_type=os_type)
+
+
+def best_for(path, min_vcpu=0, min_ram=0, regions=None, currency=None, tier=None):
+    """Cheapest VM per region with at least min_vcpu vCPUs and min_ram GB.
+
+    Answered from the Pareto frontier sidecar: the cheapest VM meeting a
+    minimum shape is never dominated, so it is always on the frontier. Falls
+    back to a full search when the database has no sidecar yet. Prices are
+    compared within one currency and tier (default vmdb.DEFAULT_CURRENCY,
+    vmdb.DEFAULT_TIER).
+    """
+    wanted = set(regions or [])
+    currency = (currency or vmdb.DEFAULT_CURRENCY).upper()
+    tier = tier or vmdb.DEFAULT_TIER
+    sidecar = vmdb.frontier_path(path)
+    if not os.path.exists(sidecar):
+        rows = search(path, min_vcpu, min_ram, regions=regions, limit=sys.maxsize, currency=currency, tier=tier)
+        best = {}
+        for rec in rows:
+            if rec["price"] > 0:
+                best.setdefault(rec["region"], rec)
+        return sorted(best.values(), key=lambda rec: (rec["price"], -rec["vcpu"]))
+
+    rows = []
+    for region, frontier in vmdb.load_frontier(sidecar, currency, tier).items():
+        if wanted and region not in wanted:
+            continue
+        # Frontier entries are cheapest first, so the first fit is the answer
+        for rec in frontier:
+            if rec["vcpu"] >= min_vcpu and rec["ram"] >= min_ram:
+                rows.append(rec)
+                break
+    rows.sort(key=lambda rec: (rec["price"], -rec["vcpu"]))
+    return rows
+
+
+def _history_rows(path, region, sku, tier, os_type, currency):
+    history = vmhistory.PriceHistory(vmhistory.history_path(path))
+    for key_id in history.find(region, sku, tier, os_type, currency):
+        region_name, sku_name, tier_name, os_name, currency_code = history.keys[key_id]
+        rec = {"region": region_name, "sku": sku_name, "tier": tier_name, "currency": currency_code}
+        if os_name:
+            rec["os"] = os_name
+        yield history, key_id, rec
+
+
+def price_at(path, when=None, region=None, sku=None, tier=None, os_type=None, currency=None):
+    """Prices as of `when` (Unix time, default now) from the database's history, cheapest first.
+
+    One row per (region, sku, tier, os, currency) series that was listed then.
+    """
+    when = time.time() if when is None else when
+    rows = []
+    for history, key_id, rec in _history_rows(path, region, sku, tier, os_type, currency):
+        price = history.price_at(key_id, when)
+        if price is not None:
+            rows.append(dict(rec, price=price))
+    rows.sort(key=lambda rec: rec["price"])
+    return rows
+
+
+def price_window(path, start, end=None, region=None, sku=None, tier=None, os_type=None, currency=None):
+    """Min/max of each series' price between start and end (Unix times, end default now).
+
+    Rows carry min_price, max_price, price (the last one, None if delisted)
+    and changes, the number of price changes inside the window; the widest
+    relative swings come first.
+    """
+    end = time.time() if end is None else end
+    rows = []
+    for history, key_id, rec in _history_rows(path, region, sku, tier, os_type, currency):
+        window = history.window(key_id, start, end)
+        if window is None:
+            continue
+        low, high, last, changes = window
+        rows.append(dict(rec, min_price=low, max_price=high, price=last, changes=changes))
+    rows.sort(key=lambda rec: (-(rec["max_price"] - rec["min_price"]) / rec["max_price"] if rec["max_price"] else 0,
+                               rec["min_price"]))
+    return rows
+
+
+def parse_time(text):
+    """Unix time from "2026-09-01", "2026-09-01T12:00", "30d" / "12h" ago, or seconds since the epoch."""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([dh])", text)
+    if m:
+        return time.time() - float(m.group(1)) * (86400 if m.group(2) == "d" else 3600)
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def format_price(amount, currency, digits=None):
+    """$0.096 for USD, 7.99 INR otherwise."""
+    text = f"{amount:.{digits}f}" if digits is not None else f"{amount}"
+    return f"${text}" if currency == vmdb.DEFAULT_CURRENCY else f"{text} {currency}"
+
+
+def print_history(rows):
+    for rec in rows:
+        currency = rec["currency"]
+        line = f"{rec['region']:<20} | {rec['sku']:<28} | {rec['tier']:<11} {rec.get('os', 'any OS'):<7} | "
+        if "min_price" not in rec:
+            print(line + f"{format_price(rec['price'], currency)}/hr")
+            continue
+        last = format_price(rec["price"], currency) if rec["price"] is not None else "delisted"
+        print(line + f"{format_price(rec['min_price'], currency)} - {format_price(rec['max_price'], currency)}/hr"
+                     f" | last {last} | {rec['changes']} change{'s' * (rec['changes'] != 1)}")
+
+
+def print_rows(rows, rank="price"):
+    # Only name subscriptions, tiers and OSes when the results actually span several
+    show_subs = len({rec.get("subscription") for rec in rows}) > 1
+    show_tier = len({vmdb.record_tier(rec) for rec in rows}) > 1
+    show_os = len({rec.get("os") for rec in rows}) > 1
+    for rec in rows:
+        currency = vmdb.record_currency(rec)
+        line = (f"{rec['region']:<20} | {rec['sku']:<28} | {rec['vcpu']:>5g} vCPU | "
+                f"{rec['ram']:>7g} GB | {format_price(rec['price'], currency)}/hr")
+        if rank == "price_per_vcpu":
+            line += f" | {format_price(rec['price'] / rec['vcpu'], currency, 5)}/vCPU"
+        elif rank == "price_per_gb":
+            line += f" | {format_price(rec['price'] / rec['ram'], currency, 5)}/GB"
+        if show_tier or show_os:
+            labels = ([vmdb.record_tier(rec)] if show_tier else []) + ([rec.get("os") or "any OS"] if show_os else [])
+            line += f" | {' '.join(labels)}"
+        if show_subs:
+            line += f" | sub {rec.get('subscription') or '?'}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the VM price database.")
+    parser.add_argument("--db", default=None, help="Database file (default: first of data/vms.{db,vmdb,json,ndjson})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    srch = sub.add_parser("search", help="Top-k VMs under constraints, ranked by price or price efficiency")
+    srch.add_argument("--min-vcpu", type=float, default=0)
+    srch.add_argument("--min-ram", type=float, default=0, help="GB")
+    srch.add_argument("--max-price", type=float, help="Hourly price")
+    srch.add_argument("--region", dest="regions", action="append", default=[], help="Repeatable")
+    srch.add_argument("--family", dest="families", action="append", default=[], metavar="PREFIX",
+                      help="SKU name prefix, e.g. Standard_D4 (repeatable)")
+    srch.add_argument("--rank", choices=list(RANKS), default="price")
+    srch.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    srch.add_argument("--subscription", dest="subscriptions", action="append", default=[], help="Repeatable")
+
+    budget = sub.add_parser("budget", help="Cheapest VMs under a max hourly price")
+    budget.add_argument("max_price", type=float)
+    budget.add_argument("--region")
+    budget.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    budget.add_argument("--subscription", dest="subscriptions", action="append", default=[], help="Repeatable")
+
+    sku = sub.add_parser("sku", help="Prices for specific SKUs")
+    sku.add_argument("skus", nargs="+")
+    sku.add_argument("--region")
+    sku.add_argument("--subscription", dest="subscriptions", action="append", default=[], help="Repeatable")
+
+    shape = sub.add_parser("shape", help="Cheapest VMs with at least N vCPU / GB RAM")
+    shape.add_argument("--min-vcpu", type=float, default=0)
+    shape.add_argument("--min-ram", type=float, default=0)
+    shape.add_argument("--max-price", type=float)
+    shape.add_argument("--region")
+    shape.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    shape.add_argument("--subscription", dest="subscriptions", action="append", default=[], help="Repeatable")
+
+    best = sub.add_parser("best", help="Cheapest VM per region for a minimum shape (Pareto frontier)")
+    best.add_argument("--min-vcpu", type=float, default=0)
+    best.add_argument("--min-ram", type=float, default=0, help="GB")
+    best.add_argument("--region", dest="regions", action="append", default=[], help="Repeatable")
+    best.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+
+    at = sub.add_parser("at", help="Prices at a point in time, from the price history")
+    at.add_argument("skus", nargs="*", help="SKU names (default: all)")
+    at.add_argument("--when", type=parse_time, help="2026-09-01, 2026-09-01T12:00 or 3d (ago); default now")
+    at.add_argument("--region")
+    at.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+
+    window = sub.add_parser("window", help="Min/max prices over a time window, from the price history")
+    window.add_argument("skus", nargs="*", help="SKU names (default: all)")
+    window.add_argument("--since", type=parse_time, default="30d", help="Window start (default 30d ago)")
+    window.add_argument("--until", type=parse_time, help="Window end (default now)")
+    window.add_argument("--region")
+    window.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+
+    for subparser in (srch, budget, sku, shape, best, at, window):
+        subparser.add_argument("--currency", help="Only prices in this currency, e.g. INR")
+        subparser.add_argument("--tier", choices=vmdb.TIERS + ("all",), default=vmdb.DEFAULT_TIER,
+                               help=f"Pricing tier to compare (default {vmdb.DEFAULT_TIER}; all: every tier)")
+    for subparser in (srch, budget, sku, shape, at, window):
+        subparser.add_argument("--os", dest="os_type", choices=["linux", "windows"],
+                               help="Only Linux or Windows prices (reservations cover either)")
+
+    args = parser.parse_args(argv)
+    path = args.db or find_db()
+    if not path or not os.path.exists(path):
+        print("Error: no VM database found. Run scripts/builddb.py first!")
+        sys.exit(1)
+
+    rank = "price"
+    tier = None if args.tier == "all" else args.tier
+    if args.command == "search":
+        rank = args.rank
+        rows = search(path, args.min_vcpu, args.min_ram, args.max_price, args.regions,
+                      args.families, rank, args.limit, args.currency, args.subscriptions, tier, args.os_type)
+    elif args.command == "budget":
+        rows = under_budget(path, args.max_price, args.region, args.limit, args.currency, args.subscriptions,
+                            tier, args.os_type)
+    elif args.command == "sku":
+        rows = lookup_skus(path, args.skus, args.region, args.currency, args.subscriptions, tier, args.os_type)
+    elif args.command in ("at", "window"):
+        if not os.path.exists(vmhistory.history_path(path)):
+            print(f"Error: no price history next to {path}. It is written by builddb.py runs.")
+            sys.exit(1)
+        rows = []
+        for name in args.skus or [None]:
+            if args.command == "at":
+                rows += price_at(path, args.when, args.region, name, tier, args.os_type, args.currency)
+            else:
+                rows += price_window(path, args.since, args.until, args.region, name, tier, args.os_type,
+                                     args.currency)
+        print_history(rows[:args.limit])
+        return
+    elif args.command == "best":
+        if tier is None:
+            parser.error("best compares prices within one tier; pick one with --tier")
+        rows = best_for(path, args.min_vcpu, args.min_ram, args.regions, args.currency, tier)[:args.limit]
+    else:
+        rows = by_shape(path, args.min_vcpu, args.min_ram, args.max_price, args.region, args.limit,
+                        args.currency, args.subscriptions, tier, args.os_type)
+    print_rows(rows, rank)
+
+
+if __name__ == "__main__":
+    main()
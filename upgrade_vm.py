@@ -1,5 +1,8 @@
-import json, urllib.parse, time, subprocess, os
-from urllib import request, error
+import json, os, sys
+from urllib import request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+import aztoken
 
 # ============= CONFIGURATION =============
 CLIENT_ID = os.environ.get("ARM_CLIENT_ID", "")
@@ -37,8 +40,7 @@ TEMPLATE = {
 def run():
     # 1. Get Token
     print("🔑 Authenticating as Service Principal...")
-    auth_data = urllib.parse.urlencode({"grant_type": "client_credentials", "client_id": CLIENT_ID, "client_secret": CLIENT_SECRET, "scope": "https://management.azure.com/.default"}).encode()
-    token = json.loads(request.urlopen(request.Request(f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token", data=auth_data)).read())["access_token"]
+    token = aztoken.sp_token(CLIENT_ID, CLIENT_SECRET, TENANT_ID)
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
     # 2. Create Resource Group